@@ -0,0 +1,144 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Benchmark decoding the DNS records of very large zones
+
+A synthetic get_dns_settings response is decoded once through zeep (as
+get_dns_records does) and once with the streaming decoder behind
+iter_dns_records. Each scenario runs in a new interpreter that reports the
+increase of its peak resident memory (Linux only) and the wall time, printed
+as JSON.
+
+The response is built with kasserver.emulator. The KAS WSDL imports the SOAP
+encoding schema, the emulator's minimal replacement is put into zeep's cache
+so that the benchmark runs offline."""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from kasserver import emulator
+from kasserver.emulator import ENCODING_SCHEMA, ENCODING_URL
+
+SETUP = {
+    "zeep": f"""
+import zeep, zeep.cache, kasserver
+cache = zeep.cache.InMemoryCache()
+cache.add({ENCODING_URL!r}, {ENCODING_SCHEMA!r}.encode())
+client = zeep.Client(kasserver.WSDL_FILE, transport=zeep.Transport(cache=cache))
+binding = client.service._binding
+operation = binding.get("KasApi")
+
+class Response:
+    status_code = 200
+    headers = {{"Content-Type": "text/xml; charset=utf-8"}}
+    encoding = "utf-8"
+    content = content
+
+def run():
+    res = binding.process_reply(client, operation, Response)
+    records = kasserver.KasServerBase._parse_records(res)
+    return len([record.as_dict() for record in records])
+""",
+    "stream": """
+import kasserver
+from lxml import etree
+
+def run():
+    return sum(1 for _ in kasserver._RecordDecoder(content))
+""",
+}
+
+MEASURE = """
+import sys, time
+with open(sys.argv[1], "rb") as file:
+    content = file.read()
+{setup}
+def status(field):
+    with open("/proc/self/status", encoding="utf-8") as file:
+        fields = dict(line.split(":", 1) for line in file)
+    return int(fields[field].split()[0])
+
+before = status("VmRSS")
+# Reset the peak resident memory (VmHWM) to the current value
+with open("/proc/self/clear_refs", "w", encoding="utf-8") as file:
+    file.write("5")
+start = time.perf_counter()
+count = run()
+elapsed = time.perf_counter() - start
+print(count, elapsed, (status("VmHWM") - before) / 1024)
+"""
+
+
+def response(count):
+    """Build a get_dns_settings response with count A records"""
+    records = [
+        {
+            "record_zone": "example.com",
+            "record_name": f"host{i}",
+            "record_type": "A",
+            "record_data": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "record_aux": 0,
+            "record_id": str(i + 1),
+            "record_changeable": "Y",
+        }
+        for i in range(count)
+    ]
+    return emulator.response(
+        "get_dns_settings", {"zone_host": "example.com."}, records, 0.5
+    )
+
+
+def measure(scenario, path):
+    """Run a scenario in a new interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(setup=SETUP[scenario]), path],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    count, elapsed, memory = result.stdout.split()
+    return {"records": int(count), "seconds": float(elapsed), "peak_mb": float(memory)}
+
+
+def main():
+    """Run the record decoding benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=50000, help="zone size")
+    args = parser.parse_args()
+    with tempfile.NamedTemporaryFile(suffix=".xml", delete=False) as file:
+        file.write(response(args.records))
+    try:
+        results = {
+            "response_mb": os.path.getsize(file.name) / 1024 / 1024,
+            **{scenario: measure(scenario, file.name) for scenario in SETUP},
+        }
+    finally:
+        os.unlink(file.name)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Benchmark the start up time of the command line utilities
+
+Every ACME hook invocation starts a new interpreter, so the time until the
+command line utilities are ready matters. Each measurement runs in a fresh
+interpreter and the median wall time is printed as JSON."""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+SCENARIOS = {
+    "python": "pass",
+    "import kasserver-dns": "import kasserver.kasserver_dns",
+    "import kasserver-dns-certbot": "import kasserver.kasserver_dns_certbot",
+    "import kasserver-dns-lego": "import kasserver.kasserver_dns_lego",
+    "kasserver-dns --version": (
+        "from kasserver.kasserver_dns import cli\n"
+        "try:\n"
+        "    cli(['--version'])\n"
+        "except SystemExit:\n"
+        "    pass"
+    ),
+    "import zeep": "import zeep",
+}
+
+
+def measure(code, runs):
+    """Get the median wall time in seconds of running code in a new interpreter"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    """Run the start up benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10, help="runs per scenario")
+    args = parser.parse_args()
+    results = {name: measure(code, args.runs) for name, code in SCENARIOS.items()}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
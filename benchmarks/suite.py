@@ -0,0 +1,236 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Benchmark typical workflows against the local KAS API emulator
+
+Every scenario runs against a fresh kasserver.emulator.KasEmulator with the
+configured latency and flood delay and reports the number of API round trips
+and the wall time. Results are printed (or written with --output) as JSON.
+With --baseline the results are compared to an earlier run and the exit
+status is 1 if a scenario needs more round trips or takes more than
+--tolerance longer."""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import kasserver
+from kasserver import emulator, kasserver_dns_certbot, kasserver_dns_lego
+
+DOMAINS = ["example.com", "*.example.com"]
+
+
+def _hook(cli, args=(), env=None):
+    """Run a command line utility in-process like a hook invocation
+
+    Returns the output of the hook."""
+    output = io.StringIO()
+    with _environ(env or {}), contextlib.redirect_stdout(output):
+        cli.main(args=list(args), standalone_mode=False)
+    return output.getvalue()
+
+
+@contextlib.contextmanager
+def _environ(env):
+    previous = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def certbot(_emulator):
+    """Authentication and cleanup hooks of a certificate with two domains"""
+    outputs = {}
+    for hook in ("auth", "cleanup"):
+        for remaining, domain in reversed(list(enumerate(DOMAINS))):
+            env = {
+                "CERTBOT_DOMAIN": domain.removeprefix("*."),
+                "CERTBOT_VALIDATION": f"token-{domain}",
+                "CERTBOT_REMAINING_CHALLENGES": str(remaining),
+                "CERTBOT_ALL_DOMAINS": ",".join(DOMAINS),
+            }
+            if hook == "cleanup":
+                env["CERTBOT_AUTH_OUTPUT"] = outputs[domain]
+            outputs[domain] = _hook(kasserver_dns_certbot.cli, env=env)
+
+
+def lego(_emulator):
+    """present and cleanup hooks of a certificate with two domains"""
+    for command in ("present", "cleanup"):
+        for domain in DOMAINS:
+            fqdn = f"_acme-challenge.{domain.removeprefix('*.')}."
+            _hook(kasserver_dns_lego.cli, [command, fqdn, f"token-{domain}"])
+
+
+def bulk_add(_emulator, count=100):
+    """Add records with KasServer.apply"""
+    changes = [
+        kasserver.DnsChange("add", f"host{i}.example.com", "A", f"10.0.0.{i % 256}")
+        for i in range(count)
+    ]
+    result = kasserver.KasServer().apply(changes)
+    assert not any(item["error"] for item in result["results"])
+
+
+def listing(size, streamed):
+    """List a zone with size records (streamed or as complete list)"""
+
+    def run(_emulator):
+        kas = kasserver.KasServer()
+        zone = f"zone{size}.com"
+        if streamed:
+            count = sum(1 for _ in kas.iter_dns_records(zone))
+        else:
+            count = len(kas.get_dns_records(zone))
+        assert count == size
+
+    run.__doc__ = f"List {size} records ({'streamed' if streamed else 'list'})"
+    run.zone = (f"zone{size}.com", size)
+    return run
+
+
+def scenarios(sizes):
+    """Get the benchmark scenarios by name"""
+    result = {"certbot": certbot, "lego": lego, "bulk-add": bulk_add}
+    for size in sizes:
+        result[f"list-{size}"] = listing(size, streamed=True)
+        result[f"get-{size}"] = listing(size, streamed=False)
+    return result
+
+
+def measure(scenario, args):
+    """Run a scenario against a fresh emulator"""
+    zones = {"example.com": [{"name": "", "type": "A", "data": "192.0.2.1"}]}
+    if hasattr(scenario, "zone"):
+        zone, size = scenario.zone
+        zones[zone] = [
+            {
+                "name": f"host{i}",
+                "type": "A",
+                "data": f"10.0.{i // 256 % 256}.{i % 256}",
+            }
+            for i in range(size)
+        ]
+    with emulator.KasEmulator(
+        zones,
+        latency=args.latency,
+        flood_delay=args.flood_delay,
+        username="benchmark",
+        password="benchmark",
+    ) as emu:
+        with _environ({"KASSERVER_ENDPOINT": emu.endpoint}):
+            start = time.perf_counter()
+            scenario(emu)
+            elapsed = time.perf_counter() - start
+    return {
+        "round_trips": sum(emu.requests.values()),
+        "faults": sum(emu.faults.values()),
+        "seconds": round(elapsed, 4),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Get the regressions of results compared to baseline"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result["round_trips"] > before["round_trips"]:
+            regressions.append(
+                f"{name}: {result['round_trips']} round trips "
+                f"(was {before['round_trips']})"
+            )
+        if result["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['seconds']:.3f}s (was {before['seconds']:.3f}s)"
+            )
+    return regressions
+
+
+def main():
+    """Run the benchmark suite"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds")
+    parser.add_argument("--flood-delay", type=float, default=0.1, help="seconds")
+    parser.add_argument(
+        "--sizes", default="10,1000,50000", help="comma separated zone sizes"
+    )
+    parser.add_argument("--only", nargs="*", help="names of the scenarios to run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed relative slowdown"
+    )
+    args = parser.parse_args()
+    # Keep the log messages of the hooks out of the results
+    logging.basicConfig(level=logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    selected = {
+        name: scenario
+        for name, scenario in scenarios(sizes).items()
+        if not args.only or name in args.only
+    }
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        _environ(
+            {
+                "XDG_CACHE_HOME": directory,
+                "KASSERVER_USER": "benchmark",
+                "KASSERVER_PASSWORD": "benchmark",
+                "KASSERVER_SOCKET": os.path.join(directory, "kasserver.sock"),
+            }
+        ),
+    ):
+        emulator.prime_schema_cache()
+        results = {name: measure(scenario, args) for name, scenario in selected.items()}
+    output = {
+        "config": {"latency": args.latency, "flood_delay": args.flood_delay},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(output, file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,42 +21,547 @@
 
 """Manage domains hosted on All-Inkl.com through the KAS server API"""
 
+import collections
+import contextlib
+import fcntl
+import io
+import itertools
 import json
 import logging
 import math
 import netrc
 import os
+import re
+import sys
+import threading
 import time
-import importlib.metadata
+import importlib.util
 
-import zeep
-import zeep.helpers
+from kasserver import metrics, retry, zonefile, zones
 
-__version__ = importlib.metadata.version("kasserver")
+# pylint: disable=too-many-lines
 
 LOGGER = logging.getLogger(__name__)
 
+WSDL_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "KasApi.wsdl")
+AUTH_WSDL_FILE = os.path.join(os.path.dirname(WSDL_FILE), "KasAuth.wsdl")
 
-class KasServer:
-    """Manage domains hosted on All-Inkl.com through the KAS server API"""
+
+def _lazy_import(name):
+    """Import a module on first attribute access
+
+    zeep (and lxml) take a large part of the start up time of the command line
+    utilities, so they are only loaded once a client is created."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+zeep = _lazy_import("zeep")
+sqlite3 = _lazy_import("sqlite3")
+
+
+def __getattr__(name):
+    if name == "__version__":
+        from importlib import metadata  # pylint: disable=import-outside-toplevel
+
+        return metadata.version("kasserver")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+DnsChange = collections.namedtuple(
+    "DnsChange",
+    ["action", "fqdn", "record_type", "record_data", "record_aux"],
+    defaults=[None, None],
+)
+DnsChange.__doc__ = """A single change for KasServer.apply
+
+`action` is either "add" (add or update the record of fqdn and record_type)
+or "delete" (remove the record of fqdn and record_type)."""
+
+
+class DnsRecord:
+    """A single DNS record of a zone"""
+
+    __slots__ = ("id", "zone", "name", "type", "data", "aux", "changeable")
+
+    # Fields of the records in get_dns_settings responses
+    KAS_FIELDS = {f"record_{field}": field for field in __slots__}
+
+    def __init__(self, **fields):
+        fields.setdefault("changeable", "Y")
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_items(cls, items):
+        """Create a record from the key/value items of the KAS API"""
+        fields = cls.KAS_FIELDS
+        return cls(
+            **{fields[i["key"]]: i["value"] for i in items if i["key"] in fields}
+        )
+
+    def as_dict(self):
+        """Get the record as dict"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return f"DnsRecord({self.as_dict()!r})"
+
+
+class _RecordDecoder:
+    """Incremental decoder of the records in a raw get_dns_settings response
+
+    The response is parsed up to the first record when the decoder is
+    created, so that faults and the flood delay are known right away. The
+    remaining records are decoded while iterating and their XML elements are
+    freed again, so only one record is held in memory at a time."""
+
+    # pylint: disable=too-few-public-methods
+
+    XSI_TYPE = "{http://www.w3.org/2001/XMLSchema-instance}type"
+    FAULT = "{http://schemas.xmlsoap.org/soap/envelope/}Fault"
+
+    def __init__(self, content):
+        self.flood_delay = 0
+        self._records = self._decode(content)
+        self._first = next(self._records, None)
+
+    def __iter__(self):
+        if self._first is not None:
+            yield self._first
+            yield from self._records
+
+    @classmethod
+    def _value(cls, element):
+        if element is None or element.text is None:
+            return None
+        value_type = element.get(cls.XSI_TYPE, "")
+        if value_type.endswith(":int"):
+            return int(element.text)
+        if value_type.endswith(":float"):
+            return float(element.text)
+        return element.text
+
+    def _decode(self, content):
+        from lxml import etree  # pylint: disable=import-outside-toplevel
+
+        fields = DnsRecord.KAS_FIELDS
+        key, record = None, {}
+        for _, element in etree.iterparse(
+            io.BytesIO(content), tag=("key", "value", "item", self.FAULT)
+        ):
+            if element.tag == "key":
+                key = element.text
+            elif element.tag == "value":
+                if key in fields:
+                    record[fields[key]] = self._value(element)
+                elif key == "KasFloodDelay":
+                    self.flood_delay = self._value(element)
+            elif element.tag == "item":
+                if record and element[0].tag == "item":
+                    # End of the key/value map of a record
+                    yield DnsRecord(**record)
+                    record = {}
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+            else:
+                raise zeep.exceptions.Fault(
+                    element.findtext("faultstring"),
+                    code=element.findtext("faultcode"),
+                    detail=element.find("detail"),
+                )
+
+
+class RecordSet:
+    """DNS records of a zone indexed by id and by name and type
+
+    Several records can share a name and type (e.g. the TXT records of the
+    ACME challenges for a domain and its wildcard). Iterating yields the
+    records in their original order. The name of the zone apex is empty
+    (the KAS API also returns it as None)."""
+
+    __slots__ = ("_records", "_by_id", "_by_key")
+
+    def __init__(self, records=()):
+        self._records = {}
+        self._by_id = {}
+        self._by_key = collections.defaultdict(list)
+        for record in records:
+            self.add(record)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    @staticmethod
+    def _key(record):
+        return (record.name or "", record.type)
+
+    def add(self, record):
+        """Add a record"""
+        self._records[record] = None
+        self._by_id[record.id] = record
+        self._by_key[self._key(record)].append(record)
+
+    def remove(self, record):
+        """Remove a record"""
+        del self._records[record]
+        if self._by_id.get(record.id) is record:
+            del self._by_id[record.id]
+        self._by_key[self._key(record)].remove(record)
+
+    def update(self, record, **fields):
+        """Change fields of a record, keeping its position"""
+        self._by_key[self._key(record)].remove(record)
+        for field, value in fields.items():
+            setattr(record, field, value)
+        self._by_key[self._key(record)].append(record)
+
+    def get(self, record_id):
+        """Get the record with an id or None"""
+        return self._by_id.get(record_id)
+
+    def find(self, name, record_type, data=None):
+        """Get the records with name and type (and data if given)"""
+        records = self._by_key.get((name or "", record_type), [])
+        if data is None:
+            return list(records)
+        return [record for record in records if record.data == data]
+
+
+class ZoneCache:
+    """Size bounded cache of DNS zone snapshots with a time to live
+
+    Snapshots are evicted in least recently used order once more than
+    `max_zones` zones are cached and are considered stale `ttl` seconds after
+    they have been fetched."""
+
+    def __init__(self, ttl=60, max_zones=32):
+        self.ttl = ttl
+        self.max_zones = max_zones
+        self._zones = collections.OrderedDict()
+
+    def get(self, zone_name):
+        """Get the cached records of a zone or None if missing or stale"""
+        entry = self._zones.get(zone_name)
+        if entry is None:
+            return None
+        fetched, records = entry
+        if time.monotonic() - fetched > self.ttl:
+            del self._zones[zone_name]
+            return None
+        self._zones.move_to_end(zone_name)
+        return records
+
+    def put(self, zone_name, records):
+        """Store a freshly fetched snapshot of a zone"""
+        self._zones[zone_name] = (time.monotonic(), records)
+        self._zones.move_to_end(zone_name)
+        while len(self._zones) > self.max_zones:
+            self._zones.popitem(last=False)
+
+    def invalidate(self, zone_name=None):
+        """Drop a single zone or (without zone_name) all zones"""
+        if zone_name is None:
+            self._zones.clear()
+        else:
+            self._zones.pop(zone_name, None)
+
+
+# Machine of the KAS API credentials in ~/.netrc
+NETRC_MACHINE = "kasapi.kasserver.com"
+
+# Parsed ~/.netrc by modification time
+_netrc_files = {}
+
+
+def _load_netrc():
+    """Get the parsed ~/.netrc, which is only parsed again after it changed"""
+    try:
+        mtime = os.stat(os.path.expanduser("~/.netrc")).st_mtime_ns
+    except OSError:
+        return netrc.netrc()
+    if mtime not in _netrc_files:
+        _netrc_files.clear()
+        _netrc_files[mtime] = netrc.netrc()
+    return _netrc_files[mtime]
+
+
+def _cache_dir():
+    """Get the directory for the state that is kept between invocations"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "kasserver")
+
+
+class SchemaCache:
+    """On disk cache for the XML schemas referenced by the KAS WSDL
+
+    KasApi.wsdl imports the SOAP encoding schema which zeep would otherwise
+    download every time a client is created. The cache implements the
+    interface of zeep's caches, opens the database only when it is used first
+    and treats every database error as cache miss."""
+
+    TIMEOUT = 30 * 24 * 3600
+
+    def __init__(self, path=None):
+        self.path = path if path else os.path.join(_cache_dir(), "schemas.db")
+        self._cache = None
+
+    def _open(self):
+        if self._cache is None:
+            from zeep.cache import SqliteCache  # pylint: disable=import-outside-toplevel
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._cache = SqliteCache(self.path, timeout=self.TIMEOUT)
+        return self._cache
+
+    def add(self, url, content):
+        """Store the content of url"""
+        try:
+            self._open().add(url, content)
+        except (OSError, sqlite3.Error) as err:
+            LOGGER.debug("Cannot cache %s in %s: %s", url, self.path, err)
+
+    def get(self, url):
+        """Get the stored content of url (or None)"""
+        try:
+            return self._open().get(url)
+        except (OSError, sqlite3.Error) as err:
+            LOGGER.debug("Cannot read %s from %s: %s", url, self.path, err)
+            return None
+
+
+class FloodState:
+    """Flood delay of a KAS account shared by all processes on this host
+
+    The time when the next request is allowed is kept in a small state file
+    per account. Requests are made while holding an exclusive lock on that
+    file so that concurrent processes (e.g. ACME hooks) wait for each other
+    instead of running into the flood protection of the KAS server."""
+
+    def __init__(self, username, path=None):
+        if not path:
+            account = re.sub(r"[^\w.-]", "_", username)
+            path = os.path.join(_cache_dir(), f"flood-{account}.json")
+        self.path = path
+        self._file = None
+        self._not_before = 0.0
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Lock the state for the duration of a request"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a+", encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    self._not_before = float(json.load(file)["not_before"])
+                except (ValueError, KeyError, TypeError):
+                    self._not_before = 0.0
+                self._file = file
+                yield self
+            finally:
+                self._file = None
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def remaining(self):
+        """Get the time in seconds until the next request is allowed"""
+        return max(0.0, self._not_before - time.time())
+
+    def update(self, delay):
+        """Allow the next request delay seconds from now"""
+        self._not_before = time.time() + delay
+        self._file.seek(0)
+        self._file.truncate()
+        json.dump({"not_before": self._not_before}, self._file)
+        self._file.flush()
+
+
+class Pacer:
+    """Space out requests by the KAS flood delay
+
+    The delay is counted from the (monotonic) time of the last response, so
+    only the part of it that has not already passed is waited for. Threads
+    that share a pacer send their requests one after the other in the order
+    they arrived. A single pacer can be shared between several KasServer
+    instances of the same account."""
 
     def __init__(self):
-        wsdl_file = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), "KasApi.wsdl"
+        self._condition = threading.Condition()
+        self._tickets = itertools.count()
+        self._serving = 0
+        self._not_before = 0.0
+
+    def delay(self, seconds):
+        """Delay the next request by seconds from now"""
+        self._not_before = time.monotonic() + seconds
+
+    def remaining(self):
+        """Get the time in seconds until the next request is allowed"""
+        return max(0.0, self._not_before - time.monotonic())
+
+    def __enter__(self):
+        with self._condition:
+            ticket = next(self._tickets)
+            self._condition.wait_for(lambda: self._serving == ticket)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self._serving += 1
+            self._condition.notify_all()
+
+
+class SessionStore:
+    """Session token of a KAS account
+
+    The token is kept in memory and (with a path) in a file that is readable
+    only by the current user, so that it can be reused by later processes.
+    Tokens are considered expired shortly before the end of their lifetime.
+    As the server extends the lifetime with every request, so does touch()."""
+
+    MARGIN = 30
+
+    def __init__(self, username, lifetime, path=None):
+        self.lifetime = lifetime
+        self.path = path
+        self._username = username
+        self._token = None
+        self._expires = 0.0
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                session = json.load(file)
+            if session["user"] == self._username:
+                self._token, self._expires = session["token"], float(session["expires"])
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            LOGGER.debug("Cannot load session from %s: %s", self.path, err)
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)
+            with open(fd, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "user": self._username,
+                        "token": self._token,
+                        "expires": self._expires,
+                    },
+                    file,
+                )
+        except OSError as err:
+            LOGGER.warning("Cannot store session in %s: %s", self.path, err)
+
+    def get(self):
+        """Get the token if it is still valid (or None)"""
+        if self._token and time.time() + self.MARGIN < self._expires:
+            return self._token
+        return None
+
+    def set(self, token):
+        """Store a new token"""
+        self._token, self._expires = token, time.time() + self.lifetime
+        if self.path:
+            self._save()
+
+    def touch(self):
+        """Extend the lifetime of the token after it has been used"""
+        self._expires = time.time() + self.lifetime
+
+    def clear(self):
+        """Drop the token (e.g. after the server rejected it)"""
+        self._token, self._expires = None, 0.0
+        if self.path:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+
+
+class KasServerBase:
+    """Common functionality of the blocking and the asynchronous KAS clients"""
+
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+
+    # Parsed WSDL documents shared by all clients of a zeep client class
+    _documents = {}
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        cache_ttl=None,
+        cache_size=32,
+        endpoint=None,
+        transport=None,
+        credentials=None,
+        zone_names=(),
+    ):
+        self._endpoint = endpoint if endpoint else os.environ.get("KASSERVER_ENDPOINT")
+        self._transport_config = transport
+        self._client = self._create_client()
+        self._service = self._bind(self._client, "KasApi")
+        self._get_credentials(credentials)
+        self._round_trips = 0
+        self._wait_time = 0.0
+        self._cache = ZoneCache(cache_ttl, cache_size) if cache_ttl else None
+        self._resolver = zones.ZoneResolver(zone_names)
+
+    def _create_client(self):
+        raise NotImplementedError
+
+    @property
+    def transport_config(self):
+        """Configuration of the HTTP transport (see kasserver.transport)"""
+        if not self._transport_config:
+            # Imported on demand to keep requests out of the CLI startup
+            from kasserver import transport  # pylint: disable=import-outside-toplevel
+
+            self._transport_config = transport.TransportConfig()
+        return self._transport_config
+
+    @classmethod
+    def _load_client(cls, client_class, transport, wsdl_file=WSDL_FILE):
+        """Create a zeep client, parsing the WSDL only once per process"""
+        key = (client_class, wsdl_file)
+        client = client_class(cls._documents.get(key, wsdl_file), transport=transport)
+        cls._documents.setdefault(key, client.wsdl)
+        return client
+
+    def _bind(self, client, name):
+        """Get the service proxy of a client, using the configured endpoint"""
+        if not self._endpoint:
+            return client.service
+        return client.create_service(
+            f"{{https://kasserver.com/}}{name}Binding",
+            f"{self._endpoint.rstrip('/')}/{name}.php",
         )
-        self._client = zeep.Client(wsdl_file)
-        self._get_credentials()
-        self._flood_timeout = 0
 
-    def _get_credentials(self):
+    def _get_credentials(self, credentials=None):
+        if credentials:
+            self._username, self._password = credentials
+            return
         self._username = os.environ.get("KASSERVER_USER", None)
         self._password = os.environ.get("KASSERVER_PASSWORD", None)
         if self._username:
             return
 
-        server = "kasapi.kasserver.com"
+        server = NETRC_MACHINE
         try:
-            info = netrc.netrc().authenticators(server)
+            info = _load_netrc().authenticators(server)
             self._username = info[0]
             self._password = info[2]
         except (FileNotFoundError, netrc.NetrcParseError) as err:
@@ -64,81 +569,795 @@ class KasServer:
                 "Cannot load credentials for %s from .netrc: %s", server, err
             )
 
-    def _request(self, request, params):
-        request = {
-            "KasUser": self._username,
-            "KasAuthType": "plain",
-            "KasAuthData": self._password,
-            "KasRequestType": request,
-            "KasRequestParams": params,
+    def _authentication(self):
+        """Get the KasAuthType and KasAuthData for the next request"""
+        return "plain", self._password
+
+    def _build_request(self, request, params):
+        auth_type, auth_data = self._authentication()
+        return json.dumps(
+            {
+                "KasUser": self._username,
+                "KasAuthType": auth_type,
+                "KasAuthData": auth_data,
+                "KasRequestType": request,
+                "KasRequestParams": params,
+            }
+        )
+
+    @staticmethod
+    def _flood_delay(result):
+        """Get the delay that the server requires before the next request"""
+        return result[1]["value"]["item"][0]["value"]
+
+    @staticmethod
+    def _flood_protection_delay(exc):
+        """Get the retry delay of a flood_protection fault (or None)"""
+        if exc.message != "flood_protection":
+            return None
+        timeout = math.ceil(float(exc.detail.text))
+        LOGGER.warning("Hit flood protection, retrying in %ds", timeout)
+        return timeout
+
+    def _split_fqdn(self, fqdn):
+        """Split a FQDN into record_name and zone_name values
+
+        The zone is the longest matching zone of the account once they are
+        known from get_domains() and else the registrable domain."""
+        return self._resolver.split(fqdn)
+
+    def _update_cache(self, zone_name, res, params):
+        """Apply a successful write to the cached snapshot of a zone"""
+        records = self._cache.get(zone_name) if self._cache else None
+        if records is None:
+            return
+        if "record_id" in params:
+            # Update or delete of an existing record
+            record = records.get(params["record_id"])
+            if record is None:
+                self._cache.invalidate(zone_name)
+            elif "record_type" in params:
+                records.update(
+                    record,
+                    **{
+                        DnsRecord.KAS_FIELDS[key]: value
+                        for key, value in params.items()
+                        if key in DnsRecord.KAS_FIELDS and key != "record_id"
+                    },
+                )
+            else:
+                records.remove(record)
+            return
+        # Insert with the id returned by add_dns_settings if the API told us
+        record_id = self._returned_id(res)
+        if record_id is None:
+            self._cache.invalidate(zone_name)
+            return
+        records.add(
+            DnsRecord(
+                id=record_id,
+                zone=zone_name.rstrip("."),
+                name=params["record_name"],
+                type=params["record_type"],
+                data=params["record_data"],
+                aux=params["record_aux"],
+            )
+        )
+
+    @staticmethod
+    def _returned_id(res):
+        """Get the id of a record created by add_dns_settings"""
+        record_id = res[1]["value"]["item"][2]["value"]
+        return str(record_id) if isinstance(record_id, (str, int)) else None
+
+    def _written_id(self, res, params):
+        """Get the id of a record written by add or update_dns_settings"""
+        return params.get("record_id") or self._returned_id(res)
+
+    def invalidate_cache(self, fqdn=None):
+        """Drop cached DNS records of the zone of fqdn (or of all zones)"""
+        if self._cache:
+            self._cache.invalidate(self._split_fqdn(fqdn)[1] if fqdn else None)
+
+    @staticmethod
+    def _parse_records(res):
+        """Put the DNS records of a get_dns_settings response into a RecordSet"""
+        items = res[1]["value"]["item"][2]["value"]["_value_1"]
+        return RecordSet(DnsRecord.from_items(item["item"]) for item in items)
+
+    @staticmethod
+    def _parse_domains(res):
+        """Get the sorted domain names of a get_domains response"""
+        items = res[1]["value"]["item"][2]["value"]["_value_1"]
+        return sorted(
+            i["value"]
+            for item in items
+            for i in item["item"]
+            if i["key"] == "domain_name"
+        )
+
+    @staticmethod
+    def _existing_record(  # pylint: disable=too-many-arguments
+        records, record_name, record_type, record_data=None, replace=False
+    ):
+        """Get the record that is written for a name, type and data or None
+
+        With replace a record with different data is returned as well."""
+        matching = records.find(record_name, record_type, record_data)
+        if not matching and replace:
+            matching = records.find(record_name, record_type)
+        return matching[0] if matching else None
+
+    def _add_request(self, records, change, replace):
+        """Get the request type and parameters to write an "add" DnsChange
+
+        The request type is None if an existing record is already identical."""
+        record_name, zone_name = self._split_fqdn(change.fqdn)
+        record_type = change.record_type
+        params = self._record_params(
+            zone_name, record_name, record_type, change.record_data, change.record_aux
+        )
+        existing_record = self._existing_record(
+            records, record_name, record_type, change.record_data, replace
+        )
+        if not existing_record:
+            return "add_dns_settings", params
+        params["record_id"] = existing_record.id
+        if (existing_record.data, str(existing_record.aux)) == (
+            params["record_data"],
+            str(params["record_aux"]),
+        ):
+            return None, params
+        return "update_dns_settings", params
+
+    @staticmethod
+    def _record_params(zone_name, record_name, record_type, record_data, record_aux):
+        """Build the parameters for adding or updating a DNS record"""
+        return {
+            "zone_host": zone_name,
+            "record_name": record_name,
+            "record_type": record_type,
+            "record_data": record_data,
+            "record_aux": record_aux if record_aux else "0",
         }
 
-        def _send_request(request):
-            time.sleep(self._flood_timeout)
+
+class KasServer(KasServerBase):
+    """Manage domains hosted on All-Inkl.com through the KAS server API"""
+
+    # pylint: disable=too-many-instance-attributes
+
+    # Faults that indicate that a session token is no longer valid
+    SESSION_FAULTS = ("session_invalid", "session_timeout", "kas_auth_data_incorrect")
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        cache_ttl=None,
+        cache_size=32,
+        shared_pacing=False,
+        *,
+        endpoint=None,
+        session_lifetime=None,
+        session_cache=False,
+        transport=None,
+        retry_policy=None,
+        breaker=None,
+        pacer=None,
+        credentials=None,
+        zone_names=(),
+        domains_ttl=None,
+    ):
+        """Create a client for the KAS server API
+
+        With shared_pacing the flood delay is shared with other processes that
+        use the same account on this host (see FloodState).
+
+        With session_lifetime (in seconds) the password is sent only once to
+        get a session token that authenticates all further requests. With
+        session_cache the token is stored on disk for later processes.
+
+        endpoint replaces the base URL of the KAS API (for testing), it
+        defaults to $KASSERVER_ENDPOINT.
+
+        transport is a kasserver.transport.TransportConfig with timeouts,
+        connection pool and proxy settings.
+
+        retry_policy is a kasserver.retry.RetryPolicy for failed requests,
+        breaker a kasserver.retry.CircuitBreaker (possibly shared with other
+        clients) that fails fast while the API is unavailable.
+
+        pacer is a Pacer that is shared with other clients (or threads) of
+        the same account, by default every client has its own.
+
+        credentials is a (username, password) tuple, by default they are
+        taken from $KASSERVER_USER and $KASSERVER_PASSWORD or ~/.netrc.
+
+        zone_names are zones of the account that are known without
+        get_domains(), names in them are split at the longest zone. Without
+        them and with domains_ttl (in seconds) the domains of the account are
+        fetched before the first name is split and stored on disk for later
+        processes for that long."""
+        super().__init__(
+            cache_ttl, cache_size, endpoint, transport, credentials, zone_names
+        )
+        self._domains_file = None
+        self._domains_lock = threading.Lock()
+        if domains_ttl and self._username and not zone_names:
+            account = re.sub(r"[^\w.-]", "_", self._username)
+            path = os.path.join(_cache_dir(), f"domains-{account}.json")
+            self._domains_file = (path, domains_ttl)
+        self._retry = retry_policy if retry_policy else retry.RetryPolicy()
+        self._breaker = breaker if breaker else retry.CircuitBreaker()
+        # Deadlines of the threads that share the client
+        self._deadlines = threading.local()
+        self._pacer = pacer if pacer else Pacer()
+        self._call_time = 0.0
+        self._auth_service = None
+        self._session = None
+        if session_lifetime and self._username:
+            path = None
+            if session_cache:
+                account = re.sub(r"[^\w.-]", "_", self._username)
+                path = os.path.join(_cache_dir(), f"session-{account}.json")
+            self._session = SessionStore(self._username, session_lifetime, path)
+        self._flood_state = None
+        if shared_pacing and self._username:
+            self._flood_state = FloodState(self._username)
+            try:
+                with self._flood_state.lock():
+                    pass
+            except OSError as err:
+                LOGGER.warning(
+                    "Cannot share flood delay in %s: %s", self._flood_state.path, err
+                )
+                self._flood_state = None
+
+    def _create_client(self):
+        return self._load_client(
+            zeep.Client, self.transport_config.transport(cache=SchemaCache())
+        )
+
+    @property
+    def connection_stats(self):
+        """Number of HTTP requests and of opened and reused connections"""
+        return self.transport_config.stats.as_dict()
+
+    def _authentication(self):
+        if not self._session:
+            return super()._authentication()
+        token = self._session.get()
+        if not token:
+            if not self._auth_service:
+                client = self._load_client(
+                    zeep.Client,
+                    self.transport_config.transport(cache=SchemaCache()),
+                    AUTH_WSDL_FILE,
+                )
+                self._auth_service = self._bind(client, "KasAuth")
+            LOGGER.debug("Requesting new session for %s", self._username)
+            token = self._auth_service.KasAuth(
+                json.dumps(
+                    {
+                        "KasUser": self._username,
+                        "KasAuthType": "plain",
+                        "KasPassword": self._password,
+                        "SessionLifeTime": self._session.lifetime,
+                        "SessionUpdateLifeTime": "Y",
+                    }
+                )
+            )
+            self._session.set(token)
+        return "session", token
+
+    def _request(self, request, params, stream=False):
+        # Added records would be duplicated if a processed request is repeated
+        idempotent = not request.startswith("add_")
+        with self._observed(request):
             try:
-                result = self._client.service.KasApi(json.dumps(request))
-                self._flood_timeout = result[1]["value"]["item"][0]["value"]
-                return result
+                result = self._send_request(
+                    self._build_request(request, params), stream, idempotent
+                )
             except zeep.exceptions.Fault as exc:
-                if exc.message == "flood_protection":
-                    timeout = math.ceil(float(exc.detail.text))
-                    LOGGER.warning("Hit flood protection, retrying in %ds", timeout)
-                    time.sleep(timeout)
-                    return _send_request(request)
-                raise
+                if not self._session or exc.message not in self.SESSION_FAULTS:
+                    raise
+                LOGGER.info(
+                    "Session of %s is no longer valid, renewing", self._username
+                )
+                self._session.clear()
+                result = self._send_request(
+                    self._build_request(request, params), stream, idempotent
+                )
+            if self._session:
+                self._session.touch()
+            return result
 
-        return _send_request(request)
+    @contextlib.contextmanager
+    def _observed(self, request):
+        """Report the metrics of a request to the registered observers"""
+        if not metrics.observing():
+            yield
+            return
+        stats = self.transport_config.stats
+        started = time.monotonic()
+        round_trips, call_time, latency = (
+            self._round_trips,
+            self._call_time,
+            stats.latency,
+        )
+        fault = None
+        try:
+            yield
+        except zeep.exceptions.Fault as exc:
+            fault = exc.message
+            raise
+        except Exception as exc:
+            fault = type(exc).__name__
+            raise
+        finally:
+            call_time = self._call_time - call_time
+            # Session requests are not part of the call time
+            latency = min(stats.latency - latency, call_time)
+            metrics.notify(
+                metrics.RequestMetrics(
+                    request,
+                    wait=time.monotonic() - started - call_time,
+                    latency=latency,
+                    decode=call_time - latency,
+                    retries=max(0, self._round_trips - round_trips - 1),
+                    fault=fault,
+                )
+            )
 
-    @staticmethod
-    def _split_fqdn(fqdn):
-        """Split a FQDN into record_name and zone_name values"""
-        if not fqdn:
-            raise ValueError("Error: No valid FQDN given.")
-        split_dns = fqdn.rstrip(".").rsplit(".", 2)
-        return "".join(split_dns[:-2]), ".".join(split_dns[-2:]) + "."
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """Fail requests that cannot be completed within seconds from now
+
+        Requests raise kasserver.retry.DeadlineExceeded instead of waiting
+        for the flood delay or a retry beyond the deadline. A request that
+        is already sent is limited by the timeouts of the transport. The
+        deadline applies to the requests of the current thread only."""
+        previous = self._deadline
+        deadline = time.monotonic() + seconds
+        self._deadlines.value = (
+            deadline if previous is None else min(previous, deadline)
+        )
+        try:
+            yield self
+        finally:
+            self._deadlines.value = previous
+
+    @property
+    def _deadline(self):
+        """The deadline of the requests of the current thread (or None)"""
+        return getattr(self._deadlines, "value", None)
+
+    def _send_request(self, request, stream=False, idempotent=True):
+        """Send a request, retrying it according to the retry policy"""
+        attempt = self._retry.start(self._deadline)
+        while True:
+            lock = self._flood_state.lock() if self._flood_state else None
+            with self._pacer, lock or contextlib.nullcontext() as state:
+                wait = state.remaining() if state else self._pacer.remaining()
+                attempt.check(wait)
+                self._sleep(wait)
+                self._breaker.check()
+                try:
+                    result, delay = self._call(request, stream)
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    delay = self._retry_delay(attempt, exc, idempotent)
+                    if delay is None:
+                        raise
+                    # Wait before the next attempt like for the flood delay
+                    result = None
+                self._pacer.delay(delay)
+                if state:
+                    state.update(delay)
+                if result is not None:
+                    return result
+
+    def _call(self, request, stream):
+        self._round_trips += 1
+        started = time.monotonic()
+        try:
+            if stream:
+                with self._client.settings(raw_response=True):
+                    response = self._service.KasApi(request)
+                result = _RecordDecoder(response.content)
+            else:
+                result = self._service.KasApi(request)
+        finally:
+            self._call_time += time.monotonic() - started
+        self._breaker.success()
+        if stream:
+            return result, result.flood_delay
+        return result, self._flood_delay(result)
+
+    def _retry_delay(self, attempt, exc, idempotent):
+        """Get the delay before retrying a failed request (or None)"""
+        error = self._retry.classify(exc)
+        if error in (retry.CONNECTION, retry.TIMEOUT, retry.SERVER):
+            self._breaker.failure()
+        else:
+            # The server answered
+            self._breaker.success()
+        server_delay = (
+            self._flood_protection_delay(exc) if error == retry.FLOOD else None
+        )
+        return attempt.delay(exc, server_delay, idempotent)
+
+    def _sleep(self, timeout):
+        self._wait_time += timeout
+        time.sleep(timeout)
+
+    def _get_zone(self, zone_name):
+        """Get the (possibly cached) RecordSet of a zone"""
+        if self._cache:
+            records = self._cache.get(zone_name)
+            if records is not None:
+                return records
+        records = self._parse_records(
+            self._request("get_dns_settings", {"zone_host": zone_name})
+        )
+        if self._cache:
+            self._cache.put(zone_name, records)
+        return records
+
+    def get_domains(self):
+        """Get the sorted names of all domains (DNS zones) of the account
+
+        The domains are used to find the zone of names from then on."""
+        domains = self._parse_domains(self._request("get_domains", {}))
+        self._resolver.update(domains)
+        return domains
+
+    def _split_fqdn(self, fqdn):
+        with self._domains_lock:
+            if self._domains_file:
+                self._load_domains(*self._domains_file)
+                self._domains_file = None
+        return super()._split_fqdn(fqdn)
+
+    def _load_domains(self, path, ttl):
+        """Know the domains of the account from path or else get_domains()"""
+        try:
+            if time.time() - os.stat(path).st_mtime < ttl:
+                with open(path, encoding="utf-8") as file:
+                    self._resolver.update(str(domain) for domain in json.load(file))
+                return
+        except (OSError, ValueError, TypeError) as err:
+            LOGGER.debug("Cannot load domains from %s: %s", path, err)
+        try:
+            domains = self.get_domains()
+        except zeep.exceptions.Fault as exc:
+            LOGGER.warning("Cannot get the domains of %s: %s", self._username, exc)
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(domains, file)
+        except OSError as err:
+            LOGGER.warning("Cannot store domains in %s: %s", path, err)
 
     def get_dns_records(self, fqdn):
         """Get list of DNS records."""
         _, zone_name = self._split_fqdn(fqdn)
-        res = self._request("get_dns_settings", {"zone_host": zone_name})
+        return [record.as_dict() for record in self._get_zone(zone_name)]
 
-        # Put the DNS records into a list of dicts
-        items = res[1]["value"]["item"][2]["value"]["_value_1"]
-        result = []
-        for item in items:
-            result.append(
-                {i["key"].split("_", 1)[-1]: i["value"] for i in item["item"]}
-            )
-        return result
+    def iter_dns_records(self, fqdn):
+        """Iterate over the DNS records of a zone as DnsRecord objects
+
+        The records are decoded one by one from the response of the KAS API
+        (or taken from the zone cache). Streamed records are not cached."""
+        _, zone_name = self._split_fqdn(fqdn)
+        records = self._cache.get(zone_name) if self._cache else None
+        if records is not None:
+            # Copies, the cached snapshot must not be modified by callers
+            yield from (DnsRecord(**record.as_dict()) for record in records)
+            return
+        yield from self._request(
+            "get_dns_settings", {"zone_host": zone_name}, stream=True
+        )
 
-    def get_dns_record(self, fqdn, record_type):
-        """Get a specific DNS record for a FQDN and type"""
+    def get_dns_record(self, fqdn, record_type, record_data=None):
+        """Get a specific DNS record for a FQDN and type (and data)"""
         record_name, zone_name = self._split_fqdn(fqdn)
-        result = self.get_dns_records(zone_name)
-        for item in result:
-            if item["name"] == record_name and item["type"] == record_type:
-                return item
-        return None
+        records = self._get_zone(zone_name).find(record_name, record_type, record_data)
+        return records[0].as_dict() if records else None
+
+    def add_dns_record(  # pylint: disable=too-many-arguments
+        self, fqdn, record_type, record_data, record_aux=None, replace=True
+    ):
+        """Add or update an DNS record and return its id
 
-    def add_dns_record(self, fqdn, record_type, record_data, record_aux=None):
-        """Add or update an DNS record"""
+        A record with the same name, type and data is updated (if its aux
+        differs). Otherwise with replace the record with the same name and
+        type is overwritten, without replace another record is added (e.g. a
+        second TXT record)."""
+        change = DnsChange("add", fqdn, record_type, record_data, record_aux)
+        zone_name = self._split_fqdn(fqdn)[1]
+        request, params = self._add_request(self._get_zone(zone_name), change, replace)
+        if request is None:
+            return params["record_id"]
+        res = self._request(request, params)
+        self._update_cache(zone_name, res, params)
+        return self._written_id(res, params)
+
+    def delete_dns_record(  # pylint: disable=too-many-arguments
+        self, fqdn, record_type, record_data=None, record_id=None
+    ):
+        """Removes an existing DNS record (with record_data if given)
+
+        With record_id (e.g. returned by add_dns_record) the record is deleted
+        without reading the zone. Returns the id of the deleted record (or
+        None if there is no such record)."""
         record_name, zone_name = self._split_fqdn(fqdn)
-        params = {
-            "zone_host": zone_name,
-            "record_name": record_name,
-            "record_type": record_type,
-            "record_data": record_data,
-            "record_aux": record_aux if record_aux else "0",
+        if record_id is None:
+            existing_record = self._existing_record(
+                self._get_zone(zone_name), record_name, record_type, record_data
+            )
+            if not existing_record:
+                return None
+            record_id = existing_record.id
+        params = {"record_id": record_id}
+        res = self._request("delete_dns_settings", params)
+        self._update_cache(zone_name, res, params)
+        return record_id
+
+    def apply(self, changes):
+        """Apply a list of DnsChange objects with a minimal number of requests
+
+        Changes are grouped by zone and each zone is read only once. All
+        changes for the same record name and type are merged in order so that
+        only the resulting difference is written, preferring an update of an
+        existing record over deleting and re-adding it. Adds of different
+        data for the same name and type keep all values, an add replaces an
+        existing value only if no existing record has its data. The KAS API has no
+        transactions, failed writes are reported per change and do not stop
+        the remaining changes.
+
+        Returns a dict with a `results` list (one entry per change, holding
+        the performed `operation`, the `record_id` and an `error`) together
+        with the number of `round_trips` and the `wait_time` in seconds spent
+        sleeping for the flood protection."""
+        round_trips, wait_time = self._round_trips, self._wait_time
+        results = [None] * len(changes)
+
+        by_zone = collections.defaultdict(list)
+        for index, change in enumerate(changes):
+            if change.action not in ("add", "delete"):
+                raise ValueError(f"Error: Unknown change action {change.action}.")
+            record_name, zone_name = self._split_fqdn(change.fqdn)
+            by_zone[zone_name].append((index, record_name, change))
+
+        for zone_name, zone_changes in by_zone.items():
+            for index, operation, record_id, error in self._apply_zone(
+                zone_name, zone_changes
+            ):
+                results[index] = {
+                    "change": changes[index],
+                    "operation": operation,
+                    "record_id": record_id,
+                    "error": error,
+                }
+
+        return {
+            "results": results,
+            "round_trips": self._round_trips - round_trips,
+            "wait_time": self._wait_time - wait_time,
         }
-        existing_record = self.get_dns_record(fqdn, record_type)
-        if existing_record:
-            params["record_id"] = existing_record["id"]
-            self._request("update_dns_settings", params)
+
+    def _apply_zone(self, zone_name, zone_changes):
+        """Apply the changes of a single zone, yielding per change results"""
+        try:
+            records = self._get_zone(zone_name)
+        except zeep.exceptions.Fault as exc:
+            for index, _, _ in zone_changes:
+                yield index, None, None, exc
+            return
+
+        by_record = collections.defaultdict(list)
+        for index, record_name, change in zone_changes:
+            by_record[(record_name, change.record_type)].append((index, change))
+
+        for key, record_changes in by_record.items():
+            writes, shared = self._plan_record(
+                records.find(*key), self._merge_changes(record_changes)
+            )
+            results = self._write_records(zone_name, key, writes)
+            for index, _ in record_changes:
+                result = results.get(shared.get(index, index), (None, None, None))
+                yield (index, *result)
+
+    def _write_records(self, zone_name, key, writes):
+        """Write planned operations, mapping change indexes to their results
+
+        A change that is part of several writes gets the result of the first
+        one unless a later one failed."""
+        results = {}
+        for operation, record, value, indexes in writes:
+            result = self._apply_record(zone_name, key, operation, record, value)
+            for index in indexes:
+                if index not in results or result[2]:
+                    results[index] = result
+        return results
+
+    @staticmethod
+    def _merge_changes(record_changes):
+        """Merge the changes of a record name and type in order
+
+        Adds are merged by their data, so that several values of a name
+        (like the TXT records of the ACME challenges for a domain and its
+        wildcard) are all written. A delete drops the adds of its data (or
+        of all data) before it, these adds share the result of the delete.
+
+        Returns the added values (data to aux and change indexes), the
+        deletes (data, None for all records, to change indexes) and the
+        dropped adds (index to the index of the delete)."""
+        adds, deletes, shared = {}, {}, {}
+        for index, change in record_changes:
+            data = change.record_data
+            if change.action == "add":
+                indexes = adds.pop(data, (None, []))[1]
+                adds[data] = (str(change.record_aux or "0"), indexes + [index])
+                continue
+            for value in list(adds) if data is None else [data]:
+                for add_index in adds.pop(value, (None, []))[1]:
+                    shared[add_index] = index
+            deletes.setdefault(data, []).append(index)
+        return adds, deletes, shared
+
+    @staticmethod
+    def _plan_record(existing, merged):
+        """Plan the writes of merged changes for the records of a name and type
+
+        Added values are matched with the existing records of the same data.
+        The remaining values rather update a deleted record or else (like
+        add_dns_record with replace) another existing record than adding a
+        new one. Returns the writes as (operation, record, value, change
+        indexes) tuples and the indexes of changes that share a result."""
+        adds, deletes, shared = merged
+        writes, remaining = [], []
+        for record in existing:
+            if record.data in adds:
+                aux, indexes = adds.pop(record.data)
+                operation = None if str(record.aux) == aux else "update"
+                writes.append((operation, record, (record.data, aux), indexes))
+            else:
+                indexes = deletes.get(record.data, []) + deletes.get(None, [])
+                remaining.append((record, indexes))
+        # Prefer updating the records that are deleted anyway
+        remaining.sort(key=lambda item: not item[1])
+        for data, (aux, indexes) in adds.items():
+            record, deleted = remaining.pop(0) if remaining else (None, [])
+            operation = "update" if record else "add"
+            writes.append((operation, record, (data, aux), indexes + deleted))
+        writes.extend(
+            ("delete", record, None, indexes)
+            for record, indexes in remaining
+            if indexes
+        )
+        return writes, shared
+
+    def _apply_record(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, zone_name, key, operation, record, value
+    ):
+        """Write a planned operation, returning operation, record id and error"""
+        record_id = record.id if record else None
+        if operation is None:
+            return None, record_id, None
+        if operation == "delete":
+            params = {"record_id": record_id}
         else:
-            self._request("add_dns_settings", params)
+            params = self._record_params(zone_name, *key, *value)
+            if record:
+                params["record_id"] = record_id
+
+        try:
+            res = self._request(f"{operation}_dns_settings", params)
+        except zeep.exceptions.Fault as exc:
+            return operation, record_id, exc
+        if operation == "add":
+            record_id = self._returned_id(res)
+        self._update_cache(zone_name, res, params)
+        return operation, record_id, None
+
+    def sync_zone(self, fqdn, records, dry_run=False):
+        """Synchronize the DNS records of a zone with a desired state
+
+        `records` is the complete list of desired records of the zone given as
+        dicts with `name` (relative to the zone, empty for the apex), `type`,
+        `data` and optional `aux`. Records that are not changeable are never
+        modified. The zone is read once and only the difference is written.
+
+        Returns the list of executed (or with dry_run, planned) operations as
+        dicts with `operation`, `name`, `type`, `data`, `aux` and for updates
+        and deletions the `record_id` and `previous` data."""
+        _, zone_name = self._split_fqdn(fqdn)
+        plan = self._plan_sync(self._get_zone(zone_name), records)
+        if not dry_run:
+            self.execute_plan(zone_name, plan)
+        return plan
+
+    def execute_plan(self, fqdn, plan):
+        """Execute operations planned by sync_zone(..., dry_run=True)"""
+        _, zone_name = self._split_fqdn(fqdn)
+        for step in plan:
+            params = {"record_id": step["record_id"]}
+            if step["operation"] != "delete":
+                params = {
+                    "zone_host": zone_name,
+                    "record_name": step["name"],
+                    "record_type": step["type"],
+                    "record_data": step["data"],
+                    "record_aux": step["aux"],
+                    **(params if step["operation"] == "update" else {}),
+                }
+            res = self._request(f"{step['operation']}_dns_settings", params)
+            if step["operation"] == "add":
+                step["record_id"] = self._returned_id(res)
+            self._update_cache(zone_name, res, params)
+
+    @staticmethod
+    def _plan_sync(current, desired):
+        """Compute the operations to turn the current into the desired records
+
+        Domain names in the data are compared with or without trailing dot,
+        the plan holds the data as desired."""
+
+        def value(record_type, data, aux):
+            data = str(data)
+            if record_type in zonefile.TARGET_TYPES:
+                data = data.rstrip(".")
+            return data, str(aux or "0")
+
+        # Records that already exist (including read-only ones) are unchanged
+        wanted = collections.defaultdict(list)
+        for record in desired:
+            wanted[(record.get("name") or "", record["type"])].append(
+                (
+                    value(record["type"], record["data"], record.get("aux")),
+                    str(record["data"]),
+                )
+            )
+        obsolete = collections.defaultdict(list)
+        for record in current:
+            key = (record.name or "", record.type)
+            current_value = value(record.type, record.data, record.aux)
+            match = next(
+                (item for item in wanted[key] if item[0] == current_value), None
+            )
+            if match:
+                wanted[key].remove(match)
+            elif record.changeable != "N":
+                obsolete[key].append(record)
 
-    def delete_dns_record(self, fqdn, record_type):
-        """Removes an existing DNS record"""
-        existing_record = self.get_dns_record(fqdn, record_type)
-        if existing_record:
-            self._request("delete_dns_settings", {"record_id": existing_record["id"]})
+        # Reuse obsolete records of the same name and type for updates
+        plan = []
+        for key, values in wanted.items():
+            for (_, aux), data in values:
+                record = obsolete[key].pop(0) if obsolete[key] else None
+                plan.append(
+                    {
+                        "operation": "update" if record else "add",
+                        "name": key[0],
+                        "type": key[1],
+                        "data": data,
+                        "aux": aux,
+                        "record_id": record.id if record else None,
+                        "previous": record.data if record else None,
+                    }
+                )
+        for (name, record_type), records in obsolete.items():
+            for record in records:
+                plan.append(
+                    {
+                        "operation": "delete",
+                        "name": name,
+                        "type": record_type,
+                        "data": record.data,
+                        "aux": record.aux,
+                        "record_id": record.id,
+                        "previous": record.data,
+                    }
+                )
+        return plan
@@ -0,0 +1,218 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Manage domains hosted on All-Inkl.com through the KAS server API (asyncio)
+
+The asynchronous client requires the async extras of zeep which are installed
+with `pip install kasserver[async]`."""
+
+import asyncio
+import time
+
+import zeep
+
+from kasserver import DnsChange, KasServerBase, SchemaCache, retry
+
+
+class AsyncPacer:
+    """Space out requests by the KAS flood delay without blocking the loop
+
+    Requests are serialized in FIFO order and only wait for the part of the
+    flood delay that has not already passed. A single pacer can be shared
+    between several AsyncKasServer instances of the same account."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._not_before = 0.0
+        self.wait_time = 0.0
+
+    def delay(self, seconds):
+        """Delay the next request by seconds from now"""
+        self._not_before = time.monotonic() + seconds
+
+    def remaining(self):
+        """Get the time in seconds until the next request is allowed"""
+        return max(0.0, self._not_before - time.monotonic())
+
+    async def __aenter__(self):
+        await self._lock.acquire()
+        remaining = self._not_before - time.monotonic()
+        if remaining > 0:
+            self.wait_time += remaining
+            await asyncio.sleep(remaining)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
+
+
+class AsyncKasServer(KasServerBase):
+    """Manage domains hosted on All-Inkl.com through the KAS server API
+
+    Use as async context manager (or call close()) to release the HTTP
+    connections. Requests rejected by the flood protection are retried
+    according to retry_policy (a kasserver.retry.RetryPolicy), including its
+    deadline."""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        cache_ttl=None,
+        cache_size=32,
+        pacer=None,
+        endpoint=None,
+        transport=None,
+        *,
+        retry_policy=None,
+    ):
+        super().__init__(cache_ttl, cache_size, endpoint, transport)
+        self._pacer = pacer if pacer else AsyncPacer()
+        self._retry = retry_policy if retry_policy else retry.RetryPolicy()
+        self._pending = {}
+
+    def _create_client(self):
+        return self._load_client(
+            zeep.AsyncClient, self.transport_config.async_transport(cache=SchemaCache())
+        )
+
+    def _bind(self, client, name):
+        service = super()._bind(client, name)
+        if not self._endpoint:
+            return service
+        # AsyncClient.create_service returns a blocking proxy (zeep 4.3)
+        # pylint: disable-next=protected-access
+        binding, options = service._binding, service._binding_options
+        return zeep.proxy.AsyncServiceProxy(client, binding, **options)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close the HTTP connections of the client"""
+        await self._client.transport.aclose()
+
+    async def _request(self, request, params):
+        # Added records would be duplicated if a processed request is repeated
+        idempotent = not request.startswith("add_")
+        request = self._build_request(request, params)
+        attempt = self._retry.start()
+        while True:
+            attempt.check(self._pacer.remaining())
+            async with self._pacer:
+                try:
+                    self._round_trips += 1
+                    result = await self._service.KasApi(request)
+                except zeep.exceptions.Fault as exc:
+                    delay = attempt.delay(
+                        exc, self._flood_protection_delay(exc), idempotent
+                    )
+                    if delay is None:
+                        raise
+                    self._pacer.delay(delay)
+                    continue
+                self._pacer.delay(self._flood_delay(result))
+                return result
+
+    async def _get_zone(self, zone_name):
+        """Get the (possibly cached) RecordSet of a zone
+
+        Concurrent reads of the same zone share a single request."""
+        if self._cache:
+            records = self._cache.get(zone_name)
+            if records is not None:
+                return records
+        if zone_name in self._pending:
+            return await asyncio.shield(self._pending[zone_name])
+        future = asyncio.get_running_loop().create_future()
+        self._pending[zone_name] = future
+        try:
+            records = self._parse_records(
+                await self._request("get_dns_settings", {"zone_host": zone_name})
+            )
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Retrieve the exception to avoid warnings when nobody waits
+            future.exception()
+            raise
+        finally:
+            del self._pending[zone_name]
+        future.set_result(records)
+        if self._cache:
+            self._cache.put(zone_name, records)
+        return records
+
+    async def get_domains(self):
+        """Get the sorted names of all domains (DNS zones) of the account"""
+        domains = self._parse_domains(await self._request("get_domains", {}))
+        self._resolver.update(domains)
+        return domains
+
+    async def get_dns_records(self, fqdn):
+        """Get list of DNS records."""
+        _, zone_name = self._split_fqdn(fqdn)
+        return [record.as_dict() for record in await self._get_zone(zone_name)]
+
+    async def get_dns_record(self, fqdn, record_type, record_data=None):
+        """Get a specific DNS record for a FQDN and type (and data)"""
+        record_name, zone_name = self._split_fqdn(fqdn)
+        records = (await self._get_zone(zone_name)).find(
+            record_name, record_type, record_data
+        )
+        return records[0].as_dict() if records else None
+
+    async def add_dns_record(  # pylint: disable=too-many-arguments
+        self, fqdn, record_type, record_data, record_aux=None, replace=True
+    ):
+        """Add or update an DNS record (see KasServer.add_dns_record)"""
+        change = DnsChange("add", fqdn, record_type, record_data, record_aux)
+        zone_name = self._split_fqdn(fqdn)[1]
+        request, params = self._add_request(
+            await self._get_zone(zone_name), change, replace
+        )
+        if request is None:
+            return params["record_id"]
+        res = await self._request(request, params)
+        self._update_cache(zone_name, res, params)
+        return self._written_id(res, params)
+
+    async def delete_dns_record(  # pylint: disable=too-many-arguments
+        self, fqdn, record_type, record_data=None, record_id=None
+    ):
+        """Removes an existing DNS record (see KasServer.delete_dns_record)"""
+        record_name, zone_name = self._split_fqdn(fqdn)
+        if record_id is None:
+            records = await self._get_zone(zone_name)
+            existing_record = self._existing_record(
+                records, record_name, record_type, record_data
+            )
+            if not existing_record:
+                return None
+            record_id = existing_record.id
+        params = {"record_id": record_id}
+        res = await self._request("delete_dns_settings", params)
+        self._update_cache(zone_name, res, params)
+        return record_id
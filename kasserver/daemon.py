@@ -0,0 +1,257 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Resident KAS server client serving the command line utilities"""
+
+import functools
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+import click
+
+import kasserver
+from kasserver import pool
+
+LOGGER = logging.getLogger(__name__)
+
+# KasServer methods that can be called through the daemon
+METHODS = (
+    "get_domains",
+    "get_dns_records",
+    "get_dns_record",
+    "add_dns_record",
+    "delete_dns_record",
+    "invalidate_cache",
+    "apply",
+)
+
+
+# Seconds the domains of an account are kept to find the zone of names
+DOMAINS_TTL = 24 * 3600
+
+
+class DaemonError(Exception):
+    """A request failed in (or could not be delivered to) the daemon"""
+
+
+def socket_path():
+    """Get the path of the daemon socket
+
+    The path is taken from $KASSERVER_SOCKET and defaults to kasserver.sock
+    in $XDG_RUNTIME_DIR (or in the cache directory)."""
+    if os.environ.get("KASSERVER_SOCKET"):
+        return os.environ["KASSERVER_SOCKET"]
+    # pylint: disable-next=protected-access
+    directory = os.environ.get("XDG_RUNTIME_DIR") or kasserver._cache_dir()
+    return os.path.join(directory, "kasserver.sock")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers one JSON encoded request per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            response = self.server.dispatch(line)
+            # Errors in apply() results are sent as strings
+            self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+            self.wfile.flush()
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server that forwards requests to a single KasServer
+
+    Requests of all connections are executed one after the other so that the
+    zone cache and the flood delay of the KasServer stay consistent. The
+    socket is only accessible by the current user."""
+
+    daemon_threads = True
+
+    def __init__(self, kas, path=None):
+        self.kas = kas
+        self.path = path if path else socket_path()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            # A daemon of another account is not opened but still listening
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                if sock.connect_ex(self.path) == 0:
+                    raise OSError(f"Daemon is already listening on {self.path}")
+            os.unlink(self.path)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(self.path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def dispatch(self, line):
+        """Execute a single request and return the response"""
+        try:
+            request = json.loads(line)
+            method = request["method"]
+            if method == "account":
+                # pylint: disable-next=protected-access
+                return {"result": self.kas._username}
+            if method not in METHODS:
+                raise ValueError(f"Unknown method {method}")
+            args = request.get("args", [])
+            if method == "apply":
+                args = [[kasserver.DnsChange(*change) for change in args[0]]]
+            with self._lock:
+                result = getattr(self.kas, method)(*args, **request.get("kwargs", {}))
+            return {"result": result}
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("Request failed")
+            return {"error": f"{type(err).__name__}: {err}"}
+
+
+class RemoteKasServer:
+    """Client of a running daemon offering the methods in METHODS
+
+    The results of apply() hold the changes as lists and errors as strings."""
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._file = sock.makefile("rwb")
+
+    @classmethod
+    def open(cls, path=None):
+        """Connect to the daemon, returns None if it is not running
+
+        The daemon is not used if it manages another account than the one
+        in $KASSERVER_USER."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path if path else socket_path())
+        except OSError:
+            sock.close()
+            return None
+        remote = cls(sock)
+        try:
+            account = remote._call("account")
+        except (OSError, DaemonError) as err:
+            LOGGER.warning("Ignoring daemon: %s", err)
+            remote.close()
+            return None
+        user = os.environ.get("KASSERVER_USER")
+        if user and user != account:
+            LOGGER.debug("Ignoring daemon of account %s", account)
+            remote.close()
+            return None
+        return remote
+
+    def close(self):
+        """Close the connection to the daemon"""
+        self._file.close()
+        self._socket.close()
+
+    def _call(self, method, *args, **kwargs):
+        request = {"method": method, "args": args, "kwargs": kwargs}
+        self._file.write(json.dumps(request).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise DaemonError("Connection to daemon closed")
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response["result"]
+
+    def iter_dns_records(self, fqdn):
+        """Iterate over the DNS records of a zone as DnsRecord objects"""
+        for record in self._call("get_dns_records", fqdn):
+            yield kasserver.DnsRecord(**record)
+
+    def __getattr__(self, name):
+        if name not in METHODS:
+            raise AttributeError(name)
+        return functools.partial(self._call, name)
+
+
+def connect(**kwargs):
+    """Get a client of the running daemon or else a new KasServer(**kwargs)
+
+    With an accounts file (see kasserver.pool) a KasServerPool(**kwargs) of
+    all configured accounts is returned instead. New clients keep the domains
+    of the account for DOMAINS_TTL by default."""
+    kwargs.setdefault("domains_ttl", DOMAINS_TTL)
+    if pool.configured():
+        LOGGER.debug("Using the accounts in %s", pool.accounts_path())
+        return pool.KasServerPool(**kwargs)
+    remote = RemoteKasServer.open()
+    if remote:
+        LOGGER.debug("Forwarding requests to daemon")
+        return remote
+    return kasserver.KasServer(**kwargs)
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "path",
+    default=socket_path,
+    show_default="$KASSERVER_SOCKET or $XDG_RUNTIME_DIR/kasserver.sock",
+    help="the Unix socket to listen on",
+)
+@click.option(
+    "--cache-ttl",
+    default=60,
+    show_default=True,
+    help="seconds to cache the DNS records of a zone",
+)
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    default=False,
+    help="Increase log output verbosity.",
+)
+@click.version_option(package_name="kasserver")
+def cli(path, cache_ttl, verbose):
+    """Keep a KAS server client running for the command line utilities.
+
+    kasserver-dns, kasserver-dns-certbot and kasserver-dns-lego forward their
+    requests to the daemon while it is running and reuse its loaded API
+    client, cached DNS records and flood delay."""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    kas = kasserver.KasServer(
+        cache_ttl=cache_ttl, shared_pacing=True, domains_ttl=DOMAINS_TTL
+    )
+    try:
+        server = Daemon(kas, path)
+    except OSError as err:
+        raise click.ClickException(str(err)) from err
+    with server:
+        LOGGER.info("Listening on %s", path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,353 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Local emulator of the KAS server API for tests and benchmarks
+
+The emulator serves KasApi.php (get_domains and get/add/update/delete of
+DNS settings) and KasAuth.php over HTTP on localhost. Clients connect to it
+with KasServer(endpoint=emulator.endpoint).
+
+The KAS WSDL imports the SOAP encoding schema. Call prime_schema_cache()
+to store a minimal replacement in the schema cache so that clients can be
+created without network access."""
+
+import collections
+import http.server
+import itertools
+import json
+import secrets
+import threading
+import time
+import xml.etree.ElementTree
+from xml.sax.saxutils import escape
+
+ENCODING_URL = "http://schemas.xmlsoap.org/soap/encoding/"
+
+ENCODING_SCHEMA = (
+    '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+    f'xmlns:tns="{ENCODING_URL}" targetNamespace="{ENCODING_URL}">'
+    '<xs:attribute name="arrayType" type="xs:string"/>'
+    '<xs:complexType name="Array"><xs:sequence>'
+    '<xs:any namespace="##any" minOccurs="0" maxOccurs="unbounded" '
+    'processContents="lax"/></xs:sequence>'
+    '<xs:attribute ref="tns:arrayType"/></xs:complexType></xs:schema>'
+)
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?><SOAP-ENV:Envelope '
+    'xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    f'xmlns:SOAP-ENC="{ENCODING_URL}" '
+    'xmlns:ns1="{namespace}" xmlns:ns2="http://xml.apache.org/xml-soap" '
+    'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    f'SOAP-ENV:encodingStyle="{ENCODING_URL}"><SOAP-ENV:Body>'
+    "{body}</SOAP-ENV:Body></SOAP-ENV:Envelope>"
+)
+
+API_NAMESPACE = "urn:xmethodsKasApi"
+AUTH_NAMESPACE = "urn:xmethodsKasApiAuthentication"
+
+# Fields of the DNS records in get_dns_settings responses
+RECORD_FIELDS = ("zone", "name", "type", "data", "aux", "id", "changeable")
+
+
+def prime_schema_cache(cache=None):
+    """Store the minimal SOAP encoding schema in the (default) schema cache"""
+    # pylint: disable-next=import-outside-toplevel,cyclic-import
+    from kasserver import SchemaCache
+
+    (cache if cache else SchemaCache()).add(ENCODING_URL, ENCODING_SCHEMA.encode())
+
+
+def encode(value):
+    """Encode a value (dict, list, str, int or float) as SOAP encoded XML"""
+    if isinstance(value, dict):
+        items = "".join(
+            f'<item><key xsi:type="xsd:string">{escape(key)}</key>{encode(item)}</item>'
+            for key, item in value.items()
+        )
+        return f'<value xsi:type="ns2:Map">{items}</value>'
+    if isinstance(value, list):
+        items = "".join(
+            encode(item).replace("<value", "<item", 1)[: -len("</value>")] + "</item>"
+            for item in value
+        )
+        return (
+            f'<value SOAP-ENC:arrayType="ns2:Map[{len(value)}]" '
+            f'xsi:type="SOAP-ENC:Array">{items}</value>'
+        )
+    value_type = {bool: "boolean", int: "int", float: "float"}.get(type(value))
+    return (
+        f'<value xsi:type="xsd:{value_type or "string"}">{escape(str(value))}</value>'
+    )
+
+
+def response(request_type, params, return_info, flood_delay=0.0):
+    """Build a KasApi response envelope"""
+    result = encode(
+        {
+            "Request": {"KasRequestType": request_type, "KasRequestParams": params},
+            "Response": {
+                "KasFloodDelay": float(flood_delay),
+                "ReturnString": "TRUE",
+                "ReturnInfo": return_info,
+            },
+        }
+    )
+    body = (
+        "<ns1:KasApiResponse>"
+        + result.replace("<value", "<return", 1)[: -len("</value>")]
+        + "</return></ns1:KasApiResponse>"
+    )
+    return ENVELOPE.format(namespace=API_NAMESPACE, body=body).encode()
+
+
+def fault(faultstring, detail=None, namespace=API_NAMESPACE):
+    """Build a SOAP fault envelope"""
+    body = (
+        "<SOAP-ENV:Fault><faultcode>SOAP-ENV:Server</faultcode>"
+        f"<faultstring>{escape(faultstring)}</faultstring>"
+        + (f"<detail>{escape(str(detail))}</detail>" if detail is not None else "")
+        + "</SOAP-ENV:Fault>"
+    )
+    return ENVELOPE.format(namespace=namespace, body=body).encode()
+
+
+class KasFault(Exception):
+    """A request is answered with a SOAP fault"""
+
+    def __init__(self, faultstring, detail=None):
+        super().__init__(faultstring)
+        self.detail = detail
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer a SOAP request"""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status, content = self.server.emulator.handle(self.path, body)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class KasEmulator:  # pylint: disable=too-many-instance-attributes
+    """Emulated KAS server API with DNS zones kept in memory
+
+    zones maps zone names to lists of records, which are dicts with name,
+    type, data and optional aux and changeable. Every request is delayed by
+    latency seconds. Responses ask for flood_delay seconds between requests
+    of an account; with flood_protection, requests that come too early are
+    answered with a flood_protection fault. With username (and password)
+    only these credentials (or sessions created with them) are accepted.
+
+    `requests` counts the answered requests per request type and `faults`
+    the faults that were sent. Use as context manager to run the server."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        zones=None,
+        *,
+        latency=0.0,
+        flood_delay=0.0,
+        flood_protection=True,
+        username=None,
+        password=None,
+    ):
+        self.latency = latency
+        self.flood_delay = flood_delay
+        self.flood_protection = flood_protection
+        self.username = username
+        self.password = password
+        self.requests = collections.Counter()
+        self.faults = collections.Counter()
+        self.zones = {}
+        self._ids = itertools.count(1)
+        self._sessions = set()
+        self._not_before = {}
+        self._lock = threading.Lock()
+        self._server = None
+        for zone_name, records in (zones or {}).items():
+            self.add_zone(zone_name, records)
+
+    def add_zone(self, zone_name, records=()):
+        """Add a zone with a list of records (dicts with name, type and data)"""
+        zone_name = zone_name.rstrip(".")
+        with self._lock:
+            self.zones[zone_name] = [
+                {
+                    "zone": zone_name,
+                    "name": record.get("name", ""),
+                    "type": record["type"],
+                    "data": record["data"],
+                    "aux": int(record.get("aux", 0)),
+                    "id": str(next(self._ids)),
+                    "changeable": record.get("changeable", "Y"),
+                }
+                for record in records
+            ]
+
+    @property
+    def endpoint(self):
+        """The base URL of the running emulator"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.emulator = self
+        threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, path, body):
+        """Answer the SOAP request body sent to path with status and content"""
+        if self.latency:
+            time.sleep(self.latency)
+        auth = path.endswith("/KasAuth.php")
+        namespace = AUTH_NAMESPACE if auth else API_NAMESPACE
+        try:
+            element = xml.etree.ElementTree.fromstring(body).find(".//Params")
+            params = json.loads(element.text)
+            with self._lock:
+                if auth:
+                    return 200, self._auth(params)
+                return 200, self._api(params)
+        except KasFault as err:
+            self.faults[str(err)] += 1
+            return 500, fault(str(err), err.detail, namespace)
+        except (
+            xml.etree.ElementTree.ParseError,
+            AttributeError,
+            ValueError,
+            KeyError,
+            TypeError,
+        ) as err:
+            return 500, fault(f"invalid_request: {err}", namespace=namespace)
+
+    def _auth(self, params):
+        self._check_password(params.get("KasUser"), params.get("KasPassword"))
+        token = secrets.token_hex(16)
+        self._sessions.add(token)
+        self.requests["KasAuth"] += 1
+        body = (
+            f'<ns1:KasAuthResponse><return xsi:type="xsd:string">{token}</return>'
+            "</ns1:KasAuthResponse>"
+        )
+        return ENVELOPE.format(namespace=AUTH_NAMESPACE, body=body).encode()
+
+    def _check_password(self, user, password):
+        if self.username and (
+            user != self.username or (self.password and password != self.password)
+        ):
+            raise KasFault("kas_auth_data_incorrect")
+
+    def _api(self, params):
+        user, auth_type = params.get("KasUser"), params.get("KasAuthType")
+        if auth_type == "session":
+            if params.get("KasAuthData") not in self._sessions:
+                raise KasFault("session_invalid")
+        else:
+            self._check_password(user, params.get("KasAuthData"))
+        now = time.monotonic()
+        remaining = self._not_before.get(user, 0.0) - now
+        if self.flood_protection and remaining > 0:
+            raise KasFault("flood_protection", f"{remaining:.3f}")
+        request_type = params["KasRequestType"]
+        request_params = params.get("KasRequestParams") or {}
+        handler = getattr(self, f"_{request_type}", None)
+        if handler is None:
+            raise KasFault("unknown_action")
+        return_info = handler(request_params)
+        self.requests[request_type] += 1
+        self._not_before[user] = now + self.flood_delay
+        return response(request_type, request_params, return_info, self.flood_delay)
+
+    def _zone(self, params):
+        zone_name = params["zone_host"].rstrip(".")
+        if zone_name not in self.zones:
+            raise KasFault("zone_not_found")
+        return self.zones[zone_name]
+
+    def _record(self, record_id):
+        for records in self.zones.values():
+            for record in records:
+                if record["id"] == str(record_id):
+                    return records, record
+        raise KasFault("record_id_not_found")
+
+    def _get_domains(self, _params):
+        return [{"domain_name": zone_name} for zone_name in sorted(self.zones)]
+
+    def _get_dns_settings(self, params):
+        return [
+            {f"record_{field}": record[field] for field in RECORD_FIELDS}
+            for record in self._zone(params)
+        ]
+
+    def _add_dns_settings(self, params):
+        records = self._zone(params)
+        record = {
+            "zone": params["zone_host"].rstrip("."),
+            "name": params["record_name"],
+            "type": params["record_type"],
+            "data": params["record_data"],
+            "aux": int(params.get("record_aux") or 0),
+            "id": str(next(self._ids)),
+            "changeable": "Y",
+        }
+        for existing in records:
+            if all(existing[f] == record[f] for f in ("name", "type", "data")):
+                raise KasFault("record_already_exists")
+        records.append(record)
+        return int(record["id"])
+
+    def _update_dns_settings(self, params):
+        _, record = self._record(params["record_id"])
+        if record["changeable"] != "Y":
+            raise KasFault("record_not_changeable")
+        for field in ("name", "type", "data"):
+            if f"record_{field}" in params:
+                record[field] = params[f"record_{field}"]
+        if "record_aux" in params:
+            record["aux"] = int(params["record_aux"] or 0)
+        return "TRUE"
+
+    def _delete_dns_settings(self, params):
+        records, record = self._record(params["record_id"])
+        if record["changeable"] != "Y":
+            raise KasFault("record_not_changeable")
+        records.remove(record)
+        return "TRUE"
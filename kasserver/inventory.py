@@ -0,0 +1,231 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Snapshots of the DNS records of all zones kept on disk"""
+
+import hashlib
+import json
+import os
+import time
+
+import kasserver
+
+# pylint: disable-next=protected-access
+sqlite3 = kasserver._lazy_import("sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS zones (
+    zone_name TEXT PRIMARY KEY, hash TEXT NOT NULL, fetched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    zone_name TEXT NOT NULL, position INTEGER NOT NULL,
+    id TEXT, zone TEXT, name TEXT, type TEXT, data TEXT, aux TEXT, changeable TEXT,
+    PRIMARY KEY (zone_name, position)
+);
+CREATE INDEX IF NOT EXISTS records_data ON records (data);
+CREATE TABLE IF NOT EXISTS changes (
+    time REAL NOT NULL, zone_name TEXT NOT NULL, operation TEXT NOT NULL,
+    name TEXT, type TEXT, data TEXT, aux TEXT, previous TEXT
+);
+"""
+
+FIELDS = kasserver.DnsRecord.__slots__
+
+
+def _zone_key(zone_name):
+    return zone_name.rstrip(".").lower()
+
+
+def _normalized(record):
+    """Get a record with the text the database returns for its fields
+
+    The KAS API returns some fields (such as aux) as numbers, the records
+    read back from the database always have strings."""
+    return kasserver.DnsRecord(
+        **{
+            field: None if value is None else str(value)
+            for field, value in record.as_dict().items()
+        }
+    )
+
+
+def _record_key(record):
+    """Identify a record across snapshots by its id (if it has one)"""
+    if record.id and record.id != "0":
+        return record.id
+    return (record.name, record.type, record.data, record.aux)
+
+
+class Inventory:
+    """SQLite store with the last fetched records of each zone
+
+    Every snapshot is stored with a hash of its records and the time it was
+    fetched. Storing a new snapshot records the added, updated and deleted
+    records in the changes table. Use as context manager (or call close())."""
+
+    def __init__(self, path=None):
+        if not path:
+            # pylint: disable-next=protected-access
+            path = os.path.join(kasserver._cache_dir(), "inventory.db")
+        self.path = path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the database"""
+        self._db.close()
+
+    def zones(self):
+        """Get a dict mapping the stored zone names to their fetch time"""
+        return dict(
+            self._db.execute("SELECT zone_name, fetched FROM zones ORDER BY zone_name")
+        )
+
+    def stale(self, zone_names, max_age):
+        """Get the zones that are not stored or older than max_age seconds"""
+        zones = self.zones()
+        now = time.time()
+        return [
+            zone_name
+            for zone_name in zone_names
+            if now - zones.get(_zone_key(zone_name), 0.0) >= max_age
+        ]
+
+    def records(self, zone_name):
+        """Get the stored records of a zone as list of DnsRecord (or None)"""
+        zone_name = _zone_key(zone_name)
+        if not self._db.execute(
+            "SELECT 1 FROM zones WHERE zone_name = ?", (zone_name,)
+        ).fetchone():
+            return None
+        return self._select("WHERE zone_name = ? ORDER BY position", (zone_name,))
+
+    def search(self, pattern, record_type=None):
+        """Get the stored records whose data matches a glob pattern"""
+        query, params = "WHERE data GLOB ?", [pattern]
+        if record_type:
+            query += " AND type = ?"
+            params.append(record_type.upper())
+        return self._select(query + " ORDER BY zone_name, position", params)
+
+    def _select(self, query, params):
+        columns = ", ".join(FIELDS)
+        rows = self._db.execute(f"SELECT {columns} FROM records {query}", params)
+        return [kasserver.DnsRecord(**dict(zip(FIELDS, row))) for row in rows]
+
+    def store(self, zone_name, records, fetched=None):
+        """Store a new snapshot of a zone and return its changes
+
+        The changes are dicts with operation (add, update or delete), name,
+        type, data, aux and the previous data of updated records."""
+        zone_name = _zone_key(zone_name)
+        fetched = fetched if fetched else time.time()
+        records = [_normalized(record) for record in records]
+        digest = hashlib.sha256(
+            json.dumps(sorted(json.dumps(r.as_dict()) for r in records)).encode()
+        ).hexdigest()
+        row = self._db.execute(
+            "SELECT hash FROM zones WHERE zone_name = ?", (zone_name,)
+        ).fetchone()
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO zones VALUES (?, ?, ?)",
+                (zone_name, digest, fetched),
+            )
+            if row and row[0] == digest:
+                return []
+            changes = self._diff(self.records(zone_name) if row else [], records)
+            self._db.execute("DELETE FROM records WHERE zone_name = ?", (zone_name,))
+            self._db.executemany(
+                f"INSERT INTO records VALUES (?, ?, {', '.join('?' * len(FIELDS))})",
+                (
+                    (zone_name, position, *(getattr(record, f) for f in FIELDS))
+                    for position, record in enumerate(records)
+                ),
+            )
+            self._db.executemany(
+                "INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (fetched, zone_name, change["operation"])
+                    + tuple(change[f] for f in ("name", "type", "data", "aux"))
+                    + (change.get("previous"),)
+                    for change in changes
+                ),
+            )
+        return changes
+
+    @staticmethod
+    def _diff(previous, current):
+        previous = {_record_key(record): record for record in previous}
+        current = {_record_key(record): record for record in current}
+        changes = []
+        for key, record in current.items():
+            old = previous.get(key)
+            if old is None:
+                changes.append({"operation": "add", **record.as_dict()})
+            elif (old.name, old.type, old.data, old.aux) != (
+                record.name,
+                record.type,
+                record.data,
+                record.aux,
+            ):
+                changes.append(
+                    {"operation": "update", **record.as_dict(), "previous": old.data}
+                )
+        changes.extend(
+            {"operation": "delete", **record.as_dict()}
+            for key, record in previous.items()
+            if key not in current
+        )
+        return changes
+
+    def prune(self, zone_names):
+        """Drop the snapshots of all zones except zone_names and return them"""
+        keep = {_zone_key(zone_name) for zone_name in zone_names}
+        dropped = [zone_name for zone_name in self.zones() if zone_name not in keep]
+        with self._db:
+            for zone_name in dropped:
+                for table in ("zones", "records"):
+                    self._db.execute(
+                        f"DELETE FROM {table} WHERE zone_name = ?", (zone_name,)
+                    )
+        return dropped
+
+    def changes(self, zone_name=None, limit=100):
+        """Get the last recorded changes (of a zone), newest first"""
+        query, params = "", []
+        if zone_name:
+            query, params = "WHERE zone_name = ?", [_zone_key(zone_name)]
+        rows = self._db.execute(
+            "SELECT time, zone_name, operation, name, type, data, aux, previous "
+            f"FROM changes {query} ORDER BY rowid DESC LIMIT ?",
+            (*params, limit),
+        )
+        columns = ("time", "zone_name", "operation", "name", "type", "data", "aux")
+        return [dict(zip(columns + ("previous",), row)) for row in rows]
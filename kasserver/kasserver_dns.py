@@ -21,14 +21,42 @@
 
 """Manage DNS records for All-Inkl.com domains through the KAS server"""
 
+import concurrent.futures
+import contextlib
+import itertools
+import json
 import logging
+import shlex
+import threading
+import time
 
 import click
 
 import kasserver
+from kasserver import (
+    daemon,
+    inventory,
+    metrics,
+    output,
+    pool,
+    profiling,
+    retry,
+    zonefile,
+)
 
 LOGGER = logging.getLogger(__name__)
 
+SYMBOLS = {"add": "+", "update": "~", "delete": "-"}
+
+# Columns of the list command
+FIELDS = ("id", "changeable", "zone", "name", "type", "data", "aux")
+
+# Operations of the batch command and the actions of their results
+BATCH_ACTIONS = {"add": "add", "remove": "delete", "delete": "delete", "list": "list"}
+
+# Fields of the results of the batch command
+BATCH_FIELDS = ("line", *output.FIELDS, "error")
+
 
 @click.group()
 @click.option(
@@ -38,28 +66,49 @@ LOGGER = logging.getLogger(__name__)
     default=False,
     help="Increase log output verbosity.",
 )
-@click.version_option(kasserver.__version__)
+@metrics.stats_options
+@profiling.profile_option
+@click.version_option(package_name="kasserver")
 def cli(verbose):
     """Manage All-Inkl DNS records through the KAS server."""
     logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
 
 
-@cli.command(name="list")
-@click.argument("zone_name")
-def list_command(zone_name):
-    """List DNS records for zone_name."""
-    kas = kasserver.KasServer()
-    records = kas.get_dns_records(zone_name)
-    heading = {
-        "id": "ID",
-        "changeable": "C",
-        "zone": "Zone",
-        "name": "Name",
-        "type": "Type",
-        "data": "Data",
-        "aux": "Aux",
-    }
-    for item in [heading] + records:
+def _zone_records(zone_names, jobs, stream=True):
+    """Yield the name and the DNS records of each zone in the given order
+
+    Several zones are fetched by a pool of worker threads with a client each.
+    The clients send their requests one after the other through a shared
+    Pacer and share the flood delay with other processes (see FloodState),
+    or forward their requests to the daemon, which executes them one by one.
+    The records of zones that cannot be fetched are None. With stream, the
+    records of a single zone are decoded while they are consumed instead."""
+    if stream and len(zone_names) == 1:
+        kas = daemon.connect(shared_pacing=True)
+        yield zone_names[0], kas.iter_dns_records(zone_names[0])
+        return
+    local = threading.local()
+    pacer = kasserver.Pacer()
+    # A pool of several accounts is shared, it paces every account on its own
+    shared = daemon.connect(shared_pacing=True) if pool.configured() else None
+
+    def fetch(zone_name):
+        if not hasattr(local, "kas"):
+            local.kas = shared or daemon.connect(shared_pacing=True, pacer=pacer)
+        try:
+            return list(local.kas.iter_dns_records(zone_name))
+        except (kasserver.zeep.exceptions.Fault, daemon.DaemonError) as err:
+            LOGGER.error("Cannot list zone %s: %s", zone_name, err)
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from zip(zone_names, executor.map(fetch, zone_names))
+
+
+def _write_table(zones):
+    heading = dict(zip(FIELDS, ("ID", "C", "Zone", "Name", "Type", "Data", "Aux")))
+    records = (record.as_dict() for _, records in zones for record in records)
+    for item in itertools.chain([heading], records):
         print(
             f"{item['id']:>8} {item['changeable']:1} {item['zone']:20} "
             f"{item['name'] if item['name'] else '':20} {item['type']:5} "
@@ -67,12 +116,139 @@ def list_command(zone_name):
         )
 
 
+def _write_json(zones):
+    # Streamed, maps zone names to lists of records like sync state files
+    print("{", end="")
+    for index, (zone_name, records) in enumerate(zones):
+        print(f"{',' if index else ''}\n  {json.dumps(zone_name)}: [", end="")
+        for position, record in enumerate(records):
+            print(f"{',' if position else ''}\n    ", end="")
+            print(json.dumps(record.as_dict()), end="")
+        print("\n  ]", end="")
+    print("\n}")
+
+
+def _write_ndjson(zones):
+    records = (record.as_dict() for _, records in zones for record in records)
+    output.write("ndjson", records)
+
+
+def _write_csv(zones):
+    records = (record.as_dict() for _, records in zones for record in records)
+    output.write("csv", records, FIELDS)
+
+
+def _write_bind(zones):
+    for index, (zone_name, records) in enumerate(zones):
+        records = [record.as_dict() for record in records]
+        print(
+            ("\n" if index else "") + zonefile.format_bind(zone_name, records), end=""
+        )
+
+
+WRITERS = {
+    "table": _write_table,
+    # The text output of the other commands (set in KASSERVER_OUTPUT)
+    "text": _write_table,
+    "json": _write_json,
+    "ndjson": _write_ndjson,
+    "csv": _write_csv,
+    "bind": _write_bind,
+}
+
+
+def _write_zones(output_format, zones, count):
+    """Write the records of zones that are available and fail for the others"""
+    failed = []
+
+    def available():
+        for zone_name, records in zones:
+            if records is None:
+                failed.append(zone_name)
+            else:
+                yield zone_name, records
+
+    WRITERS[output_format](available())
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} of {count} zones could not be listed"
+        )
+
+
+def _format_change(zone_name, change):
+    previous = f" (was {change['previous']})" if change["operation"] == "update" else ""
+    return (
+        f"{SYMBOLS[change['operation']]} {zone_name:20} {change['name'] or '':20} "
+        f"{change['type']:5} {change['data']:25} {change['aux']:>5}{previous}"
+    )
+
+
+@contextlib.contextmanager
+def _open_inventory():
+    try:
+        with inventory.Inventory() as store:
+            yield store
+    except (OSError, inventory.sqlite3.Error) as err:
+        raise click.ClickException(f"Cannot use the inventory: {err}") from err
+
+
+def _format_option(function):
+    return output.output_option(
+        function, tuple(WRITERS), default="table", aliases=("--format",)
+    )
+
+
+def _jobs_option(function):
+    return click.option(
+        "--jobs",
+        type=click.IntRange(min=1),
+        default=4,
+        show_default=True,
+        help="the number of zones that are fetched in parallel",
+    )(function)
+
+
+@cli.command(name="list")
+@click.argument("zone_names", nargs=-1)
+@click.option("--all", "all_zones", is_flag=True, default=False, help="list all zones")
+@click.option(
+    "--cached",
+    is_flag=True,
+    default=False,
+    help="list the records stored by inventory refresh instead",
+)
+@_format_option
+@_jobs_option
+def list_command(  # pylint: disable=too-many-arguments
+    zone_names, all_zones, cached, output_format, jobs
+):
+    """List DNS records for one or more zone_names (or --all zones).
+
+    The records are written in the order of the given zones (sorted with
+    --all) as table, JSON (like sync state files), NDJSON, CSV or BIND zone
+    files."""
+    if not zone_names and not all_zones:
+        raise click.UsageError("Missing argument 'ZONE_NAMES...' or option '--all'.")
+    if not cached:
+        if all_zones:
+            zone_names = daemon.connect(shared_pacing=True).get_domains()
+        zones = _zone_records(list(zone_names), jobs)
+        _write_zones(output_format, zones, len(zone_names))
+        return
+    with _open_inventory() as store:
+        if all_zones:
+            zone_names = list(store.zones())
+        zones = ((zone_name, store.records(zone_name)) for zone_name in zone_names)
+        _write_zones(output_format, zones, len(zone_names))
+
+
 @cli.command()
 @click.argument("fqdn")
 @click.argument("record_type")
 @click.argument("value")
 @click.option("--ttl", default="0", help="the TTL value")
-def add(fqdn, record_type, value, ttl):
+@output.output_option
+def add(fqdn, record_type, value, ttl, output_format):
     """Add a DNS record for fqdn with record_type and value."""
     LOGGER.info(
         "Setting DNS %s record for domain %s to %s (TTL: %s)",
@@ -81,15 +257,251 @@ def add(fqdn, record_type, value, ttl):
         value,
         ttl,
     )
-    kas = kasserver.KasServer()
-    kas.add_dns_record(fqdn, record_type, value, ttl)
+    kas = daemon.connect(shared_pacing=True)
+    try:
+        record_id = kas.add_dns_record(fqdn, record_type, value, ttl)
+    except daemon.DaemonError as err:
+        raise click.ClickException(str(err)) from err
+    output.write(
+        output_format, [output.result("add", fqdn, record_type, value, record_id)]
+    )
 
 
 @cli.command()
 @click.argument("fqdn")
 @click.argument("record_type")
-def remove(fqdn, record_type):
-    """Remove a DNS record for fqdn and record_type."""
+@click.argument("value", required=False)
+@output.output_option
+def remove(fqdn, record_type, value, output_format):
+    """Remove a DNS record for fqdn and record_type (and value)."""
     LOGGER.info("Removing DNS %s record for domain %s", record_type, fqdn)
-    kas = kasserver.KasServer()
-    kas.delete_dns_record(fqdn, record_type)
+    kas = daemon.connect(shared_pacing=True)
+    try:
+        record_id = kas.delete_dns_record(fqdn, record_type, value)
+    except daemon.DaemonError as err:
+        raise click.ClickException(str(err)) from err
+    output.write(
+        output_format, [output.result("delete", fqdn, record_type, value, record_id)]
+    )
+
+
+def _parse_operation(line):
+    """Parse an operation given as words or as JSON object
+
+    Words are `add FQDN TYPE VALUE [TTL]`, `remove FQDN TYPE [VALUE]` or
+    `list ZONE`. JSON objects have the keys of the results (action, fqdn,
+    type, data) and optionally aux, so results can be read back."""
+    if line.startswith("{"):
+        item = json.loads(line)
+        words = [item.get("action")] + [
+            item.get(key) for key in ("fqdn", "type", "data", "aux")
+        ]
+    else:
+        words = shlex.split(line)
+    action = BATCH_ACTIONS.get(words[0])
+    arguments = {"add": (3, 4), "delete": (2, 3), "list": (1, 1)}.get(action)
+    if arguments is None:
+        raise ValueError(f"unknown operation {words[0]!r}")
+    while words and words[-1] is None:
+        words.pop()
+    if not arguments[0] <= len(words) - 1 <= arguments[1]:
+        raise ValueError(f"wrong number of arguments for {words[0]}")
+    fqdn, record_type, data, aux = (words[1:] + [None] * 3)[:4]
+    return action, fqdn, record_type, data, aux
+
+
+def _run_operation(kas, line):
+    """Run the operation of a line and get its result"""
+    action, fqdn, record_type, data, aux = _parse_operation(line)
+    if action == "add":
+        record_id = kas.add_dns_record(fqdn, record_type, data, aux or "0")
+    elif action == "delete":
+        record_id = kas.delete_dns_record(fqdn, record_type, data)
+    else:
+        records = kas.get_dns_records(fqdn)
+        return {**output.result(action, fqdn, None), "records": records}
+    return output.result(action, fqdn, record_type, data, record_id)
+
+
+def _run_batch(kas, lines, continue_on_error):
+    """Run the operations of all lines and yield their results in order"""
+    # pylint: disable-next=import-outside-toplevel
+    import requests.exceptions
+
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            result = {"line": number, **_run_operation(kas, line), "error": None}
+        except (
+            ValueError,
+            LookupError,
+            kasserver.zeep.exceptions.Fault,
+            daemon.DaemonError,
+            retry.DeadlineExceeded,
+            retry.CircuitOpenError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as err:
+            LOGGER.error("Line %d failed: %s", number, err)
+            result = {"line": number, "error": str(err)}
+        yield result
+        if result["error"] and not continue_on_error:
+            return
+
+
+def _write_batch_text(results):
+    for result in results:
+        if result["error"]:
+            print(f"{result['line']}: failed: {result['error']}")
+        elif result["action"] == "list":
+            records = (kasserver.DnsRecord(**item) for item in result["records"])
+            _write_table([(result["fqdn"], records)])
+        else:
+            print(
+                f"{result['line']}: {SYMBOLS[result['action']]} {result['fqdn']} "
+                f"{result['type']} {result['data'] or ''}".rstrip()
+            )
+
+
+@cli.command()
+@click.argument("operations", type=click.File(), default="-")
+@click.option(
+    "--continue-on-error",
+    is_flag=True,
+    default=False,
+    help="run the remaining operations after a failed one",
+)
+@output.output_option
+def batch(operations, continue_on_error, output_format):
+    """Run add, remove and list operations read from a file (or stdin).
+
+    Every line is an operation like the commands (`add FQDN TYPE VALUE
+    [TTL]`, `remove FQDN TYPE [VALUE]`, `list ZONE`) or a JSON object with
+    action, fqdn, type, data and aux. All operations share one client that
+    reads every zone only once. The results are reported per line."""
+    kas = daemon.connect(cache_ttl=3600, shared_pacing=True)
+    results = []
+
+    def run():
+        for result in _run_batch(kas, operations, continue_on_error):
+            results.append(result)
+            yield result
+
+    if output_format == "text":
+        _write_batch_text(run())
+    else:
+        output.write(output_format, run(), BATCH_FIELDS)
+    failed = sum(1 for result in results if result["error"])
+    if failed:
+        raise click.ClickException(f"{failed} of {len(results)} operations failed")
+
+
+@cli.command()
+@click.argument("state_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(zonefile.FORMATS),
+    help="the format of state_file (guessed from the extension by default)",
+)
+@click.option(
+    "--dry-run", is_flag=True, default=False, help="only print the planned changes"
+)
+def sync(state_file, file_format, dry_run):
+    """Synchronize DNS records with the desired state in state_file.
+
+    state_file is either a JSON or YAML file mapping zone names to lists of
+    records (with name, type, data and optional aux) or a BIND zone file.
+    Records that are not changeable are left untouched."""
+    try:
+        zones = zonefile.load(state_file, file_format)
+    except ValueError as err:
+        raise click.ClickException(str(err)) from err
+    kas = kasserver.KasServer(shared_pacing=True, domains_ttl=daemon.DOMAINS_TTL)
+    for zone_name, records in zones.items():
+        plan = kas.sync_zone(zone_name, records, dry_run=True)
+        if not plan:
+            LOGGER.info("Zone %s is up to date", zone_name)
+            continue
+        for step in plan:
+            print(_format_change(zone_name, step))
+        if not dry_run:
+            kas.execute_plan(zone_name, plan)
+
+
+@cli.group(name="inventory")
+def inventory_group():
+    """Keep the DNS records of all zones for offline queries."""
+
+
+@inventory_group.command()
+@click.argument("zone_names", nargs=-1)
+@click.option(
+    "--max-age",
+    type=click.FloatRange(min=0),
+    default=3600,
+    show_default=True,
+    help="seconds after which a stored zone is fetched again",
+)
+@_jobs_option
+def refresh(zone_names, max_age, jobs):
+    """Store the records of stale zone_names (or of all zones).
+
+    Only zones that are not stored yet or older than --max-age are fetched.
+    Without zone_names, zones that no longer belong to the account are
+    dropped. Changed records are printed and kept for inventory changes."""
+    with _open_inventory() as store:
+        if not zone_names:
+            zone_names = daemon.connect(shared_pacing=True).get_domains()
+            for zone_name in store.prune(zone_names):
+                LOGGER.info("Dropped zone %s", zone_name)
+        stale = store.stale(zone_names, max_age)
+        LOGGER.info("Refreshing %d of %d zones", len(stale), len(zone_names))
+        failed = 0
+        for zone_name, records in _zone_records(stale, jobs, stream=False):
+            if records is None:
+                failed += 1
+                continue
+            for change in store.store(zone_name, records):
+                print(_format_change(zone_name, change))
+    if failed:
+        raise click.ClickException(f"{failed} of {len(stale)} zones failed")
+
+
+@inventory_group.command()
+@click.argument("pattern")
+@click.option("--type", "record_type", help="only search records of this type")
+@click.option(
+    "--zones",
+    "zones_only",
+    is_flag=True,
+    default=False,
+    help="only print the names of the matching zones",
+)
+@_format_option
+def search(pattern, record_type, zones_only, output_format):
+    """Search stored records with data matching the glob pattern.
+
+    For example `search --type A --zones 192.0.2.1` prints the zones that
+    point at 192.0.2.1."""
+    with _open_inventory() as store:
+        records = store.search(pattern, record_type)
+    if zones_only:
+        for zone_name in dict.fromkeys(record.zone for record in records):
+            print(zone_name)
+        return
+    WRITERS[output_format](itertools.groupby(records, key=lambda r: r.zone))
+
+
+@inventory_group.command()
+@click.argument("zone_name", required=False)
+@click.option("--limit", default=100, show_default=True, help="the number of changes")
+def changes(zone_name, limit):
+    """Show the last changes found by refresh (in zone_name)."""
+    with _open_inventory() as store:
+        recorded = store.changes(zone_name, limit)
+    for change in reversed(recorded):
+        fetched = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(change["time"]))
+        print(f"{fetched} {_format_change(change['zone_name'], change)}")
@@ -21,20 +21,180 @@
 
 """Request Let's encrypt certificates for All-Inkl.com domains with Certbot"""
 
+import contextlib
+import fcntl
+import hashlib
+import json
 import logging
+import os
+import time
 
 import click
 
 import kasserver
+from kasserver import daemon, metrics, output, profiling, propagation
 
 LOGGER = logging.getLogger("kasserver_dns_certbot")
 
+# Seconds after which queued challenges are considered left by an aborted run
+QUEUE_TTL = 600
+
+
+@contextlib.contextmanager
+def _challenge_state(domains):
+    """Lock and load the state of a Certbot run
+
+    The state holds the queued `challenges` and the ids of the added TXT
+    `records` for the cleanup hooks. Each set of domains has its own state,
+    so concurrent runs for other certificates do not interfere. The state is
+    saved even if the run fails, so the ids of added records are kept."""
+    digest = hashlib.sha256(domains.encode("utf-8")).hexdigest()[:16]
+    # pylint: disable-next=protected-access
+    path = os.path.join(kasserver._cache_dir(), f"certbot-challenges-{digest}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+", encoding="utf-8") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        file.seek(0)
+        try:
+            state = json.loads(file.read() or "{}")
+        except ValueError:
+            state = {}
+        state = {
+            "domains": domains,
+            "challenges": state.get("challenges", []),
+            "records": state.get("records", {}),
+        }
+        try:
+            yield state
+        finally:
+            file.seek(0)
+            file.truncate()
+            json.dump(state, file)
+
+
+def _queued_challenges(state, domains, remaining):
+    """Get the queued challenges of the current run
+
+    Challenges of an aborted run are dropped: they are older than QUEUE_TTL
+    or more than the challenges of the domains that precede this one."""
+    now = time.time()
+    queued = [item for item in state["challenges"] if now - item[2] < QUEUE_TTL]
+    if domains:
+        expected = max(len(domains.split(",")) - 1 - remaining, 0)
+        queued = queued[len(queued) - expected :] if expected else []
+    for fqdn, value, _ in (item for item in state["challenges"] if item not in queued):
+        LOGGER.warning("Dropping challenge %s %s of an earlier run", fqdn, value)
+    return queued
+
+
+def _key(fqdn, value):
+    return f"{fqdn} {value}"
+
+
+def _authenticate(kas, challenges, records):
+    """Add the TXT records of the challenges and get the results
+
+    Each zone is read once. Records that already hold the value are kept and
+    other values of the same name (e.g. of a sibling challenge for a
+    wildcard domain) are not touched. Failed challenges have no result. The
+    ids of added records are stored in records right away."""
+    results = []
+    for fqdn, value in challenges:
+        LOGGER.info("Setting DNS TXT record for domain %s to %s", fqdn, value)
+        try:
+            record_id = kas.add_dns_record(fqdn, "TXT", value, replace=False)
+        except (kasserver.zeep.exceptions.Fault, daemon.DaemonError) as err:
+            LOGGER.error("Failed to add %s: %s", fqdn, err)
+            continue
+        records[_key(fqdn, value)] = record_id
+        results.append(output.result("add", fqdn, "TXT", value, record_id))
+    return results
+
+
+def _auth_record_id(auth_output, fqdn, value):
+    """Get the record id of a challenge from the authentication hook output
+
+    The output is the id or the results in a machine readable format."""
+    auth_output = auth_output.strip()
+    if auth_output.isdigit():
+        return auth_output
+    try:
+        results = output.parse(auth_output)
+    except ValueError:
+        results = []
+    for item in results:
+        if (item.get("fqdn"), item.get("data")) == (fqdn, value) and item.get(
+            "record_id"
+        ):
+            return str(item["record_id"])
+    return None
+
+
+def _cleanup(domains, challenge, auth_output, output_format):
+    """Remove the TXT record of a challenge
+
+    The record is deleted by its id (printed by the authentication hook or
+    stored for queued challenges) without reading the zone. Without id only
+    the record that holds the value is removed."""
+    fqdn, value = challenge
+    with _challenge_state(domains) as state:
+        record_id = state["records"].pop(_key(fqdn, value), None)
+    record_id = _auth_record_id(auth_output, fqdn, value) or record_id
+    LOGGER.info("Removing DNS TXT record for domain %s", fqdn)
+    kas = daemon.connect(shared_pacing=True)
+    record_id = kas.delete_dns_record(fqdn, "TXT", value, record_id=record_id)
+    output.write(
+        output_format, [output.result("delete", fqdn, "TXT", value, record_id)]
+    )
+
 
 @click.command()
 @click.argument("fqdn", envvar="CERTBOT_DOMAIN")
 @click.argument("value", envvar="CERTBOT_VALIDATION")
-@click.version_option(kasserver.__version__)
-def cli(fqdn, value):
+@click.option(
+    "--remaining",
+    envvar="CERTBOT_REMAINING_CHALLENGES",
+    default=0,
+    help="number of challenges that follow (queued until the last one)",
+)
+@click.option(
+    "--all-domains",
+    envvar="CERTBOT_ALL_DOMAINS",
+    default="",
+    help="the domains of the certificate",
+)
+@click.option(
+    "--auth-output",
+    envvar="CERTBOT_AUTH_OUTPUT",
+    default="",
+    help="the record id printed by the authentication hook",
+)
+@click.option(
+    "--cleanup/--auth",
+    default=None,
+    help="run as cleanup or authentication hook  [default: cleanup if "
+    "$CERTBOT_AUTH_OUTPUT is set]",
+)
+@click.option(
+    "--propagation-timeout",
+    envvar="KASSERVER_PROPAGATION_TIMEOUT",
+    default=0,
+    help="seconds to wait until the nameservers serve new records",
+)
+@output.output_option
+@metrics.stats_options
+@profiling.profile_option
+@click.version_option(package_name="kasserver")
+def cli(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    fqdn,
+    value,
+    remaining,
+    all_domains,
+    auth_output,
+    cleanup,
+    propagation_timeout,
+    output_format,
+):
     """Request Let's encrypt (wildcard) certificates for All-Inkl.com domains.
 
     This program is designed to be used with Certbot (https://certbot.eff.org)
@@ -44,20 +204,48 @@ def cli(fqdn, value):
     --manual --manual-auth-hook kasserver-dns-certbot
     --manual-cleanup-hook kasserver-dns-certbot -m invalid@example.com
 
+    Challenges of certificates with multiple domains are collected until the
+    last one and then written together with as few requests as possible.
+    The authentication hook prints the id of the added record (or with
+    --output the results of all written challenges), which Certbot passes to
+    the cleanup hook to delete the record without reading the zone.
+    With --propagation-timeout the hook returns as soon as all authoritative
+    nameservers serve the new records.
+
     See https://certbot.eff.org/docs/using.html#hooks more detailed
     information."""
     logging.basicConfig(level=logging.INFO)
     LOGGER.info("Received request for fqdn %s and value %a", fqdn, value)
-    kas = kasserver.KasServer()
-    fqdn = f"_acme-challenge.{fqdn}"
-    record = kas.get_dns_record(fqdn, "TXT")
-    if record:
-        LOGGER.info(
-            "Removing existing DNS TXT record for domain %s with value %s",
-            fqdn,
-            record["data"],
+    if cleanup is None:
+        cleanup = "CERTBOT_AUTH_OUTPUT" in os.environ
+    challenge = (f"_acme-challenge.{fqdn}", value)
+    if cleanup:
+        _cleanup(all_domains, challenge, auth_output, output_format)
+        return
+    with _challenge_state(all_domains) as state:
+        queued = _queued_challenges(state, all_domains, remaining)
+        if remaining > 0:
+            state["challenges"] = [*queued, [*challenge, time.time()]]
+            LOGGER.info("Queued challenge, %d remaining", remaining)
+            return
+        challenges = [tuple(item[:2]) for item in queued] + [challenge]
+        state["challenges"] = []
+        kas = daemon.connect(cache_ttl=60, shared_pacing=True)
+        results = _authenticate(kas, challenges, state["records"])
+        # The id of this challenge is printed for its cleanup hook
+        record_id = state["records"].pop(_key(*challenge), None)
+
+    if output_format != "text":
+        output.write(output_format, results)
+    elif record_id:
+        click.echo(record_id)
+    if len(results) < len(challenges):
+        raise click.ClickException(
+            f"{len(challenges) - len(results)} of {len(challenges)} changes failed"
+        )
+    if propagation_timeout and not propagation.wait(
+        kas, challenges, propagation_timeout
+    ):
+        raise click.ClickException(
+            f"Records are not served after {propagation_timeout} seconds"
         )
-        kas.delete_dns_record(fqdn, "TXT")
-    if not record or record["data"] != value:
-        LOGGER.info("Setting DNS TXT record for domain %s to %s", fqdn, value)
-        kas.add_dns_record(fqdn, "TXT", value)
@@ -25,13 +25,15 @@ import logging
 
 import click
 
-import kasserver
+from kasserver import daemon, metrics, output, profiling, propagation
 
 LOGGER = logging.getLogger("kasserver_dns_lego")
 
 
 @click.group()
-@click.version_option(kasserver.__version__)
+@metrics.stats_options
+@profiling.profile_option
+@click.version_option(package_name="kasserver")
 def cli():
     """Request Let's encrypt (wildcard) certificates for All-Inkl.com domains.
 
@@ -56,22 +58,40 @@ def cli():
 @click.argument("fqdn")
 @click.argument("value")
 @click.argument("ttl", required=False)
-def present(fqdn, value, ttl):
+@click.option(
+    "--propagation-timeout",
+    envvar="KASSERVER_PROPAGATION_TIMEOUT",
+    default=0,
+    help="seconds to wait until the nameservers serve the record",
+)
+@output.output_option
+def present(fqdn, value, ttl, propagation_timeout, output_format):
     """Add a DNS record for fqdn with value (and ttl)."""
     LOGGER.info(
         "Setting DNS TXT record for domain %s to %s (TTL: %s)", fqdn, value, ttl
     )
-    kas = kasserver.KasServer()
-    kas.add_dns_record(fqdn, "TXT", value, ttl)
+    kas = daemon.connect(shared_pacing=True)
+    record_id = kas.add_dns_record(fqdn, "TXT", value, ttl, replace=False)
+    output.write(output_format, [output.result("add", fqdn, "TXT", value, record_id)])
+    if propagation_timeout and not propagation.wait(
+        kas, [(fqdn, value)], propagation_timeout
+    ):
+        raise click.ClickException(
+            f"Record is not served after {propagation_timeout} seconds"
+        )
 
 
 @cli.command()
 @click.argument("fqdn")
 @click.argument("value")
 @click.argument("ttl", required=False)
-def cleanup(fqdn, value, ttl):
+@output.output_option
+def cleanup(fqdn, value, ttl, output_format):
     """Remove a DNS record for fqdn with value (and ttl)."""
     # pylint: disable=unused-argument
     LOGGER.info("Removing DNS TXT record for domain %s", fqdn)
-    kas = kasserver.KasServer()
-    kas.delete_dns_record(fqdn, "TXT")
+    kas = daemon.connect(shared_pacing=True)
+    record_id = kas.delete_dns_record(fqdn, "TXT", value)
+    output.write(
+        output_format, [output.result("delete", fqdn, "TXT", value, record_id)]
+    )
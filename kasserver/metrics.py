@@ -0,0 +1,265 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Metrics of the requests to the KAS server API
+
+Every request of a KasServer is reported as RequestMetrics to the observers
+that were registered with add_observer()."""
+
+import functools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+_OBSERVERS = []
+
+
+class RequestMetrics:
+    """Timings (in seconds) and outcome of a single KAS API request
+
+    wait is the time spent waiting for the flood delay (or for other
+    processes sharing it), latency the time of the HTTP round trips and
+    decode the time zeep spent on the responses. retries counts repeated
+    requests (after flood protection faults or for a new session). fault is
+    the fault string (or exception name) of a failed request. The decode
+    time of streamed records is spent while iterating and not included."""
+
+    __slots__ = ("request", "wait", "latency", "decode", "retries", "fault")
+
+    def __init__(self, request, **fields):
+        self.request = request
+        self.wait = fields.get("wait", 0.0)
+        self.latency = fields.get("latency", 0.0)
+        self.decode = fields.get("decode", 0.0)
+        self.retries = fields.get("retries", 0)
+        self.fault = fields.get("fault")
+
+    def as_dict(self):
+        """Get the metrics as dict"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return f"RequestMetrics({self.as_dict()!r})"
+
+
+class Observer:  # pylint: disable=too-few-public-methods
+    """Interface of the observers that receive the metrics of every request"""
+
+    def observe(self, metrics):
+        """Handle the RequestMetrics of a finished request"""
+        raise NotImplementedError
+
+
+def add_observer(observer):
+    """Report the metrics of all further requests to observer"""
+    _OBSERVERS.append(observer)
+
+
+def remove_observer(observer):
+    """Stop reporting metrics to observer"""
+    _OBSERVERS.remove(observer)
+
+
+def observing():
+    """Check whether any observer is registered"""
+    return bool(_OBSERVERS)
+
+
+def notify(metrics):
+    """Report metrics to all observers, errors of observers are logged"""
+    for observer in list(_OBSERVERS):
+        try:
+            observer.observe(metrics)
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("Observer %r failed", observer)
+
+
+class LogObserver(Observer):  # pylint: disable=too-few-public-methods
+    """Log a structured line (key=value pairs) for every request
+
+    The metrics are also attached to the log records as `kas_metrics` for
+    formatters that emit JSON."""
+
+    def __init__(self, logger=LOGGER, level=logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def observe(self, metrics):
+        fields = metrics.as_dict()
+        line = " ".join(
+            f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in fields.items()
+            if value is not None
+        )
+        self.logger.log(self.level, "%s", line, extra={"kas_metrics": fields})
+
+
+class StatsCollector(Observer):
+    """Aggregate the metrics per request type
+
+    The totals are available as dict (as_dict), as text summary (summary)
+    and in the Prometheus text format (prometheus). write() exports them to
+    a JSON file or a Prometheus textfile (*.prom)."""
+
+    COUNTERS = ("count", "wait", "latency", "decode", "retries")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, metrics):
+        with self._lock:
+            stats = self._stats.setdefault(
+                metrics.request,
+                {**dict.fromkeys(self.COUNTERS, 0), "faults": {}},
+            )
+            stats["count"] += 1
+            stats["wait"] += metrics.wait
+            stats["latency"] += metrics.latency
+            stats["decode"] += metrics.decode
+            stats["retries"] += metrics.retries
+            if metrics.fault:
+                faults = stats["faults"]
+                faults[metrics.fault] = faults.get(metrics.fault, 0) + 1
+
+    def as_dict(self):
+        """Get the totals per request type"""
+        with self._lock:
+            return {
+                request: {**stats, "faults": dict(stats["faults"])}
+                for request, stats in sorted(self._stats.items())
+            }
+
+    def summary(self):
+        """Get a table with the totals per request type"""
+        stats = self.as_dict()
+        if not stats:
+            return "No KAS API requests (requests of kasserver-daemon are not counted)"
+        lines = [
+            f"{'Request':24} {'Count':>5} {'Wait':>8} {'Latency':>8} "
+            f"{'Decode':>8} {'Retries':>7} {'Faults':>6}"
+        ]
+        for values in stats.values():
+            values["faults"] = sum(values["faults"].values())
+        stats["Total"] = {
+            counter: sum(values[counter] for values in stats.values())
+            for counter in (*self.COUNTERS, "faults")
+        }
+        for request, values in stats.items():
+            lines.append(
+                f"{request:24} {values['count']:>5} {values['wait']:>7.2f}s "
+                f"{values['latency']:>7.2f}s {values['decode']:>7.2f}s "
+                f"{values['retries']:>7} {values['faults']:>6}"
+            )
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Get the totals in the Prometheus text exposition format"""
+        metrics = (
+            ("requests_total", "count", "counter", "KAS API requests"),
+            ("wait_seconds_total", "wait", "counter", "Time waited for flood delay"),
+            ("latency_seconds_total", "latency", "counter", "Time of HTTP requests"),
+            ("decode_seconds_total", "decode", "counter", "Time decoding responses"),
+            ("retries_total", "retries", "counter", "Repeated KAS API requests"),
+        )
+        stats = self.as_dict()
+        lines = []
+        for name, counter, metric_type, description in metrics:
+            lines += [
+                f"# HELP kasserver_{name} {description}.",
+                f"# TYPE kasserver_{name} {metric_type}",
+            ]
+            lines += [
+                f'kasserver_{name}{{request="{request}"}} {values[counter]}'
+                for request, values in stats.items()
+            ]
+        lines += [
+            "# HELP kasserver_faults_total Failed KAS API requests.",
+            "# TYPE kasserver_faults_total counter",
+        ]
+        lines += [
+            f'kasserver_faults_total{{request="{request}",fault={json.dumps(fault)}}}'
+            f" {count}"
+            for request, values in stats.items()
+            for fault, count in values["faults"].items()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Replace path with the totals as Prometheus textfile (*.prom) or JSON"""
+        if path.endswith(".prom"):
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.as_dict(), indent=2) + "\n"
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, delete=False, encoding="utf-8"
+        ) as file:
+            file.write(content)
+        os.replace(file.name, path)
+
+
+def _collector(ctx):
+    if "kasserver.stats" not in ctx.meta:
+        collector = StatsCollector()
+        add_observer(collector)
+        ctx.call_on_close(functools.partial(remove_observer, collector))
+        ctx.meta["kasserver.stats"] = collector
+    return ctx.meta["kasserver.stats"]
+
+
+def _print_stats(ctx, _param, value):
+    if value:
+        collector = _collector(ctx)
+        ctx.call_on_close(lambda: print(collector.summary(), file=sys.stderr))
+
+
+def _write_stats(ctx, _param, path):
+    if path:
+        ctx.call_on_close(functools.partial(_collector(ctx).write, path))
+
+
+def stats_options(function):
+    """Add the --stats and --stats-file options to a click command"""
+    import click  # pylint: disable=import-outside-toplevel
+
+    function = click.option(
+        "--stats-file",
+        type=click.Path(dir_okay=False),
+        envvar="KASSERVER_STATS_FILE",
+        expose_value=False,
+        callback=_write_stats,
+        help="write request metrics as JSON or Prometheus textfile (*.prom)",
+    )(function)
+    return click.option(
+        "--stats",
+        is_flag=True,
+        default=False,
+        expose_value=False,
+        callback=_print_stats,
+        help="print a summary of the KAS API requests on exit",
+    )(function)
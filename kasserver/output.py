@@ -0,0 +1,94 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Machine readable output of the command line utilities
+
+Results are dicts that are written as a JSON array, as newline delimited
+JSON (one object per line, flushed right away so that consumers such as jq
+can process them while they are written) or as CSV."""
+
+import csv
+import json
+import sys
+
+import click
+
+FORMATS = ("text", "json", "ndjson", "csv")
+
+# Fields of the results of record changes
+FIELDS = ("action", "fqdn", "type", "data", "record_id")
+
+
+def output_option(function, formats=FORMATS, default="text", aliases=()):
+    """Decorator adding the --output option (KASSERVER_OUTPUT) to a command
+
+    Commands that write other things than results pass their own formats,
+    default and further names of the option in aliases."""
+    return click.option(
+        *aliases,
+        "--output",
+        "output_format",
+        type=click.Choice(formats),
+        default=default,
+        envvar="KASSERVER_OUTPUT",
+        show_default=True,
+        help="the format of the results on stdout",
+    )(function)
+
+
+def result(action, fqdn, record_type, data=None, record_id=None):
+    """Get the result of a record change"""
+    return dict(zip(FIELDS, (action, fqdn, record_type, data, record_id)))
+
+
+def write(output_format, results, fields=FIELDS):
+    """Write results in a machine readable format (nothing for text)
+
+    results may be an iterator, only json collects them before writing."""
+    if output_format == "json":
+        print(json.dumps(list(results)))
+    elif output_format == "ndjson":
+        for item in results:
+            print(json.dumps(item), flush=True)
+    elif output_format == "csv":
+        writer = csv.DictWriter(
+            sys.stdout, fields, lineterminator="\n", extrasaction="ignore"
+        )
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def parse(text):
+    """Get the results written in any of the machine readable formats"""
+    text = text.strip()
+    if text.startswith(("[", "{")):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return [json.loads(line) for line in text.splitlines() if line]
+        return data if isinstance(data, list) else [data]
+    if text.startswith(FIELDS[0]):
+        return [
+            {key: value or None for key, value in row.items()}
+            for row in csv.DictReader(text.splitlines())
+        ]
+    return []
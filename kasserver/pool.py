@@ -0,0 +1,224 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Manage the domains of several KAS accounts
+
+The accounts are configured in an INI file ($KASSERVER_ACCOUNTS, by default
+$XDG_CONFIG_HOME/kasserver/accounts.ini) with a section per account login:
+
+    [w0123456]
+    password = PASSWORD
+    zones = example.com example.org
+
+The zones are optional and are otherwise fetched once from the account.
+Without the file the accounts are read from all ~/.netrc entries of the
+machine kasapi.kasserver.com or a subdomain of it (such as
+w0123456.kasapi.kasserver.com)."""
+
+import collections
+import concurrent.futures
+import configparser
+import logging
+import os
+import threading
+
+import kasserver
+from kasserver import zones
+
+LOGGER = logging.getLogger(__name__)
+
+Account = collections.namedtuple("Account", ("username", "password", "zones"))
+Account.__doc__ = "Credentials (and optionally the zone names) of a KAS account"
+
+
+class AccountNotFoundError(LookupError):
+    """No configured account manages the zone of a name"""
+
+
+def accounts_path():
+    """Get the path of the accounts file"""
+    if os.environ.get("KASSERVER_ACCOUNTS"):
+        return os.environ["KASSERVER_ACCOUNTS"]
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.path.join(config_home, "kasserver", "accounts.ini")
+
+
+def configured():
+    """Check if the accounts file is used (without $KASSERVER_USER)"""
+    return not os.environ.get("KASSERVER_USER") and os.path.exists(accounts_path())
+
+
+def load_accounts(path=None):
+    """Load the accounts from the accounts file or else from ~/.netrc"""
+    path = path if path else accounts_path()
+    if os.path.exists(path):
+        if os.stat(path).st_mode & 0o077:
+            LOGGER.warning("%s should be accessible only by your user", path)
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(path, encoding="utf-8")
+        return [
+            Account(
+                username,
+                section.get("password"),
+                tuple(section.get("zones", "").replace(",", " ").split()),
+            )
+            for username, section in config.items()
+            if username != configparser.DEFAULTSECT
+        ]
+    # pylint: disable-next=protected-access
+    hosts = kasserver._load_netrc().hosts
+    return [
+        Account(login, password, ())
+        for machine, (login, _, password) in hosts.items()
+        if machine == kasserver.NETRC_MACHINE
+        or machine.endswith(f".{kasserver.NETRC_MACHINE}")
+    ]
+
+
+class KasServerPool:
+    """Route the requests for DNS records to the account that owns the zone
+
+    Every account has its own KasServer (and thereby its own flood delay),
+    so that requests for zones of different accounts are sent in parallel
+    when the pool is used from several threads or with apply()."""
+
+    def __init__(self, accounts=None, **kwargs):
+        """Create clients for accounts (by default load_accounts())
+
+        kwargs are passed to KasServer when the client of an account is
+        created on first use, except for a pacer (every account has its
+        own)."""
+        accounts = load_accounts() if accounts is None else accounts
+        self._accounts = {account.username: account for account in accounts}
+        kwargs.pop("pacer", None)
+        self._kwargs = kwargs
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._owners = None
+        self._resolver = None
+
+    @property
+    def accounts(self):
+        """The names of the accounts"""
+        return list(self._accounts)
+
+    def client(self, username):
+        """Get the KasServer of an account"""
+        with self._lock:
+            if username not in self._clients:
+                account = self._accounts[username]
+                self._clients[username] = kasserver.KasServer(
+                    credentials=(account.username, account.password),
+                    zone_names=account.zones,
+                    **self._kwargs,
+                )
+            return self._clients[username]
+
+    def _fetch_domains(self, username):
+        return self.client(username).get_domains()
+
+    def _index(self):
+        """Get the accounts by zone name, fetching unconfigured zones once"""
+        with self._index_lock:
+            if self._owners is None:
+                missing = [
+                    name for name, item in self._accounts.items() if not item.zones
+                ]
+                with concurrent.futures.ThreadPoolExecutor(
+                    max(len(missing), 1)
+                ) as executor:
+                    fetched = dict(
+                        zip(missing, executor.map(self._fetch_domains, missing))
+                    )
+                owners = {}
+                for name, account in self._accounts.items():
+                    for zone in fetched.get(name, account.zones):
+                        owners[zone.rstrip(".").lower()] = name
+                self._resolver = zones.ZoneResolver(owners)
+                self._owners = owners
+            return self._owners
+
+    def account(self, fqdn):
+        """Get the name of the account that owns the zone of fqdn"""
+        if len(self._accounts) == 1:
+            return next(iter(self._accounts))
+        owners = self._index()
+        zone_name = self._resolver.split(fqdn)[1].rstrip(".").lower()
+        if zone_name not in owners:
+            raise AccountNotFoundError(f"No account manages zone {zone_name}")
+        return owners[zone_name]
+
+    def _route(self, fqdn):
+        return self.client(self.account(fqdn))
+
+    def get_domains(self):
+        """Get the sorted names of the domains of all accounts"""
+        return sorted(self._index())
+
+    def get_dns_records(self, fqdn):
+        """Get list of DNS records (see KasServer.get_dns_records)"""
+        return self._route(fqdn).get_dns_records(fqdn)
+
+    def iter_dns_records(self, fqdn):
+        """Iterate over DNS records (see KasServer.iter_dns_records)"""
+        return self._route(fqdn).iter_dns_records(fqdn)
+
+    def get_dns_record(self, fqdn, *args, **kwargs):
+        """Get a DNS record (see KasServer.get_dns_record)"""
+        return self._route(fqdn).get_dns_record(fqdn, *args, **kwargs)
+
+    def add_dns_record(self, fqdn, *args, **kwargs):
+        """Add or update a DNS record (see KasServer.add_dns_record)"""
+        return self._route(fqdn).add_dns_record(fqdn, *args, **kwargs)
+
+    def delete_dns_record(self, fqdn, *args, **kwargs):
+        """Remove a DNS record (see KasServer.delete_dns_record)"""
+        return self._route(fqdn).delete_dns_record(fqdn, *args, **kwargs)
+
+    def invalidate_cache(self, fqdn=None):
+        """Drop cached DNS records (see KasServer.invalidate_cache)"""
+        clients = [self._route(fqdn)] if fqdn else list(self._clients.values())
+        for client in clients:
+            client.invalidate_cache(fqdn)
+
+    def apply(self, changes):
+        """Apply DnsChange objects (see KasServer.apply)
+
+        The changes of every account are applied in parallel."""
+        by_account = collections.defaultdict(list)
+        for index, change in enumerate(changes):
+            by_account[self.account(change.fqdn)].append(index)
+
+        def apply_account(item):
+            username, indexes = item
+            return indexes, self.client(username).apply([changes[i] for i in indexes])
+
+        results = [None] * len(changes)
+        total = {"results": results, "round_trips": 0, "wait_time": 0.0}
+        with concurrent.futures.ThreadPoolExecutor(max(len(by_account), 1)) as executor:
+            for indexes, result in executor.map(apply_account, by_account.items()):
+                for index, item in zip(indexes, result["results"]):
+                    results[index] = item
+                total["round_trips"] += result["round_trips"]
+                total["wait_time"] += result["wait_time"]
+        return total
@@ -0,0 +1,152 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Profile the command line utilities
+
+With --profile (or $KASSERVER_PROFILE) a command runs under cProfile. The
+statistics are written to a file for pstats (or viewers like snakeviz) and
+a summary of the time per phase and of the most expensive functions is
+printed on stderr. The phases are taken from the cumulative time of the
+functions that implement them, so the profile adds no instrumentation to
+the requests. Only the main thread is profiled."""
+
+import cProfile
+import functools
+import io
+import pstats
+import sys
+import time
+
+DEFAULT_PATH = "kasserver.prof"
+
+# Functions (file name suffix, function name) whose cumulative time makes up
+# a phase. zeep is imported on demand while the client is created, so the
+# imports are partly included in the client construction.
+PHASES = (
+    ("imports", (("<frozen importlib._bootstrap>", "_find_and_load"),)),
+    (
+        "client",
+        (
+            ("kasserver/__init__.py", "_create_client"),
+            ("kasserver/__init__.py", "_bind"),
+        ),
+    ),
+    (
+        "credentials",
+        (
+            ("kasserver/__init__.py", "_get_credentials"),
+            ("kasserver/pool.py", "load_accounts"),
+        ),
+    ),
+    (
+        "wait",
+        (
+            ("kasserver/__init__.py", "_sleep"),
+            ("kasserver/__init__.py", "lock"),
+            ("kasserver/__init__.py", "__enter__"),
+        ),
+    ),
+    (
+        "serialize",
+        (
+            ("kasserver/__init__.py", "_build_request"),
+            ("zeep/wsdl/bindings/soap.py", "_create"),
+        ),
+    ),
+    ("network", (("kasserver/transport.py", "send"),)),
+    (
+        "decode",
+        (
+            ("zeep/wsdl/bindings/soap.py", "process_reply"),
+            ("kasserver/__init__.py", "_decode"),
+            ("kasserver/__init__.py", "_parse_records"),
+        ),
+    ),
+)
+
+
+def phases(stats):
+    """Get the cumulative seconds per phase of pstats.Stats"""
+    totals = dict.fromkeys((name for name, _ in PHASES), 0.0)
+    for (filename, _, function), values in stats.stats.items():
+        for name, functions in PHASES:
+            if any(
+                function == candidate and filename.endswith(suffix)
+                for suffix, candidate in functions
+            ):
+                totals[name] += values[3]
+    return totals
+
+
+def summary(stats, startup, wall_time, limit=15):
+    """Get the phases and the functions with the highest cumulative time"""
+    lines = [
+        f"{'Phase':12} {'Time':>8}",
+        f"{'startup':12} {startup:>7.3f}s (CPU time before the command)",
+    ]
+    lines += [f"{name:12} {seconds:>7.3f}s" for name, seconds in phases(stats).items()]
+    lines.append(f"{'total':12} {wall_time:>7.3f}s")
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return "\n".join(lines) + "\n" + stream.getvalue()
+
+
+def _finish(profiler, path, startup, started):
+    profiler.disable()
+    wall_time = time.perf_counter() - started
+    profiler.dump_stats(path)
+    stats = pstats.Stats(profiler)
+    print(summary(stats, startup, wall_time), file=sys.stderr)
+    print(f"Profile written to {path}", file=sys.stderr)
+
+
+def _start_profile(ctx, _param, path):
+    if not path:
+        return
+    commands = getattr(ctx.command, "commands", {})
+    if path in commands:
+        import click  # pylint: disable=import-outside-toplevel
+
+        raise click.UsageError(f"Use --profile=PATH to profile the {path} command.")
+    startup = time.process_time()
+    started = time.perf_counter()
+    profiler = cProfile.Profile()
+    ctx.call_on_close(functools.partial(_finish, profiler, path, startup, started))
+    profiler.enable()
+
+
+def profile_option(function):
+    """Add the --profile[=PATH] option ($KASSERVER_PROFILE) to a click command"""
+    import click  # pylint: disable=import-outside-toplevel
+
+    return click.option(
+        "--profile",
+        metavar="PATH",
+        is_flag=False,
+        flag_value=DEFAULT_PATH,
+        envvar="KASSERVER_PROFILE",
+        expose_value=False,
+        callback=_start_profile,
+        help=f"profile the command and write the statistics to PATH "
+        f"(default {DEFAULT_PATH})",
+    )(function)
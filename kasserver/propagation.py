@@ -0,0 +1,215 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Wait until DNS records are served by the authoritative nameservers"""
+
+import concurrent.futures
+import functools
+import logging
+import random
+import socket
+import struct
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+TYPE_TXT = 16
+CLASS_IN = 1
+
+# Seconds to wait for the answer of a single query
+QUERY_TIMEOUT = 2.0
+
+
+class DnsError(Exception):
+    """A nameserver sent an invalid or failed response"""
+
+
+def _query(qname, query_id):
+    """Build a non-recursive TXT query
+
+    Internationalized names are encoded with IDNA."""
+    header = struct.pack("!HHHHHH", query_id, 0, 1, 0, 0, 0)
+    labels = b"".join(
+        bytes([len(label)]) + label
+        for label in qname.rstrip(".").encode("idna").split(b".")
+    )
+    return header + labels + b"\0" + struct.pack("!HH", TYPE_TXT, CLASS_IN)
+
+
+def _skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+        if not length:
+            return offset
+
+
+def _txt_data(rdata):
+    """Join the character strings of a TXT record"""
+    strings, offset = [], 0
+    while offset < len(rdata):
+        length = rdata[offset]
+        strings.append(rdata[offset + 1 : offset + 1 + length])
+        offset += 1 + length
+    return b"".join(strings).decode("utf-8", "replace")
+
+
+def _parse_response(data, query_id):
+    """Get the TXT records and the truncation flag of a response"""
+    try:
+        response_id, flags, questions, answers, _, _ = struct.unpack_from(
+            "!HHHHHH", data
+        )
+        if response_id != query_id or not flags & 0x8000:
+            raise DnsError("Unexpected DNS response")
+        if flags & 0xF == 3:  # NXDOMAIN
+            return [], False
+        if flags & 0xF:
+            raise DnsError(f"DNS query failed with rcode {flags & 0xF}")
+        offset = 12
+        for _ in range(questions):
+            offset = _skip_name(data, offset) + 4
+        records = []
+        for _ in range(answers):
+            offset = _skip_name(data, offset)
+            record_type, _, _, length = struct.unpack_from("!HHIH", data, offset)
+            offset += 10
+            if record_type == TYPE_TXT:
+                records.append(_txt_data(data[offset : offset + length]))
+            offset += length
+    except (IndexError, struct.error) as err:
+        raise DnsError("Malformed DNS response") from err
+    return records, bool(flags & 0x200)
+
+
+def _recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise DnsError("Connection closed by nameserver")
+        data += chunk
+    return data
+
+
+def query_txt(address, fqdn, timeout=QUERY_TIMEOUT):
+    """Query the TXT records of fqdn from the nameserver at address
+
+    address is a (host, port) tuple. Truncated answers are repeated over
+    TCP."""
+    query_id = random.getrandbits(16)
+    message = _query(fqdn, query_id)
+    family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.send(message)
+        records, truncated = _parse_response(sock.recv(65535), query_id)
+    if truncated:
+        with socket.create_connection(address, timeout) as sock:
+            sock.sendall(struct.pack("!H", len(message)) + message)
+            length = struct.unpack("!H", _recv_exactly(sock, 2))[0]
+            records, _ = _parse_response(_recv_exactly(sock, length), query_id)
+    return records
+
+
+def nameservers(records, port=53):
+    """Get the addresses of the authoritative nameservers of a zone
+
+    records are the DNS records of the zone as returned by
+    KasServer.get_dns_records()."""
+    addresses = []
+    for record in records:
+        if record["type"] != "NS" or record["name"]:
+            continue
+        try:
+            info = socket.getaddrinfo(
+                record["data"].rstrip("."), port, type=socket.SOCK_DGRAM
+            )
+        except socket.gaierror as err:
+            LOGGER.warning("Cannot resolve nameserver %s: %s", record["data"], err)
+            continue
+        addresses.append(info[0][4][:2])
+    return addresses
+
+
+def _serves(address, fqdn, value, timeout):
+    try:
+        return value in query_txt(address, fqdn, timeout)
+    except (OSError, UnicodeError, DnsError) as err:
+        LOGGER.debug("Querying %s failed: %s", address[0], err)
+        return False
+
+
+def wait_for_txt(addresses, fqdn, value, timeout=120, interval=2.0):
+    """Wait until all nameservers serve a TXT record of fqdn with value
+
+    The nameservers are queried in parallel every interval seconds until all
+    of them answer with the value or timeout seconds have passed.
+
+    Returns the addresses of the nameservers that do not serve the value."""
+    pending = list(addresses)
+    deadline = time.monotonic() + timeout
+    with concurrent.futures.ThreadPoolExecutor(max(len(pending), 1)) as executor:
+        while pending:
+            query_timeout = min(QUERY_TIMEOUT, max(deadline - time.monotonic(), 0.1))
+            served = executor.map(
+                functools.partial(
+                    _serves, fqdn=fqdn, value=value, timeout=query_timeout
+                ),
+                pending,
+            )
+            pending = [address for address, ok in zip(pending, served) if not ok]
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            LOGGER.info("Waiting for %d nameservers to serve %s", len(pending), fqdn)
+            time.sleep(min(interval, remaining))
+    return pending
+
+
+def wait(kas, records, timeout=120, port=53):
+    """Wait until the (fqdn, value) TXT records are served
+
+    The authoritative nameservers are taken from the NS records of the zone
+    of each fqdn. Returns False if timeout seconds passed before all
+    nameservers served all records or if a zone has no nameservers."""
+    deadline = time.monotonic() + timeout
+    propagated = True
+    for fqdn, value in records:
+        addresses = nameservers(kas.get_dns_records(fqdn), port)
+        if not addresses:
+            LOGGER.warning("No nameservers found for %s", fqdn)
+            propagated = False
+            continue
+        remaining = max(deadline - time.monotonic(), 0)
+        pending = wait_for_txt(addresses, fqdn, value, remaining)
+        if pending:
+            LOGGER.warning(
+                "DNS TXT record for domain %s is not served by %s",
+                fqdn,
+                ", ".join(address[0] for address in pending),
+            )
+            propagated = False
+    return propagated
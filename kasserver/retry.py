@@ -0,0 +1,205 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Retrying failed requests to the KAS server API"""
+
+import collections
+import logging
+import random
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# Error classes that are retried, see RetryPolicy.classify()
+FLOOD, CONNECTION, TIMEOUT, SERVER = "flood", "connection", "timeout", "server"
+
+
+class DeadlineExceeded(TimeoutError):
+    """A request cannot be completed before the deadline"""
+
+
+class CircuitOpenError(ConnectionError):
+    """Requests fail fast because the KAS server API is unavailable"""
+
+
+class RetryPolicy:
+    """Limits and backoff for retrying failed requests
+
+    Requests rejected by the flood protection are retried up to
+    flood_attempts times after the delay given by the server (plus up to
+    flood_jitter seconds). Connection errors, timeouts and HTTP 5xx
+    responses are retried up to attempts times each with an exponential
+    backoff starting at backoff seconds (at most max_backoff), randomly
+    shortened by up to the fraction jitter. Requests that are not idempotent
+    (adding records) are retried only if they were surely not processed.
+
+    With deadline (in seconds) every request fails with DeadlineExceeded
+    instead of waiting beyond it."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        attempts=3,
+        flood_attempts=10,
+        backoff=1.0,
+        max_backoff=30.0,
+        jitter=0.5,
+        flood_jitter=0.25,
+        deadline=None,
+    ):
+        self.attempts = attempts
+        self.flood_attempts = flood_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.flood_jitter = flood_jitter
+        self.deadline = deadline
+
+    @staticmethod
+    def classify(exc):
+        """Get the error class of an exception (or None if it is not retried)"""
+        # pylint: disable-next=import-outside-toplevel
+        import requests.exceptions
+        import zeep.exceptions  # pylint: disable=import-outside-toplevel
+
+        if isinstance(exc, zeep.exceptions.Fault):
+            return FLOOD if exc.message == "flood_protection" else None
+        if isinstance(exc, requests.exceptions.Timeout):
+            return TIMEOUT
+        if isinstance(exc, requests.exceptions.ConnectionError):
+            return CONNECTION
+        if isinstance(exc, zeep.exceptions.TransportError) and exc.status_code >= 500:
+            return SERVER
+        return None
+
+    @staticmethod
+    def processed(exc):
+        """Check whether a failed request may have been processed by the server"""
+        # pylint: disable-next=import-outside-toplevel
+        import requests.exceptions
+
+        return not isinstance(exc, requests.exceptions.ConnectTimeout)
+
+    def start(self, deadline=None):
+        """Start retrying a request, deadline is an absolute monotonic time"""
+        if self.deadline is not None:
+            own = time.monotonic() + self.deadline
+            deadline = own if deadline is None else min(deadline, own)
+        return Retry(self, deadline)
+
+
+class Retry:
+    """Retries of a single request"""
+
+    def __init__(self, policy, deadline=None):
+        self.policy = policy
+        self.deadline = deadline
+        self.retries = collections.Counter()
+
+    def check(self, wait):
+        """Fail if waiting wait seconds would pass the deadline"""
+        if self.deadline is not None and time.monotonic() + wait > self.deadline:
+            raise DeadlineExceeded(f"Deadline exceeded, request needs to wait {wait}s")
+
+    def delay(self, exc, server_delay=None, idempotent=True):
+        """Get the delay before retrying after exc or None to give up
+
+        Raises DeadlineExceeded if the delay would pass the deadline."""
+        policy = self.policy
+        error = policy.classify(exc)
+        if error is None or (
+            error != FLOOD and not idempotent and policy.processed(exc)
+        ):
+            return None
+        self.retries[error] += 1
+        count = self.retries[error]
+        if count > (policy.flood_attempts if error == FLOOD else policy.attempts):
+            LOGGER.warning("Giving up after %d retries (%s)", count - 1, error)
+            return None
+        if error == FLOOD:
+            delay = (server_delay or 0) + random.uniform(0, policy.flood_jitter)
+        else:
+            delay = min(policy.max_backoff, policy.backoff * 2 ** (count - 1))
+            delay *= random.uniform(1 - policy.jitter, 1)
+            LOGGER.warning("Request failed (%s), retrying in %.1fs", exc, delay)
+        try:
+            self.check(delay)
+        except DeadlineExceeded as err:
+            raise err from exc
+        return delay
+
+
+class CircuitBreaker:
+    """Fail fast while the KAS server API is unavailable
+
+    After threshold consecutive connection errors, timeouts or HTTP 5xx
+    responses the circuit opens and all requests fail with CircuitOpenError
+    for reset_timeout seconds. Then a single trial request is let through
+    that closes the circuit again if it succeeds. A breaker can be shared
+    by several clients."""
+
+    def __init__(self, threshold=5, reset_timeout=60.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """closed, open or half-open"""
+        with self._lock:
+            if self._opened is None:
+                return "closed"
+            if time.monotonic() - self._opened < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def check(self):
+        """Raise CircuitOpenError if no request may be sent now"""
+        with self._lock:
+            if self._opened is None:
+                return
+            remaining = self._opened + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(
+                    f"KAS server API unavailable, retrying after {max(remaining, 0):.0f}s"
+                )
+            self._trial = True
+
+    def success(self):
+        """Record a successful request"""
+        with self._lock:
+            self._failures, self._opened, self._trial = 0, None, False
+
+    def failure(self):
+        """Record a request that failed with an unavailable server"""
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                if self._opened is None or self._trial:
+                    LOGGER.warning("KAS server API unavailable, failing fast")
+                self._opened, self._trial = time.monotonic(), False
@@ -0,0 +1,150 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""HTTP transport configuration for the KAS server API clients"""
+
+import time
+
+import requests
+import requests.adapters
+import zeep
+import zeep.transports
+
+
+class ConnectionStats:
+    """Counters for HTTP requests and the connections that were opened
+
+    Requests that did not open a new connection reused a pooled keep-alive
+    connection. latency is the time in seconds spent sending requests and
+    receiving their responses."""
+
+    def __init__(self):
+        self.requests = 0
+        self.opened = 0
+        self.latency = 0.0
+
+    @property
+    def reused(self):
+        """Number of requests that reused an existing connection"""
+        return self.requests - self.opened
+
+    def as_dict(self):
+        """Get the counters as dict"""
+        return {"requests": self.requests, "opened": self.opened, "reused": self.reused}
+
+
+class _CountingAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter that counts requests and newly opened connections"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        def _counting(pool_class):
+            class _CountingPool(pool_class):  # pylint: disable=too-few-public-methods
+                def _new_conn(self):
+                    stats.opened += 1
+                    return super()._new_conn()
+
+            return _CountingPool
+
+        # Copy the mapping, urllib3 shares it between all pool managers
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: _counting(pool_class)
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ
+        self.stats.requests += 1
+        started = time.monotonic()
+        try:
+            return super().send(request, *args, **kwargs)
+        finally:
+            self.stats.latency += time.monotonic() - started
+
+
+class TransportConfig:
+    """Configuration of the HTTP transport used to talk to the KAS server
+
+    All requests of a client go through a pooled keep-alive session so that
+    connections (and TLS sessions) are reused between requests. Timeouts are
+    given in seconds, proxy is the URL of an HTTP(S) proxy. With compression
+    the server may send gzip (or deflate) compressed responses.
+
+    The counters of all clients that were created with this configuration are
+    available in `stats`."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        connect_timeout=10,
+        read_timeout=60,
+        pool_size=4,
+        proxy=None,
+        compression=True,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.proxy = proxy
+        self.compression = compression
+        self.stats = ConnectionStats()
+
+    def session(self):
+        """Create a requests session with this configuration"""
+        session = requests.Session()
+        adapter = _CountingAdapter(
+            self.stats, pool_connections=1, pool_maxsize=self.pool_size
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = (
+            "gzip, deflate" if self.compression else "identity"
+        )
+        if self.proxy:
+            session.proxies = {"http": self.proxy, "https": self.proxy}
+        return session
+
+    def transport(self, cache=None):
+        """Create a zeep transport with this configuration"""
+        return zeep.Transport(
+            cache=cache,
+            timeout=(self.connect_timeout, self.read_timeout),
+            operation_timeout=(self.connect_timeout, self.read_timeout),
+            session=self.session(),
+        )
+
+    def async_transport(self, cache=None):
+        """Create a zeep transport for asyncio with this configuration
+
+        httpx decodes compressed responses and pools connections by itself,
+        connection counters are not available."""
+        return zeep.transports.AsyncTransport(
+            cache=cache,
+            timeout=self.read_timeout,
+            operation_timeout=self.read_timeout,
+            proxy=self.proxy,
+        )
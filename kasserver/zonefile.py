@@ -0,0 +1,200 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Load desired DNS zone states from JSON, YAML or BIND zone files"""
+
+import json
+import os
+import shlex
+
+FORMATS = ("json", "yaml", "bind")
+
+# Record types whose data ends with a domain name
+TARGET_TYPES = ("CNAME", "MX", "NS", "PTR", "SRV")
+
+
+def load(path, file_format=None):
+    """Load the desired records of one or more zones from a file
+
+    JSON and YAML files map zone names to lists of records with `name`,
+    `type`, `data` and optional `aux` keys. BIND zone files contain a single
+    zone named by `$ORIGIN` (or else by the file name). Without file_format
+    the format is guessed from the file extension.
+
+    Returns a dict mapping zone names to lists of record dicts."""
+    if not file_format:
+        extension = os.path.splitext(path)[1].lower()
+        file_format = {".json": "json", ".yaml": "yaml", ".yml": "yaml"}.get(
+            extension, "bind"
+        )
+    with open(path, encoding="utf-8") as file:
+        content = file.read()
+    if file_format == "bind":
+        origin = os.path.basename(path)
+        for suffix in (".zone", ".db"):
+            origin = origin.removesuffix(suffix)
+        return parse_bind(content, origin)
+    if file_format == "yaml":
+        try:
+            import yaml  # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            raise ValueError(
+                "Error: Reading YAML files requires PyYAML to be installed."
+            ) from err
+        zones = yaml.safe_load(content)
+    else:
+        zones = json.loads(content)
+    if not isinstance(zones, dict):
+        raise ValueError(f"Error: {path} does not map zone names to records.")
+    return {
+        zone: [_normalize(record) for record in records or []]
+        for zone, records in zones.items()
+    }
+
+
+def _normalize(record):
+    try:
+        name = record.get("name") or ""
+        return {
+            "name": "" if name == "@" else str(name),
+            "type": str(record["type"]).upper(),
+            "data": str(record["data"]),
+            "aux": str(record.get("aux") or "0"),
+        }
+    except (AttributeError, KeyError) as err:
+        raise ValueError(f"Error: Invalid record {record!r}.") from err
+
+
+def parse_bind(content, origin):
+    """Parse the records of a (simplified) BIND zone file
+
+    Supports `$ORIGIN`, relative, absolute and `@` owner names, owner names
+    continued from the previous line, optional TTL and class fields,
+    entries continued over several lines in parentheses and priorities of MX
+    and SRV records. Domain names in the data of CNAME, MX, NS, PTR and SRV
+    records are returned fully qualified without the trailing dot (like the
+    KAS API stores them). The SOA record (managed by All-Inkl) and directives
+    like `$TTL` are ignored.
+
+    Returns a dict mapping the zone name to a list of record dicts."""
+    origin = origin.rstrip(".")
+    records = []
+    name = ""
+    for number, has_owner, fields in _entries(content):
+        if fields[0] == "$ORIGIN":
+            origin = fields[1].rstrip(".")
+            continue
+        if fields[0].startswith("$"):
+            continue
+        if has_owner:
+            name = _relative_name(fields.pop(0), origin, number)
+        while fields and (fields[0].isdigit() or fields[0].upper() in ("IN", "CH")):
+            fields.pop(0)
+        if len(fields) < 2:
+            raise ValueError(f"Error: Line {number}: Missing record type or data.")
+        record_type, data = fields[0].upper(), fields[1:]
+        if record_type == "SOA":
+            continue
+        aux = "0"
+        if record_type in ("MX", "SRV") and len(data) > 1:
+            aux = data.pop(0)
+        data = _map_target(
+            record_type, " ".join(data), lambda target: _absolute(target, origin)
+        )
+        records.append({"name": name, "type": record_type, "data": data, "aux": aux})
+    return {origin: records}
+
+
+def _entries(content):
+    """Get the line number, whether it starts with an owner and the fields of
+    every entry of a zone file, joining the lines of entries in parentheses"""
+    entry, depth = None, 0
+    for number, line in enumerate(content.splitlines(), 1):
+        lexer = shlex.shlex(line, posix=True, punctuation_chars="()")
+        lexer.whitespace_split = True
+        lexer.commenters = ";"
+        try:
+            fields = list(lexer)
+        except ValueError as err:
+            raise ValueError(f"Error: Line {number}: {err}.") from err
+        if not depth:
+            if not fields:
+                continue
+            entry = (number, not line[0].isspace(), [])
+        depth += fields.count("(") - fields.count(")")
+        if depth < 0:
+            raise ValueError(f"Error: Line {number}: Unbalanced parentheses.")
+        entry[2].extend(field for field in fields if field not in ("(", ")"))
+        if not depth and entry[2]:
+            yield entry
+    if depth:
+        raise ValueError(f"Error: Line {entry[0]}: Unbalanced parentheses.")
+
+
+def format_bind(origin, records):
+    """Format the records of a zone as (simplified) BIND zone file
+
+    The record data is written as stored by the KAS API with fully qualified
+    domain names in the data of CNAME, MX, NS, PTR and SRV records, TXT data
+    is quoted. The result can be read again with parse_bind."""
+    lines = [f"$ORIGIN {origin.rstrip('.')}."]
+    for record in records:
+        data = _map_target(
+            record["type"],
+            record["data"],
+            lambda target: target if target.endswith(".") else f"{target}.",
+        )
+        if record["type"] == "TXT":
+            data = '"' + data.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        if record["type"] in ("MX", "SRV"):
+            data = f"{record['aux']} {data}"
+        lines.append(f"{record['name'] or '@'}\tIN\t{record['type']}\t{data}")
+    return "\n".join(lines) + "\n"
+
+
+def _map_target(record_type, data, function):
+    """Apply function to the domain name at the end of the data of a record"""
+    if record_type not in TARGET_TYPES or not data:
+        return data
+    fields = data.split(" ")
+    return " ".join(fields[:-1] + [function(fields[-1])])
+
+
+def _absolute(target, origin):
+    if target == "@":
+        return origin
+    if target.endswith("."):
+        return target.rstrip(".")
+    return f"{target}.{origin}"
+
+
+def _relative_name(name, origin, number):
+    if name == "@":
+        return ""
+    if not name.endswith("."):
+        return name
+    name = name.rstrip(".")
+    if name == origin:
+        return ""
+    if not name.endswith(f".{origin}"):
+        raise ValueError(f"Error: Line {number}: {name} is not in zone {origin}.")
+    return name.removesuffix(f".{origin}")
@@ -0,0 +1,145 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Resolve the DNS zone of a domain name
+
+The zone is the longest suffix of the name that is a zone of the account.
+Names outside of the known zones fall back to the registrable domain, the
+public suffix (e.g. `co.uk`) plus one label, according to the rules of the
+Public Suffix List (https://publicsuffix.org) shipped as
+public_suffix_list.dat."""
+
+import functools
+import os
+
+PUBLIC_SUFFIX_FILE = os.path.join(os.path.dirname(__file__), "public_suffix_list.dat")
+
+# Node keys of the trie that cannot be labels of a domain name
+_END = "."
+_EXCEPTION = "!"
+
+
+class SuffixTrie:
+    """Set of domain names as trie of their labels from right to left
+
+    Finding the longest suffix of a name that is in the set takes one dict
+    lookup per label."""
+
+    __slots__ = ("_root",)
+
+    def __init__(self, names=()):
+        self._root = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name, marker=_END):
+        """Add a name (with the marker of its node)"""
+        node = self._root
+        for label in reversed(name.rstrip(".").lower().split(".")):
+            node = node.setdefault(label, {})
+        node[marker] = True
+
+    def longest(self, labels):
+        """Get the number of labels of the longest suffix in the set (or 0)"""
+        node, length = self._root, 0
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            if _END in node:
+                length = depth
+        return length
+
+    def public_suffix(self, labels):
+        """Get the number of labels of the public suffix of a name
+
+        The trie holds the public suffix rules, which may start with a
+        wildcard label (`*.ck`) or be an exception to one (`!www.ck`). Names
+        without a matching rule have a public suffix of one label."""
+        node, length = self._root, 1
+        for depth, label in enumerate(reversed(labels), 1):
+            wildcard = node.get("*")
+            node = node.get(label)
+            if node is not None and _EXCEPTION in node:
+                return depth - 1
+            if (wildcard is not None and _END in wildcard) or (
+                node is not None and _END in node
+            ):
+                length = depth
+            if node is None:
+                break
+        return length
+
+
+@functools.cache
+def public_suffixes(path=PUBLIC_SUFFIX_FILE):
+    """Get the compiled public suffix rules of a file (parsed once)
+
+    Internationalized rules are also added in their ASCII form (`xn--...`)
+    as the API returns domain names in that form."""
+    trie = SuffixTrie()
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            rule = line.split(maxsplit=1)[0] if line.strip() else ""
+            if not rule or rule.startswith("//"):
+                continue
+            marker = _END
+            if rule.startswith("!"):
+                rule, marker = rule[1:], _EXCEPTION
+            trie.add(rule, marker=marker)
+            if not rule.isascii():
+                try:
+                    trie.add(rule.encode("idna").decode("ascii"), marker=marker)
+                except UnicodeError:
+                    pass
+    return trie
+
+
+class ZoneResolver:
+    """Split domain names into record name and zone
+
+    zones are the names of the zones of the account, further zones are
+    added with update()."""
+
+    __slots__ = ("_zones", "_suffixes")
+
+    def __init__(self, zones=(), suffixes=None):
+        self._zones = SuffixTrie(zones)
+        self._suffixes = suffixes
+
+    def update(self, zones):
+        """Add the names of known zones"""
+        for zone in zones:
+            self._zones.add(zone)
+
+    def split(self, fqdn):
+        """Split a FQDN into record_name and zone_name (with trailing dot)"""
+        if not fqdn or not fqdn.rstrip("."):
+            raise ValueError("Error: No valid FQDN given.")
+        labels = fqdn.rstrip(".").split(".")
+        folded = fqdn.rstrip(".").lower().split(".")
+        length = self._zones.longest(folded)
+        if not length:
+            if self._suffixes is None:
+                self._suffixes = public_suffixes()
+            length = min(len(labels), self._suffixes.public_suffix(folded) + 1)
+        return ".".join(labels[:-length]), ".".join(labels[-length:]) + "."
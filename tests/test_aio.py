@@ -0,0 +1,264 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for AsyncKasServer"""
+
+import asyncio
+import copy
+import json
+from unittest import mock
+
+import pytest
+import zeep
+
+from kasserver import retry
+from kasserver.aio import AsyncKasServer, AsyncPacer
+
+from .test_kasserver import (
+    PASSWORD,
+    USERNAME,
+    WSDL,
+    TestKasServer,
+    TestKasServerCache,
+)
+
+# pylint: disable=protected-access
+
+
+@pytest.fixture(name="kasserver", params=[None, 60])
+def fixture_kasserver(request, mocker):
+    """Fixture that sets up an AsyncKasServer instance with mocked KasApi"""
+    mocker.patch.dict(
+        "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+    )
+    mocker.patch("netrc.netrc", autospec=True)
+    mocker.patch("zeep.AsyncClient", autospec=True).return_value.wsdl = WSDL
+    mocker.patch("zeep.transports.AsyncTransport", autospec=True)
+    kasserver = AsyncKasServer(cache_ttl=request.param)
+
+    async def _respond(request):
+        await asyncio.sleep(0)
+        return TestKasServerCache._respond(request)
+
+    kasserver._client.service.KasApi = mock.AsyncMock(side_effect=_respond)
+    kasserver._client.transport = mock.Mock(aclose=mock.AsyncMock())
+    return kasserver
+
+
+def _requests(kasserver):
+    return [
+        json.loads(args[0])["KasRequestType"]
+        for args, _ in kasserver._client.service.KasApi.call_args_list
+    ]
+
+
+def test_getdnsrecords(kasserver):
+    """Test getting DNS records concurrently with a single request"""
+
+    async def _run():
+        async with kasserver:
+            return await asyncio.gather(
+                kasserver.get_dns_records("example.com"),
+                kasserver.get_dns_record("www.example.com", "A"),
+            )
+
+    records, record = asyncio.run(_run())
+    assert records == TestKasServer.RESPONSE_PARSED
+    assert record == TestKasServer.RESPONSE_PARSED[0]
+    assert _requests(kasserver) == ["get_dns_settings"]
+    kasserver._client.transport.aclose.assert_awaited_once()
+
+
+@pytest.mark.parametrize(
+    "fqdn,method,expected",
+    [
+        ("new.example.com", "add_dns_record", "add_dns_settings"),
+        ("test.example.com", "add_dns_record", "update_dns_settings"),
+        ("test.example.com", "delete_dns_record", "delete_dns_settings"),
+        ("new.example.com", "delete_dns_record", None),
+    ],
+)
+def test_write(kasserver, fqdn, method, expected):
+    """Test adding, updating and deleting DNS records"""
+    args = ["www.example2.com"] if method == "add_dns_record" else []
+    asyncio.run(getattr(kasserver, method)(fqdn, "CNAME", *args))
+    assert _requests(kasserver)[1:] == ([expected] if expected else [])
+
+
+def test_write_by_id(kasserver):
+    """Test that unchanged records and deletions by id skip requests"""
+
+    async def _run():
+        record_id = await kasserver.add_dns_record(
+            "test.example.com", "CNAME", "www.example.com", "0"
+        )
+        await kasserver.delete_dns_record("test.example.com", "CNAME", record_id="1")
+        return record_id
+
+    assert asyncio.run(_run()) == "2"
+    assert _requests(kasserver) == ["get_dns_settings", "delete_dns_settings"]
+
+
+def test_endpoint(kasserver, mocker):
+    """Test that services of other endpoints are bound to async proxies"""
+    proxy = mocker.patch("zeep.proxy.AsyncServiceProxy", autospec=True)
+    client = kasserver._client
+    kas = AsyncKasServer(endpoint="http://localhost:8080/")
+    assert kas._bind(client, "KasApi") is proxy.return_value
+    client.create_service.assert_called_with(
+        "{https://kasserver.com/}KasApiBinding", "http://localhost:8080/KasApi.php"
+    )
+    service = client.create_service.return_value
+    proxy.assert_called_with(client, service._binding, **service._binding_options)
+
+
+def test_request_failed(kasserver):
+    """Test that failed requests are propagated to all waiting readers"""
+    kasserver._client.service.KasApi.side_effect = zeep.exceptions.Fault("failed")
+
+    async def _run():
+        return await asyncio.gather(
+            kasserver.get_dns_records("example.com"),
+            kasserver.get_dns_records("example.com"),
+            return_exceptions=True,
+        )
+
+    assert [str(result) for result in asyncio.run(_run())] == ["failed", "failed"]
+    assert not kasserver._pending
+
+
+def test_request_cancelled(kasserver):
+    """Test that cancelled reads do not leave pending requests behind"""
+    kasserver._client.service.KasApi.side_effect = asyncio.CancelledError
+
+    async def _run():
+        return await asyncio.gather(
+            kasserver.get_dns_records("example.com"),
+            kasserver.get_dns_records("example.com"),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(_run())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert not kasserver._pending
+
+
+def test_request_floodprotection(kasserver, mocker):
+    """Test request retries when hitting KasServer flood protection"""
+    sleep = mocker.patch("asyncio.sleep", autospec=True)
+    kasserver._retry = retry.RetryPolicy(flood_jitter=0)
+    response = copy.deepcopy(TestKasServer.RESPONSE)
+    response[1]["value"]["item"][0]["value"] = 2
+    kasserver._client.service.KasApi.side_effect = [
+        zeep.exceptions.Fault("flood_protection", detail=mock.Mock(text="1.5")),
+        response,
+        response,
+    ]
+
+    async def _run():
+        await kasserver._request("test_request", {})
+        await kasserver._request("test_request", {})
+
+    asyncio.run(_run())
+    assert kasserver._client.service.KasApi.await_count == 3
+    assert [pytest.approx(c.args[0], abs=0.1) for c in sleep.call_args_list] == [
+        2,
+        2,
+    ]
+
+
+def test_request_flood_attempts(kasserver, mocker):
+    """Test that the flood protection is retried according to the policy"""
+    mocker.patch("asyncio.sleep", autospec=True)
+    kasserver._retry = retry.RetryPolicy(flood_attempts=2)
+    kasserver._client.service.KasApi.side_effect = zeep.exceptions.Fault(
+        "flood_protection", detail=mock.Mock(text="1")
+    )
+    with pytest.raises(zeep.exceptions.Fault):
+        asyncio.run(kasserver._request("get_dns_settings", {}))
+    assert kasserver._client.service.KasApi.await_count == 3
+
+
+def test_request_deadline(mocker):
+    """Test that requests fail instead of waiting beyond the deadline"""
+    mocker.patch.dict(
+        "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+    )
+    mocker.patch("netrc.netrc", autospec=True)
+    mocker.patch("zeep.AsyncClient", autospec=True).return_value.wsdl = WSDL
+    mocker.patch("zeep.transports.AsyncTransport", autospec=True)
+    kasserver = AsyncKasServer(retry_policy=retry.RetryPolicy(deadline=5))
+    kasserver._client.service.KasApi = mock.AsyncMock(
+        side_effect=zeep.exceptions.Fault(
+            "flood_protection", detail=mock.Mock(text="10")
+        )
+    )
+    with pytest.raises(retry.DeadlineExceeded):
+        asyncio.run(kasserver._request("get_dns_settings", {}))
+    assert kasserver._client.service.KasApi.await_count == 1
+    kasserver._pacer.delay(10)
+    with pytest.raises(retry.DeadlineExceeded):
+        asyncio.run(kasserver._request("get_dns_settings", {}))
+    assert kasserver._client.service.KasApi.await_count == 1
+
+
+def test_pacer_sleeps_remaining_delay(mocker):
+    """Test that the pacer only waits for the remaining flood delay"""
+    monotonic = mocker.patch("time.monotonic", return_value=100.0)
+    sleep = mocker.patch("asyncio.sleep", autospec=True)
+    pacer = AsyncPacer()
+
+    async def _run():
+        async with pacer:
+            pacer.delay(2)
+        monotonic.return_value = 101.5
+        async with pacer:
+            pass
+        monotonic.return_value = 105.0
+        async with pacer:
+            pass
+
+    asyncio.run(_run())
+    sleep.assert_called_once_with(0.5)
+    assert pacer.wait_time == 0.5
+
+
+def test_getdomains(kasserver):
+    """Test that the domains of the account are used to split names"""
+    domains = [{"item": [{"key": "domain_name", "value": "sub.example.com"}]}]
+    response = copy.deepcopy(TestKasServer.RESPONSE)
+    response[1]["value"]["item"][2]["value"]["_value_1"] = domains
+    kasserver._client.service.KasApi = mock.AsyncMock(return_value=response)
+    assert asyncio.run(kasserver.get_domains()) == ["sub.example.com"]
+    assert _requests(kasserver) == ["get_domains"]
+    assert kasserver._split_fqdn("www.sub.example.com") == ("www", "sub.example.com.")
+
+
+def test_cache(kasserver):
+    """Test that cached zones are not requested again"""
+
+    async def _run():
+        await kasserver.get_dns_records("example.com")
+        await kasserver.get_dns_records("example.com")
+
+    asyncio.run(_run())
+    assert len(_requests(kasserver)) == (1 if kasserver._cache else 2)
@@ -0,0 +1,199 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the kasserver daemon"""
+
+import os
+import socket
+import stat
+import threading
+from unittest import mock
+
+import click.testing
+import pytest
+
+import kasserver
+from kasserver import daemon
+
+from .test_kasserver import USERNAME
+
+RECORD = {"id": "1", "name": "www", "type": "A", "data": "1.2.3.4"}
+
+
+@pytest.fixture(name="kas")
+def fixture_kas():
+    """Fixture for a mocked KasServer"""
+    kas = mock.create_autospec(kasserver.KasServer, instance=True)
+    kas._username = USERNAME  # pylint: disable=protected-access
+    kas.get_dns_record.return_value = RECORD
+    kas.add_dns_record.return_value = None
+    return kas
+
+
+@pytest.fixture(name="server")
+def fixture_server(kas, tmp_path, mocker):
+    """Fixture that runs a daemon on a temporary socket"""
+    path = str(tmp_path / "kasserver.sock")
+    mocker.patch.dict("os.environ", {"KASSERVER_SOCKET": path})
+    server = daemon.Daemon(kas)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_socket_path(mocker):
+    """Test the location of the daemon socket"""
+    mocker.patch.dict("os.environ", {"XDG_RUNTIME_DIR": "/run/user/1000"})
+    mocker.patch.dict("os.environ", {"KASSERVER_SOCKET": ""})
+    assert daemon.socket_path() == "/run/user/1000/kasserver.sock"
+    mocker.patch.dict("os.environ", {"KASSERVER_SOCKET": "/tmp/kas.sock"})
+    assert daemon.socket_path() == "/tmp/kas.sock"
+
+
+def test_forward(kas, server):
+    """Test that method calls are forwarded to the KasServer of the daemon"""
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+    remote = daemon.connect()
+    assert isinstance(remote, daemon.RemoteKasServer)
+    assert remote.get_dns_record("www.example.com", "A") == RECORD
+    remote.add_dns_record("test.example.com", "TXT", "value", replace=False)
+    kas.get_dns_records.return_value = [RECORD]
+    assert [r.as_dict() for r in remote.iter_dns_records("example.com")] == [
+        kasserver.DnsRecord(**RECORD).as_dict()
+    ]
+    remote.close()
+    kas.get_dns_record.assert_called_once_with("www.example.com", "A")
+    kas.add_dns_record.assert_called_once_with(
+        "test.example.com", "TXT", "value", replace=False
+    )
+
+
+def test_error(kas, server):  # pylint: disable=unused-argument
+    """Test that failed requests raise an error in the client"""
+    kas.delete_dns_record.side_effect = ValueError("failed")
+    remote = daemon.connect()
+    with pytest.raises(daemon.DaemonError, match="ValueError: failed"):
+        remote.delete_dns_record("www.example.com", "A")
+    with pytest.raises(AttributeError):
+        remote.sync_zone("example.com", [])  # pylint: disable=no-member
+    assert server.dispatch(b'{"method": "sync_zone"}') == {
+        "error": "ValueError: Unknown method sync_zone"
+    }
+    assert remote.get_dns_record("www.example.com", "A") == RECORD
+
+
+def test_fallback(tmp_path, mocker):
+    """Test that a KasServer is created if the daemon is not running"""
+    mocker.patch.dict(
+        "os.environ", {"KASSERVER_SOCKET": str(tmp_path / "kasserver.sock")}
+    )
+    kasserver_class = mocker.patch("kasserver.KasServer", autospec=True)
+    assert daemon.connect(shared_pacing=True) is kasserver_class.return_value
+    kasserver_class.assert_called_once_with(
+        shared_pacing=True, domains_ttl=daemon.DOMAINS_TTL
+    )
+
+
+def test_other_account(server, mocker):  # pylint: disable=unused-argument
+    """Test that the daemon of another account is not used"""
+    mocker.patch.dict("os.environ", {"KASSERVER_USER": "other"})
+    kasserver_class = mocker.patch("kasserver.KasServer", autospec=True)
+    assert daemon.connect() is kasserver_class.return_value
+
+
+def test_closed(tmp_path, caplog):
+    """Test that a daemon closing the connection is not used"""
+    path = str(tmp_path / "kasserver.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(path)
+        listener.listen()
+
+        def _close():
+            with listener.accept()[0] as conn:
+                conn.makefile("rb").readline()
+
+        thread = threading.Thread(target=_close)
+        thread.start()
+        assert daemon.RemoteKasServer.open(path) is None
+        thread.join()
+    assert "Connection to daemon closed" in caplog.text
+
+
+def test_stale_socket(kas, server):
+    """Test that only one daemon listens and stale sockets are replaced"""
+    with pytest.raises(OSError, match="already listening"):
+        daemon.Daemon(kas)
+    server.shutdown()
+    server.socket.close()
+    assert os.path.exists(server.path)
+    daemon.Daemon(kas).server_close()
+    assert not os.path.exists(server.path)
+
+
+def test_other_account_socket(kas, server, mocker):
+    """Test that the socket of a daemon of another account is kept"""
+    mocker.patch.dict("os.environ", {"KASSERVER_USER": "other"})
+    with pytest.raises(OSError, match="already listening"):
+        daemon.Daemon(kas)
+    mocker.patch.dict("os.environ", {"KASSERVER_USER": USERNAME})
+    remote = daemon.RemoteKasServer.open(server.path)
+    assert remote.get_dns_record("www.example.com", "A") == RECORD
+    remote.close()
+
+
+def test_cli(tmp_path, mocker):
+    """Test the daemon command"""
+    path = str(tmp_path / "kasserver.sock")
+    kasserver_class = mocker.patch("kasserver.KasServer", autospec=True)
+    serve = mocker.patch.object(
+        daemon.Daemon, "serve_forever", side_effect=KeyboardInterrupt
+    )
+    result = click.testing.CliRunner().invoke(daemon.cli, ["--socket", path])
+    assert result.exit_code == 0
+    kasserver_class.assert_called_once_with(
+        cache_ttl=60, shared_pacing=True, domains_ttl=daemon.DOMAINS_TTL
+    )
+    serve.assert_called_once()
+    assert not os.path.exists(path)
+
+
+def test_cli_error(tmp_path, mocker):
+    """Test that the daemon command fails if it cannot listen"""
+    mocker.patch("kasserver.KasServer", autospec=True)
+    path = str(tmp_path / "missing" / "kasserver.sock")
+    result = click.testing.CliRunner().invoke(daemon.cli, ["--socket", path])
+    assert result.exit_code == 1
+    assert "No such file or directory" in result.output
+
+
+def test_apply(kas, server):  # pylint: disable=unused-argument
+    """Test that changes and results of apply() are serialized"""
+    change = kasserver.DnsChange("add", "test.example.com", "TXT", "value")
+    kas.apply.side_effect = lambda changes: {
+        "results": [{"change": changes[0], "error": ValueError("failed")}]
+    }
+    remote = daemon.connect()
+    assert remote.apply([change]) == {
+        "results": [{"change": list(change), "error": "failed"}]
+    }
+    kas.apply.assert_called_once_with([change])
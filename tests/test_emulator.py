@@ -0,0 +1,236 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""End-to-end tests of KasServer against the KAS API emulator"""
+
+import asyncio
+import json
+import time
+
+import pytest
+import zeep
+
+from kasserver import DnsChange, KasServer
+from kasserver.aio import AsyncKasServer
+from kasserver.emulator import KasEmulator, prime_schema_cache
+
+USERNAME = "username"
+PASSWORD = "password"
+
+ZONE = [
+    {"name": "", "type": "NS", "data": "ns5.kasserver.com.", "changeable": "N"},
+    {"name": "www", "type": "A", "data": "192.0.2.1"},
+    {"name": "www", "type": "MX", "data": "mail.example.com.", "aux": 10},
+]
+
+
+@pytest.fixture(name="emulator")
+def fixture_emulator(tmp_path, monkeypatch):
+    """Fixture that runs an emulator with example.com"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setenv("KASSERVER_USER", USERNAME)
+    monkeypatch.setenv("KASSERVER_PASSWORD", PASSWORD)
+    prime_schema_cache()
+    with KasEmulator(
+        {"example.com": ZONE}, username=USERNAME, password=PASSWORD
+    ) as emulator:
+        monkeypatch.setenv("KASSERVER_ENDPOINT", emulator.endpoint)
+        yield emulator
+
+
+def test_records(emulator):
+    """Test reading and writing records"""
+    kas = KasServer()
+    assert kas.get_domains() == ["example.com"]
+    assert [r["data"] for r in kas.get_dns_records("example.com")] == [
+        "ns5.kasserver.com.",
+        "192.0.2.1",
+        "mail.example.com.",
+    ]
+    assert kas.get_dns_record("www.example.com", "MX")["aux"] == 10
+    kas.add_dns_record("_acme-challenge.example.com", "TXT", "a")
+    kas.add_dns_record("_acme-challenge.example.com", "TXT", "b", replace=False)
+    kas.add_dns_record("www.example.com", "A", "192.0.2.2")
+    kas.delete_dns_record("_acme-challenge.example.com", "TXT", "a")
+    assert [(r["name"], r["data"]) for r in emulator.zones["example.com"][1:]] == [
+        ("www", "192.0.2.2"),
+        ("www", "mail.example.com."),
+        ("_acme-challenge", "b"),
+    ]
+    assert emulator.requests["update_dns_settings"] == 1
+
+
+def test_async(emulator):
+    """Test AsyncKasServer with the transport of the async extras"""
+    pytest.importorskip("httpx")
+
+    async def _run():
+        async with AsyncKasServer() as kas:
+            assert await kas.get_domains() == ["example.com"]
+            fqdn = "_acme-challenge.example.com"
+            record_id = await kas.add_dns_record(fqdn, "TXT", "a")
+            assert await kas.add_dns_record(fqdn, "TXT", "a") == record_id
+            assert (await kas.get_dns_record(fqdn, "TXT"))["data"] == "a"
+        assert emulator.requests["add_dns_settings"] == 1
+
+    asyncio.run(_run())
+
+
+def test_stream(emulator):
+    """Test streaming the records of a large zone"""
+    emulator.add_zone(
+        "example.org",
+        [{"name": f"host{i}", "type": "A", "data": "192.0.2.1"} for i in range(500)],
+    )
+    records = list(KasServer().iter_dns_records("example.org"))
+    assert [r.name for r in records[:2]] == ["host0", "host1"]
+    assert len(records) == 500
+
+
+def test_apply_cached(emulator):
+    """Test that cached writes need a single zone read"""
+    kas = KasServer(cache_ttl=60)
+    result = kas.apply(
+        [DnsChange("add", f"host{i}.example.com", "A", "192.0.2.3") for i in range(3)]
+    )
+    assert not any(item["error"] for item in result["results"])
+    assert emulator.requests == {"get_dns_settings": 1, "add_dns_settings": 3}
+    assert len(kas.get_dns_records("example.com")) == 6
+
+
+def test_faults(emulator, monkeypatch):
+    """Test faults of the emulator"""
+    with pytest.raises(zeep.exceptions.Fault, match="zone_not_found"):
+        KasServer().get_dns_records("example.net")
+    with pytest.raises(zeep.exceptions.Fault, match="record_already_exists"):
+        KasServer()._request(  # pylint: disable=protected-access
+            "add_dns_settings",
+            {
+                "zone_host": "example.com.",
+                "record_name": "www",
+                "record_type": "A",
+                "record_data": "192.0.2.1",
+            },
+        )
+    monkeypatch.setenv("KASSERVER_PASSWORD", "wrong")
+    with pytest.raises(zeep.exceptions.Fault, match="kas_auth_data_incorrect"):
+        KasServer().get_domains()
+    assert emulator.faults == {
+        "zone_not_found": 1,
+        "record_already_exists": 1,
+        "kas_auth_data_incorrect": 1,
+    }
+
+
+def _handle(emulator, request_type, params=None, **fields):
+    """Send a request of the plain authentication type to the emulator"""
+    request = {
+        "KasUser": USERNAME,
+        "KasAuthType": "plain",
+        "KasAuthData": PASSWORD,
+        "KasRequestType": request_type,
+        "KasRequestParams": params or {},
+        **fields,
+    }
+    body = f"<Envelope><Params>{json.dumps(request)}</Params></Envelope>"
+    return emulator.handle("/KasApi.php", body.encode())
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"<Envelope",
+        b"<Envelope></Envelope>",
+        b"<Envelope><Params>[</Params></Envelope>",
+        b'<Envelope><Params>{"KasUser": "username", "KasAuthType": "plain", '
+        b'"KasAuthData": "password"}</Params></Envelope>',
+        b"<Envelope><Params>[]</Params></Envelope>",
+    ],
+)
+def test_invalid_request(emulator, body):
+    """Test that malformed requests are answered with a fault"""
+    status, content = emulator.handle("/KasApi.php", body)
+    assert status == 500
+    assert b"<faultstring>invalid_request: " in content
+
+
+def test_record_faults(emulator):
+    """Test faults of requests for single records"""
+    emulator.add_zone("example.org", [{"type": "A", "data": "192.0.2.1"}])
+    ns_id = emulator.zones["example.com"][0]["id"]
+    for request_type, params, faultstring in [
+        ("sync_zone", {}, b"unknown_action"),
+        ("update_dns_settings", {"record_id": "999"}, b"record_id_not_found"),
+        ("update_dns_settings", {"record_id": ns_id}, b"record_not_changeable"),
+        ("delete_dns_settings", {"record_id": ns_id}, b"record_not_changeable"),
+    ]:
+        status, content = _handle(emulator, request_type, params)
+        assert status == 500
+        assert b"<faultstring>" + faultstring + b"</faultstring>" in content
+    status, _ = _handle(emulator, "get_domains", KasAuthType="session")
+    assert status == 500
+    assert emulator.faults["session_invalid"] == 1
+
+    record = emulator.zones["example.org"][0]
+    for params in ({"record_aux": 5}, {"record_data": "192.0.2.2"}):
+        status, _ = _handle(
+            emulator, "update_dns_settings", {"record_id": record["id"], **params}
+        )
+        assert status == 200
+    assert (record["type"], record["data"], record["aux"]) == ("A", "192.0.2.2", 5)
+
+
+def test_latency(emulator):
+    """Test that responses are delayed by the latency"""
+    emulator.latency = 0.05
+    start = time.monotonic()
+    status, _ = _handle(emulator, "get_domains")
+    assert status == 200
+    assert time.monotonic() - start >= 0.05
+
+
+def test_flood_protection(emulator):
+    """Test that the client keeps the flood delay of the emulator"""
+    emulator.flood_delay = 0.1
+    kas = KasServer()
+    for _ in range(3):
+        kas.get_domains()
+    assert emulator.requests == {"get_domains": 3}
+    assert not emulator.faults
+    # Another client that does not share the delay is rejected
+    request = (
+        b"<Envelope><Body><KasApi><Params>"
+        b'{"KasUser": "username", "KasAuthType": "plain", '
+        b'"KasAuthData": "password", "KasRequestType": "get_domains"}'
+        b"</Params></KasApi></Body></Envelope>"
+    )
+    status, content = emulator.handle("/KasApi.php", request)
+    assert status == 500
+    assert b"<faultstring>flood_protection</faultstring><detail>0.0" in content
+
+
+def test_session(emulator):
+    """Test requests authenticated with a session token"""
+    kas = KasServer(session_lifetime=60)
+    kas.get_domains()
+    kas.get_domains()
+    assert emulator.requests == {"KasAuth": 1, "get_domains": 2}
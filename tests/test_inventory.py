@@ -0,0 +1,111 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the zone inventory"""
+
+import pytest
+
+from kasserver import DnsRecord
+from kasserver.inventory import Inventory
+
+RECORDS = [
+    DnsRecord(id="0", zone="example.com", name="", type="NS", data="ns5.", aux="0"),
+    DnsRecord(id="1", zone="example.com", name="www", type="A", data="192.0.2.1"),
+    DnsRecord(id="2", zone="example.com", name="mail", type="A", data="192.0.2.2"),
+]
+
+
+@pytest.fixture(name="store")
+def fixture_store(tmp_path):
+    """Fixture that opens an empty inventory"""
+    with Inventory(str(tmp_path / "inventory.db")) as store:
+        yield store
+
+
+def test_store(store):
+    """Test storing and reading a snapshot"""
+    assert store.records("example.com") is None
+    changes = store.store("example.com.", RECORDS)
+    assert [change["operation"] for change in changes] == ["add"] * 3
+    assert [r.as_dict() for r in store.records("Example.com")] == [
+        r.as_dict() for r in RECORDS
+    ]
+    assert list(store.zones()) == ["example.com"]
+
+
+def test_changes(store):
+    """Test that only changed records are reported"""
+    store.store("example.com", RECORDS, fetched=1.0)
+    assert not store.store("example.com", RECORDS, fetched=2.0)
+    records = [
+        RECORDS[0],
+        DnsRecord(id="1", zone="example.com", name="www", type="A", data="192.0.2.9"),
+        DnsRecord(id="3", zone="example.com", name="ftp", type="A", data="192.0.2.2"),
+    ]
+    changes = store.store("example.com", records, fetched=3.0)
+    assert [(c["operation"], c["name"], c.get("previous")) for c in changes] == [
+        ("update", "www", "192.0.2.1"),
+        ("add", "ftp", None),
+        ("delete", "mail", None),
+    ]
+    assert [c["operation"] for c in store.changes("example.com", limit=3)] == [
+        "delete",
+        "add",
+        "update",
+    ]
+    assert store.zones() == {"example.com": 3.0}
+
+
+def test_changes_types(store):
+    """Test that numeric fields of the API are not reported as updates"""
+    records = [
+        DnsRecord(id=1, zone="example.com", name="www", type="A", data="192.0.2.1"),
+        DnsRecord(id=2, zone="example.com", name="", type="MX", data="mx.", aux=10),
+    ]
+    records[0].aux = 0
+    store.store("example.com", records, fetched=1.0)
+    records[0].data = "192.0.2.9"
+    changes = store.store("example.com", records, fetched=2.0)
+    assert [(c["operation"], c["name"]) for c in changes] == [("update", "www")]
+    assert [c["name"] for c in store.changes()] == ["www", "", "www"]
+
+
+def test_stale(store):
+    """Test selecting the zones that have to be fetched again"""
+    store.store("example.com", RECORDS)
+    store.store("example.org", [], fetched=1.0)
+    zones = ["example.com", "example.org", "example.net"]
+    assert store.stale(zones, 3600) == ["example.org", "example.net"]
+    assert store.stale(zones, 0) == zones
+
+
+def test_search_prune(store):
+    """Test searching records and dropping zones"""
+    store.store("example.com", RECORDS)
+    store.store(
+        "example.org", [DnsRecord(zone="example.org", type="A", data="192.0.2.1")]
+    )
+    assert [r.zone for r in store.search("192.0.2.1")] == ["example.com", "example.org"]
+    assert [r.name for r in store.search("192.0.2.*", "a")] == ["www", "mail", None]
+    assert not store.search("192.0.2.1", "AAAA")
+    assert store.prune(["example.org"]) == ["example.com"]
+    assert not store.search("ns5.")
@@ -21,25 +21,51 @@
 
 """Tests for KasServer"""
 
+import copy
+import fcntl
+import http.server
 import json
 import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
 
 from unittest import mock
 
 import pytest
+import requests.exceptions
 import zeep
 
-from kasserver import KasServer
+import kasserver as kasserver_module
+from kasserver import WSDL_FILE
+from kasserver import (
+    DnsChange,
+    DnsRecord,
+    FloodState,
+    KasServer,
+    KasServerBase,
+    Pacer,
+    RecordSet,
+    SchemaCache,
+    SessionStore,
+    ZoneCache,
+    metrics,
+    retry,
+)
 
 
 LOGGER = logging.getLogger(__name__)
 
 USERNAME = "username"
 PASSWORD = "password"
+WSDL = mock.sentinel.wsdl
 
 # pylint: disable=protected-access
 # pylint: disable=attribute-defined-outside-init
 # pylint: disable=too-few-public-methods
+# pylint: disable=too-many-lines
 
 
 class TestKasServerCredentials:
@@ -157,7 +183,7 @@ class TestKasServer:
             "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
         )
         mocker.patch("netrc.netrc", autospec=True)
-        mocker.patch("zeep.Client", autospec=True)
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
         KasServer.FLOOD_TIMEOUT = 0
         kasserver = KasServer()
         kasserver._client.service.KasApi.return_value = self.RESPONSE
@@ -208,10 +234,122 @@ class TestKasServer:
         kasserver._request(self.REQUEST_TYPE, self.REQUEST_PARAMS)
         assert kasapi.call_count == 2
 
+    def test_request_metrics(self, kasserver, kasapi, mocker):
+        """Test that the metrics of requests are reported to observers"""
+        observer = mocker.Mock(spec=metrics.Observer)
+        metrics.add_observer(observer)
+        try:
+            floodprotection = mock.PropertyMock(text="0.0")
+            kasapi.side_effect = [
+                zeep.exceptions.Fault("flood_protection", detail=floodprotection),
+                mock.DEFAULT,
+                zeep.exceptions.Fault("zone_not_found"),
+                ValueError("invalid response"),
+            ]
+            kasserver._request(self.REQUEST_TYPE, self.REQUEST_PARAMS)
+            with pytest.raises(zeep.exceptions.Fault):
+                kasserver._request("get_dns_settings", {})
+            with pytest.raises(ValueError):
+                kasserver._request("get_domains", {})
+        finally:
+            metrics.remove_observer(observer)
+        reported = [call.args[0] for call in observer.observe.call_args_list]
+        assert [(m.request, m.retries, m.fault) for m in reported] == [
+            (self.REQUEST_TYPE, 1, None),
+            ("get_dns_settings", 0, "zone_not_found"),
+            ("get_domains", 0, "ValueError"),
+        ]
+        assert all(m.wait >= 0 and m.decode >= 0 for m in reported)
+
     def test_getdnsrecords(self, kasserver):
         """Test getting DNS record list"""
         assert kasserver.get_dns_records("example.com") == self.RESPONSE_PARSED
 
+    @staticmethod
+    def test_getdomains(kasserver, kasapi):
+        """Test getting the domain names of the account"""
+        domains = [
+            {"item": [{"key": "domain_name", "value": name}]}
+            for name in ("example.org", "example.com")
+        ]
+        kasapi.return_value = copy.deepcopy(TestKasServer.RESPONSE)
+        kasapi.return_value[1]["value"]["item"][2]["value"]["_value_1"] = domains
+        assert kasserver.get_domains() == ["example.com", "example.org"]
+        assert kasapi.requests_contains("get_domains")
+
+    @staticmethod
+    def test_getdomains_zones(kasserver, kasapi):
+        """Test that the zones of the account are used to split names"""
+        domains = [{"item": [{"key": "domain_name", "value": "sub.example.com"}]}]
+        kasapi.return_value = copy.deepcopy(TestKasServer.RESPONSE)
+        kasapi.return_value[1]["value"]["item"][2]["value"]["_value_1"] = domains
+        assert kasserver._split_fqdn("www.sub.example.com") == (
+            "www.sub",
+            "example.com.",
+        )
+        kasserver.get_domains()
+        assert kasserver._split_fqdn("www.sub.example.com") == (
+            "www",
+            "sub.example.com.",
+        )
+
+    @staticmethod
+    def test_domains_file(kasapi, tmp_path, mocker, caplog):
+        """Test that the domains of the account are kept on disk"""
+        mocker.patch.dict("os.environ", {"XDG_CACHE_HOME": str(tmp_path)})
+        domains = [{"item": [{"key": "domain_name", "value": "sub.example.com"}]}]
+        kasapi.return_value = copy.deepcopy(TestKasServer.RESPONSE)
+        kasapi.return_value[1]["value"]["item"][2]["value"]["_value_1"] = domains
+        path = tmp_path / "kasserver" / f"domains-{USERNAME}.json"
+        expected = ("www", "sub.example.com.")
+
+        assert KasServer(domains_ttl=60)._split_fqdn("www.sub.example.com") == expected
+        assert json.loads(path.read_text()) == ["sub.example.com"]
+        assert kasapi.requests_contains("get_domains")
+
+        kasapi.reset_mock()
+        assert KasServer(domains_ttl=60)._split_fqdn("www.sub.example.com") == expected
+        assert not kasapi.requests_contains("get_domains")
+        assert KasServer(zone_names=["example.com"], domains_ttl=60)._split_fqdn(
+            "www.sub.example.com"
+        ) == ("www.sub", "example.com.")
+        assert not kasapi.requests_contains("get_domains")
+
+        path.write_text("{")
+        with caplog.at_level(logging.DEBUG, logger="kasserver"):
+            assert KasServer(domains_ttl=60)._split_fqdn("www.sub.example.com") == (
+                expected
+            )
+        assert "Cannot load domains" in caplog.text
+        assert kasapi.requests_contains("get_domains")
+
+        kasapi.reset_mock()
+        os.utime(path, (0, 0))
+        assert KasServer(domains_ttl=60)._split_fqdn("www.sub.example.com") == expected
+        assert kasapi.requests_contains("get_domains")
+
+    @staticmethod
+    def test_domains_file_failed(kasapi, tmp_path, mocker, caplog):
+        """Test that names are split without the domains if they are unknown"""
+        cache_home = tmp_path / "file"
+        cache_home.write_text("")
+        mocker.patch.dict("os.environ", {"XDG_CACHE_HOME": str(cache_home)})
+        domains = [{"item": [{"key": "domain_name", "value": "sub.example.com"}]}]
+        kasapi.return_value = copy.deepcopy(TestKasServer.RESPONSE)
+        kasapi.return_value[1]["value"]["item"][2]["value"]["_value_1"] = domains
+        assert KasServer(domains_ttl=60)._split_fqdn("www.sub.example.com") == (
+            "www",
+            "sub.example.com.",
+        )
+        assert "Cannot store domains" in caplog.text
+
+        kasapi.side_effect = zeep.exceptions.Fault("failed")
+        assert KasServer(domains_ttl=60)._split_fqdn("www.sub.example.com") == (
+            "www.sub",
+            "example.com.",
+        )
+        assert "Cannot get the domains" in caplog.text
+
     def test_getdnsrecord(self, kasserver):
         """Test getting single DNS record"""
         assert (
@@ -235,6 +373,22 @@ class TestKasServer:
         kasserver.add_dns_record("test.example.com", "CNAME", "www.example2.com")
         assert kasapi.requests_contains("update_dns_settings")
 
+    @staticmethod
+    def test_adddnsrecord_unchanged(kasserver, kasapi):
+        """Test that an identical record is not written again"""
+        record_id = kasserver.add_dns_record(
+            "test.example.com", "CNAME", "www.example.com"
+        )
+        assert record_id == "2"
+        assert not kasapi.requests_contains("update_dns_settings")
+
+    @staticmethod
+    def test_deletednsrecord_id(kasserver, kasapi):
+        """Test deleting a DNS record by id without reading the zone"""
+        kasserver.delete_dns_record("test.example.com", "TXT", record_id="3")
+        assert kasapi.requests_contains("delete_dns_settings")
+        assert not kasapi.requests_contains("get_dns_settings")
+
     @staticmethod
     def test_deletednsrecord(kasserver, kasapi):
         """Test deleting an existing DNS record"""
@@ -252,11 +406,1063 @@ class TestKasServerUtils:
     """Unit tests for utilities"""
 
     @staticmethod
-    def test_split_dqdn():
+    def test_base_client():
+        """Tests that the base class does not implement a client."""
+        with pytest.raises(NotImplementedError):
+            KasServerBase()
+
+    @staticmethod
+    def test_split_dqdn(mocker):
         """Tests splitting FQDN into dns_name and zone_host values."""
-        assert KasServer._split_fqdn("hallo.welt.de.") == ("hallo", "welt.de.")
-        assert KasServer._split_fqdn("hallo.welt.de") == ("hallo", "welt.de.")
-        assert KasServer._split_fqdn("test.hallo.welt.de") == ("test.hallo", "welt.de.")
-        assert KasServer._split_fqdn("hallowelt.de") == ("", "hallowelt.de.")
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        kasserver = KasServer()
+        assert kasserver._split_fqdn("hallo.welt.de.") == ("hallo", "welt.de.")
+        assert kasserver._split_fqdn("hallo.welt.de") == ("hallo", "welt.de.")
+        assert kasserver._split_fqdn("test.hallo.welt.de") == ("test.hallo", "welt.de.")
+        assert kasserver._split_fqdn("hallowelt.de") == ("", "hallowelt.de.")
+        assert kasserver._split_fqdn("a.example.co.uk") == ("a", "example.co.uk.")
+        with pytest.raises(ValueError):
+            kasserver._split_fqdn("")
+
+    @staticmethod
+    def test_netrc_cached(tmp_path, mocker):
+        """Test that ~/.netrc is only parsed again after it changed"""
+        mocker.patch.dict("os.environ", {"HOME": str(tmp_path)})
+        mocker.patch.dict(kasserver_module._netrc_files, clear=True)
+        path = tmp_path / ".netrc"
+        path.write_text(f"machine kasapi.kasserver.com login {USERNAME}\n")
+        path.chmod(0o600)
+        parsed = kasserver_module._load_netrc()
+        assert kasserver_module._load_netrc() is parsed
+        os.utime(path, ns=(0, 0))
+        assert kasserver_module._load_netrc() is not parsed
+
+
+class TestKasServerRetry:
+    """Unit tests for retrying failed requests"""
+
+    @pytest.fixture()
+    def kasserver(self, mocker):
+        """Fixture that sets up a KasServer with mocked KasApi and sleep"""
+        mocker.patch.dict(
+            "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+        )
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        self.sleep = mocker.patch("time.sleep")
+        kasserver = KasServer(
+            retry_policy=retry.RetryPolicy(attempts=2, jitter=0),
+            breaker=retry.CircuitBreaker(threshold=3),
+        )
+        kasserver._client.service.KasApi.return_value = TestKasServer.RESPONSE
+        return kasserver
+
+    def test_connection_error(self, kasserver):
+        """Test that connection errors are retried with a backoff"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = [requests.exceptions.ConnectionError(), mock.DEFAULT]
+        kasserver._request("get_dns_settings", {})
+        assert kasapi.call_count == 2
+        assert [call.args[0] for call in self.sleep.call_args_list] == [
+            0,
+            pytest.approx(1.0, abs=0.1),
+        ]
+
+    @staticmethod
+    def test_attempts(kasserver):
+        """Test that errors are raised after the last attempt"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = requests.exceptions.ReadTimeout()
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            kasserver._request("get_dns_settings", {})
+        assert kasapi.call_count == 3
+        # The breaker opened after three failures
+        with pytest.raises(retry.CircuitOpenError):
+            kasserver._request("get_dns_settings", {})
+        assert kasapi.call_count == 3
+
+    @staticmethod
+    def test_not_idempotent(kasserver):
+        """Test that added records are not sent again after a timeout"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = requests.exceptions.ReadTimeout()
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            kasserver._request("add_dns_settings", {})
+        assert kasapi.call_count == 1
+
+    @staticmethod
+    def test_flood_attempts(kasserver):
+        """Test that the flood protection is not retried forever"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = zeep.exceptions.Fault(
+            "flood_protection", detail=mock.Mock(text="1")
+        )
+        with pytest.raises(zeep.exceptions.Fault):
+            kasserver._request("get_dns_settings", {})
+        assert kasapi.call_count == 11
+
+    @staticmethod
+    def test_deadline(kasserver):
+        """Test that requests fail instead of waiting beyond the deadline"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = zeep.exceptions.Fault(
+            "flood_protection", detail=mock.Mock(text="10")
+        )
+        with kasserver.deadline(5):
+            with pytest.raises(retry.DeadlineExceeded):
+                kasserver._request("get_dns_settings", {})
+        assert kasapi.call_count == 1
+        kasapi.side_effect = None
+        kasserver._pacer.delay(10)
+        with pytest.raises(retry.DeadlineExceeded), kasserver.deadline(5):
+            kasserver._request("get_dns_settings", {})
+        kasserver._request("get_dns_settings", {})
+        assert kasapi.call_count == 2
+
+    @staticmethod
+    def test_deadline_nested(kasserver, mocker):
+        """Test that nested deadlines keep the earlier one per thread"""
+        mocker.patch("time.monotonic", return_value=100.0)
+        deadlines = []
+        with kasserver.deadline(5):
+            with kasserver.deadline(10):
+                deadlines.append(kasserver._deadline)
+                thread = threading.Thread(
+                    target=lambda: deadlines.append(kasserver._deadline)
+                )
+                thread.start()
+                thread.join()
+            with kasserver.deadline(1):
+                deadlines.append(kasserver._deadline)
+            deadlines.append(kasserver._deadline)
+        assert deadlines == [105.0, None, 101.0, 105.0]
+        assert kasserver._deadline is None
+
+
+class TestKasServerCache:
+    """Unit tests for the zone snapshot cache"""
+
+    @pytest.fixture()
+    def kasserver(self, mocker):
+        """Fixture that sets up a caching KasServer instance with mocked KasApi"""
+        mocker.patch.dict(
+            "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+        )
+        mocker.patch("netrc.netrc", autospec=True)
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        mocker.patch("time.sleep")
+        kasserver = KasServer(cache_ttl=60)
+        kasserver._client.service.KasApi.side_effect = self._respond
+        return kasserver
+
+    @staticmethod
+    def _respond(request):
+        request = json.loads(request)
+        if request["KasRequestType"] == "get_dns_settings":
+            return copy.deepcopy(TestKasServer.RESPONSE)
+        response = copy.deepcopy(TestKasServer.RESPONSE)
+        response[1]["value"]["item"][2]["value"] = (
+            "3" if request["KasRequestType"] == "add_dns_settings" else "TRUE"
+        )
+        return response
+
+    @staticmethod
+    def _count(kasserver, request_type):
+        return sum(
+            json.loads(args[0])["KasRequestType"] == request_type
+            for args, _ in kasserver._client.service.KasApi.call_args_list
+        )
+
+    def test_single_read(self, kasserver):
+        """Test that repeated operations on a zone only read it once"""
+        kasserver.add_dns_record("new.example.com", "TXT", "value")
+        kasserver.add_dns_record("test.example.com", "CNAME", "example.com")
+        kasserver.delete_dns_record("www.example.com", "A")
+        records = kasserver.get_dns_records("example.com")
+        assert self._count(kasserver, "get_dns_settings") == 1
+        assert {"id": "3", "name": "new", "data": "value"}.items() <= records[
+            -1
+        ].items()
+        assert [r["id"] for r in records] == ["2", "3"]
+        assert records[0]["data"] == "example.com"
+
+    def test_multiple_values(self, kasserver):
+        """Test managing several records with the same name and type"""
+        ids = iter(["3", "4"])
+
+        def _respond(request):
+            response = self._respond(request)
+            if "add_dns_settings" in request:
+                response[1]["value"]["item"][2]["value"] = next(ids)
+            return response
+
+        kasserver._client.service.KasApi.side_effect = _respond
+        assert kasserver.add_dns_record("_acme-challenge.example.com", "TXT", "1")
+        ids = [
+            kasserver.add_dns_record(
+                "_acme-challenge.example.com", "TXT", "2", replace=False
+            )
+            for _ in range(2)
+        ]
+        # The identical record is not written again
+        assert ids == ["4", "4"]
+        assert self._count(kasserver, "add_dns_settings") == 2
+        assert self._count(kasserver, "update_dns_settings") == 0
+        assert kasserver.get_dns_record("_acme-challenge.example.com", "TXT", "2")
+        kasserver.delete_dns_record("_acme-challenge.example.com", "TXT", "1")
+        records = kasserver.get_dns_records("example.com")
+        assert [r["data"] for r in records if r["type"] == "TXT"] == ["2"]
+        assert self._count(kasserver, "get_dns_settings") == 1
+
+    def test_snapshot_copy(self, kasserver):
+        """Test that callers cannot modify the cached snapshot"""
+        kasserver.get_dns_records("example.com")[0]["data"] = "modified"
+        assert kasserver.get_dns_records("example.com")[0]["data"] == "1.2.3.4"
+
+    def test_iter_cached(self, kasserver):
+        """Test iterating over copies of the cached records"""
+        kasserver.get_dns_records("example.com")
+        records = list(kasserver.iter_dns_records("example.com"))
+        assert [record.as_dict() for record in records] == (
+            TestKasServer.RESPONSE_PARSED
+        )
+        records[0].data = "modified"
+        assert kasserver.get_dns_records("example.com")[0]["data"] == "1.2.3.4"
+        assert self._count(kasserver, "get_dns_settings") == 1
+
+    @staticmethod
+    def test_invalidate_uncached(mocker):
+        """Test that invalidating is a no-op without a cache"""
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        KasServer().invalidate_cache()
+
+    def test_invalidate(self, kasserver):
+        """Test invalidating cached zones"""
+        kasserver.get_dns_records("example.com")
+        kasserver.invalidate_cache("www.example.com")
+        kasserver.get_dns_records("example.com")
+        kasserver.invalidate_cache()
+        kasserver.get_dns_records("example.com")
+        assert self._count(kasserver, "get_dns_settings") == 3
+
+    def test_add_without_id(self, kasserver):
+        """Test that the zone is re-read when the API returns no record id"""
+        kasserver._client.service.KasApi.side_effect = None
+        kasserver._client.service.KasApi.return_value = TestKasServer.RESPONSE
+        kasserver.add_dns_record("new.example.com", "TXT", "value")
+        kasserver.get_dns_records("example.com")
+        assert self._count(kasserver, "get_dns_settings") == 2
+
+    def test_write_unknown_record(self, kasserver, mocker):
+        """Test that the zone is re-read when a written record is not cached"""
+        mocker.patch.object(
+            KasServerBase, "_existing_record", return_value=DnsRecord(id="99")
+        )
+        kasserver.get_dns_records("example.com")
+        kasserver.delete_dns_record("missing.example.com", "A")
+        kasserver.get_dns_records("example.com")
+        assert self._count(kasserver, "get_dns_settings") == 2
+
+
+class TestZoneCache:
+    """Unit tests for ZoneCache"""
+
+    @staticmethod
+    def test_ttl(mocker):
+        """Test that snapshots expire after their time to live"""
+        monotonic = mocker.patch("time.monotonic", return_value=0)
+        cache = ZoneCache(ttl=10)
+        cache.put("example.com.", [])
+        assert cache.get("example.com.") == []
+        monotonic.return_value = 11
+        assert cache.get("example.com.") is None
+        assert cache.get("example.com.") is None
+
+    @staticmethod
+    def test_eviction():
+        """Test that the least recently used zone is evicted"""
+        cache = ZoneCache(max_zones=2)
+        cache.put("a.", [])
+        cache.put("b.", [])
+        cache.get("a.")
+        cache.put("c.", [])
+        assert cache.get("a.") == []
+        assert cache.get("b.") is None
+        assert cache.get("c.") == []
+
+
+class TestKasServerStream:
+    """Unit tests for streaming DNS records"""
+
+    ENVELOPE = (
+        '<?xml version="1.0" encoding="UTF-8"?><SOAP-ENV:Envelope '
+        'xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+        'xmlns:ns1="urn:xmethodsKasApi" '
+        'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        "<SOAP-ENV:Body>{}</SOAP-ENV:Body></SOAP-ENV:Envelope>"
+    )
+
+    @staticmethod
+    def _pair(key, value, value_type="xsd:string"):
+        return (
+            f"<item><key>{key}</key>"
+            f'<value xsi:type="{value_type}">{value}</value></item>'
+        )
+
+    @classmethod
+    def _response(cls, records, flood_delay="0.5"):
+        items = "".join(
+            "<item>"
+            + "".join(cls._pair(f"record_{key}", value) for key, value in r.items())
+            + "</item>"
+            for r in records
+        )
+        return cls.ENVELOPE.format(
+            "<ns1:KasApiResponse><return>"
+            + f"<item><key>Request</key><value>{cls._pair('zone_host', 'x')}</value>"
+            + "</item><item><key>Response</key><value>"
+            + cls._pair("KasFloodDelay", flood_delay, "xsd:float")
+            + cls._pair("ReturnString", "TRUE")
+            + f"<item><key>ReturnInfo</key><value>{items}</value></item>"
+            + "</value></item></return></ns1:KasApiResponse>"
+        ).encode()
+
+    @staticmethod
+    @pytest.fixture()
+    def kasserver(mocker):
+        """Fixture that sets up a KasServer instance with mocked KasApi"""
+        mocker.patch.dict(
+            "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+        )
+        client = mocker.patch("zeep.Client", autospec=True).return_value
+        client.wsdl = WSDL
+        client.settings = mock.MagicMock()
+        mocker.patch("time.sleep")
+        return KasServer()
+
+    def test_iter(self, kasserver):
+        """Test decoding the records one by one"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.return_value = mock.Mock(
+            content=self._response(TestKasServer.RESPONSE_PARSED)
+        )
+        records = kasserver.iter_dns_records("example.com")
+        assert not kasapi.called
+        assert next(records).as_dict() == TestKasServer.RESPONSE_PARSED[0]
+        assert kasserver._pacer.remaining() == pytest.approx(0.5, abs=0.1)
+        assert [r.as_dict() for r in records] == TestKasServer.RESPONSE_PARSED[1:]
+        kasserver._client.settings.assert_called_once_with(raw_response=True)
+
+    def test_iter_values(self, kasserver):
+        """Test decoding typed and empty values"""
+        content = self._response([{"id": "1", "name": "", "aux": "10"}]).replace(
+            b'<value xsi:type="xsd:string">10</value>',
+            b'<value xsi:type="xsd:int">10</value>',
+        )
+        kasserver._client.service.KasApi.return_value = mock.Mock(content=content)
+        record = next(kasserver.iter_dns_records("example.com"))
+        assert (record.id, record.name, record.aux) == ("1", None, 10)
+        kasserver._client.service.KasApi.return_value = mock.Mock(
+            content=self._response([])
+        )
+        assert not list(kasserver.iter_dns_records("example.com"))
+
+    def test_iter_fault(self, kasserver):
+        """Test that faults are raised and flood protection is retried"""
+        fault = self.ENVELOPE.format(
+            "<SOAP-ENV:Fault><faultcode>SOAP-ENV:Server</faultcode>"
+            "<faultstring>{}</faultstring><detail>{}</detail></SOAP-ENV:Fault>"
+        )
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = [
+            mock.Mock(content=fault.format("flood_protection", "0.1").encode()),
+            mock.Mock(content=self._response(TestKasServer.RESPONSE_PARSED)),
+            mock.Mock(content=fault.format("zone_not_found", "").encode()),
+        ]
+        assert len(list(kasserver.iter_dns_records("example.com"))) == 2
+        assert kasapi.call_count == 2
+        with pytest.raises(zeep.exceptions.Fault, match="zone_not_found"):
+            list(kasserver.iter_dns_records("example.com"))
+
+    @staticmethod
+    def test_iter_cached(mocker):
+        """Test that cached zones are copied instead of requested"""
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        kasserver = KasServer(cache_ttl=60)
+        kasserver._client.service.KasApi.return_value = TestKasServer.RESPONSE
+        kasserver.get_dns_records("example.com")
+        record = next(kasserver.iter_dns_records("example.com"))
+        record.data = "modified"
+        assert kasserver.get_dns_record("www.example.com", "A")["data"] == "1.2.3.4"
+        assert kasserver._client.service.KasApi.call_count == 1
+
+
+class TestRecordSet:
+    """Unit tests for RecordSet"""
+
+    @staticmethod
+    def test_index():
+        """Test finding records by id, name and type and data"""
+        records = RecordSet(
+            DnsRecord.from_items(item["item"])
+            for item in TestKasServer.RESPONSE[1]["value"]["item"][2]["value"][
+                "_value_1"
+            ]
+        )
+        first = DnsRecord(id="3", name="_acme-challenge", type="TXT", data="1")
+        second = DnsRecord(id="4", name="_acme-challenge", type="TXT", data="2")
+        records.add(first)
+        records.add(second)
+        assert len(records) == 4
+        assert records.get("1").as_dict() == TestKasServer.RESPONSE_PARSED[0]
+        assert records.find("_acme-challenge", "TXT") == [first, second]
+        assert records.find("_acme-challenge", "TXT", "2") == [second]
+        assert not records.find("_acme-challenge", "TXT", "3")
+        assert not records.find("missing", "TXT")
+
+    @staticmethod
+    def test_modify():
+        """Test that updates and removals keep the indexes consistent"""
+        first = DnsRecord(id="1", name="www", type="A", data="1.2.3.4")
+        second = DnsRecord(id="2", name="test", type="A", data="1.2.3.4")
+        records = RecordSet([first, second])
+        records.update(first, name="new", data="5.6.7.8")
+        assert list(records) == [first, second]
+        assert not records.find("www", "A")
+        assert records.find("new", "A", "5.6.7.8") == [first]
+        records.remove(first)
+        assert list(records) == [second]
+        assert records.get("1") is None
+        assert not records.find("new", "A")
+
+    @staticmethod
+    def test_remove_shared_id():
+        """Test that removing a record keeps the index of another with its id"""
+        first = DnsRecord(id="3", name="_acme-challenge", type="TXT", data="1")
+        second = DnsRecord(id="3", name="_acme-challenge", type="TXT", data="2")
+        records = RecordSet([first, second])
+        records.remove(first)
+        assert records.get("3") is second
+        assert records.find("_acme-challenge", "TXT") == [second]
+
+    @staticmethod
+    def test_record():
+        """Test the record representation"""
+        record = DnsRecord(id="1", name="www")
+        assert record.as_dict()["changeable"] == "Y"
+        assert "'name': 'www'" in repr(record)
+        with pytest.raises(AttributeError):
+            record.other = 1  # pylint: disable=assigning-non-slot
+
+
+class TestKasServerApply:
+    """Unit tests for applying batches of changes"""
+
+    _count = staticmethod(TestKasServerCache._count)
+
+    @pytest.fixture(params=[None, 60])
+    def kasserver(self, request, mocker):
+        """Fixture that sets up a (caching) KasServer instance with mocked KasApi"""
+        mocker.patch.dict(
+            "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+        )
+        mocker.patch("netrc.netrc", autospec=True)
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        mocker.patch("time.sleep")
+        kasserver = KasServer(cache_ttl=request.param)
+        kasserver._client.service.KasApi.side_effect = TestKasServerCache._respond
+        return kasserver
+
+    def test_apply(self, kasserver):
+        """Test applying changes with one read per zone"""
+        changes = [
+            DnsChange("add", "new.example.com", "TXT", "1"),
+            DnsChange("add", "test.example.com", "CNAME", "www.example.com"),
+            DnsChange("delete", "www.example.com", "A"),
+            DnsChange("add", "www.example.com", "A", "5.6.7.8"),
+            DnsChange("delete", "missing.example.com", "A"),
+            DnsChange("delete", "test.example.com", "CNAME"),
+            DnsChange("add", "new.example.org", "TXT", "2"),
+        ]
+        result = kasserver.apply(changes)
+        assert [r["operation"] for r in result["results"]] == [
+            "add",
+            "delete",
+            "update",
+            "update",
+            None,
+            "delete",
+            "add",
+        ]
+        assert [r["record_id"] for r in result["results"]] == [
+            "3",
+            "2",
+            "1",
+            "1",
+            None,
+            "2",
+            "3",
+        ]
+        assert self._count(kasserver, "get_dns_settings") == 2
+        assert self._count(kasserver, "delete_dns_settings") == 1
+        assert result["round_trips"] == 6
+
+    def test_apply_multiple_values(self, kasserver):
+        """Test that adds of several values for one name write all of them"""
+        ids = iter(["3", "4"])
+
+        def _respond(request):
+            response = TestKasServerCache._respond(request)
+            if "add_dns_settings" in request:
+                response[1]["value"]["item"][2]["value"] = next(ids)
+            return response
+
+        kasserver._client.service.KasApi.side_effect = _respond
+        fqdn = "_acme-challenge.example.com"
+        result = kasserver.apply(
+            [DnsChange("add", fqdn, "TXT", "a"), DnsChange("add", fqdn, "TXT", "b")]
+        )
+        assert [(r["operation"], r["record_id"]) for r in result["results"]] == [
+            ("add", "3"),
+            ("add", "4"),
+        ]
+        written = [
+            json.loads(args[0])["KasRequestParams"]["record_data"]
+            for args, _ in kasserver._client.service.KasApi.call_args_list
+            if "add_dns_settings" in args[0]
+        ]
+        assert written == ["a", "b"]
+
+        records = kasserver._get_zone("example.com")
+        records.add(
+            DnsRecord(id="3", name="_acme-challenge", type="TXT", data="a", aux=0)
+        )
+        records.add(
+            DnsRecord(id="4", name="_acme-challenge", type="TXT", data="b", aux=0)
+        )
+        kasserver._get_zone = mock.Mock(return_value=records)
+        result = kasserver.apply(
+            [
+                DnsChange("delete", fqdn, "TXT", "a"),
+                DnsChange("add", fqdn, "TXT", "c"),
+                DnsChange("add", fqdn, "TXT", "b"),
+                DnsChange("add", fqdn, "TXT", "d"),
+                DnsChange("delete", fqdn, "TXT", "d"),
+            ]
+        )
+        assert [(r["operation"], r["record_id"]) for r in result["results"]] == [
+            ("update", "3"),
+            ("update", "3"),
+            (None, "4"),
+            (None, None),
+            (None, None),
+        ]
+        # A delete of all values gets the result of its first write
+        result = kasserver.apply([DnsChange("delete", fqdn, "TXT")])
+        assert [(r["operation"], r["record_id"]) for r in result["results"]] == [
+            ("delete", "3")
+        ]
+        deleted = [
+            json.loads(args[0])["KasRequestParams"]["record_id"]
+            for args, _ in kasserver._client.service.KasApi.call_args_list
+            if "delete_dns_settings" in args[0]
+        ]
+        assert deleted == ["3", "4"]
+
+    def test_apply_unchanged(self, kasserver):
+        """Test that changes that do not modify a record are skipped"""
+        result = kasserver.apply([DnsChange("add", "www.example.com", "A", "1.2.3.4")])
+        assert result["results"][0]["operation"] is None
+        assert result["round_trips"] == 1
+
+    def test_apply_errors(self, kasserver):
+        """Test that failed requests are reported per change"""
+
+        def _respond(request):
+            if "example.org" in request:
+                raise zeep.exceptions.Fault("zone_not_found")
+            if "add_dns_settings" in request:
+                raise zeep.exceptions.Fault("record_invalid")
+            return TestKasServerCache._respond(request)
+
+        kasserver._client.service.KasApi.side_effect = _respond
+        result = kasserver.apply(
+            [
+                DnsChange("add", "new.example.org", "TXT", "1"),
+                DnsChange("add", "new.example.com", "TXT", "1"),
+                DnsChange("delete", "test.example.com", "CNAME"),
+            ]
+        )
+        assert [str(r["error"]) for r in result["results"]] == [
+            "zone_not_found",
+            "record_invalid",
+            "None",
+        ]
+
+    @staticmethod
+    def test_apply_invalid(kasserver):
+        """Test that invalid actions are rejected"""
         with pytest.raises(ValueError):
-            KasServer._split_fqdn("")
+            kasserver.apply([DnsChange("replace", "www.example.com", "A")])
+
+
+class TestKasServerSync:
+    """Unit tests for synchronizing zones with a desired state"""
+
+    kasserver = TestKasServerApply.kasserver
+    _count = staticmethod(TestKasServerCache._count)
+
+    DESIRED = [
+        {"name": "www", "type": "A", "data": "1.2.3.4"},
+        {"name": "test", "type": "CNAME", "data": "example.com"},
+        {"name": "", "type": "MX", "data": "mail.example.com", "aux": "10"},
+    ]
+
+    def test_sync(self, kasserver):
+        """Test that only the difference is written"""
+        plan = kasserver.sync_zone("example.com", self.DESIRED)
+        assert [(s["operation"], s["record_id"]) for s in plan] == [
+            ("update", "2"),
+            ("add", "3"),
+        ]
+        assert plan[0]["previous"] == "www.example.com"
+        assert self._count(kasserver, "get_dns_settings") == 1
+        assert self._count(kasserver, "update_dns_settings") == 1
+        assert self._count(kasserver, "add_dns_settings") == 1
+
+    def test_sync_readonly(self, kasserver):
+        """Test that read-only records are never removed"""
+        plan = kasserver.sync_zone("example.com", [], dry_run=True)
+        assert [(s["operation"], s["name"]) for s in plan] == [("delete", "test")]
+        assert not self._count(kasserver, "delete_dns_settings")
+        kasserver.execute_plan("example.com", plan)
+        assert self._count(kasserver, "delete_dns_settings") == 1
+
+    def test_sync_target_data(self, kasserver):
+        """Test that targets are written as desired, with the trailing dot"""
+        desired = [
+            TestKasServer.RESPONSE_PARSED[0],
+            {"name": "test", "type": "CNAME", "data": "example.org."},
+        ]
+        plan = kasserver.sync_zone("example.com", desired)
+        assert [(s["operation"], s["data"]) for s in plan] == [
+            ("update", "example.org.")
+        ]
+        written = [
+            json.loads(args[0])["KasRequestParams"]
+            for args, _ in kasserver._client.service.KasApi.call_args_list
+            if "update_dns_settings" in args[0]
+        ]
+        assert [params["record_data"] for params in written] == ["example.org."]
+
+    def test_sync_unchanged(self, kasserver):
+        """Test that an up to date zone costs a single read"""
+        desired = [
+            {**record, "data": record["data"] + "."}
+            if record["type"] == "CNAME"
+            else record
+            for record in TestKasServer.RESPONSE_PARSED
+        ]
+        plan = kasserver.sync_zone("example.com", desired)
+        assert not plan
+        assert kasserver._client.service.KasApi.call_count == 1
+
+
+class TestKasServerStartup:
+    """Unit tests for the start up cost of clients and command line utilities"""
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        "module",
+        ["kasserver_dns", "kasserver_dns_certbot", "kasserver_dns_lego", "daemon"],
+    )
+    def test_lazy_import(module):
+        """Test that --help and --version do not load zeep"""
+        code = (
+            "import sys\n"
+            f"from kasserver.{module} import cli\n"
+            "for args in (['--help'], ['--version']):\n"
+            "    try:\n"
+            "        cli(args)\n"
+            "    except SystemExit:\n"
+            "        pass\n"
+            "print(sorted(m for m in sys.modules if m.startswith(('zeep.', 'lxml'))))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        assert result.stdout.splitlines()[-1] == "[]"
+
+    @staticmethod
+    def test_shared_document(mocker):
+        """Test that the WSDL is parsed only once"""
+        client = mocker.patch("zeep.Client", autospec=True)
+        client.return_value.wsdl = WSDL
+        KasServer()
+        KasServer()
+        assert [c.args[0] for c in client.call_args_list] == [
+            kasserver_module.WSDL_FILE,
+            WSDL,
+        ]
+
+    @staticmethod
+    def test_lazy_import_module(mocker):
+        """Test that lazily imported modules are loaded on first access"""
+        mocker.patch.dict("sys.modules")
+        sys.modules.pop("colorsys", None)
+        colorsys = kasserver_module._lazy_import("colorsys")
+        assert kasserver_module._lazy_import("colorsys") is colorsys
+        assert colorsys.rgb_to_hsv(0, 0, 0) == (0, 0, 0)
+        with pytest.raises(ModuleNotFoundError):
+            kasserver_module._lazy_import("kasserver_missing")
+
+    @staticmethod
+    def test_version():
+        """Test the lazily determined package version"""
+        assert kasserver_module.__version__
+        with pytest.raises(AttributeError):
+            kasserver_module.missing  # pylint: disable=pointless-statement
+
+
+class TestSchemaCache:
+    """Unit tests for SchemaCache"""
+
+    @staticmethod
+    def test_default_path(mocker, tmp_path):
+        """Test that the cache is stored in the XDG cache directory"""
+        mocker.patch.dict("os.environ", {"XDG_CACHE_HOME": str(tmp_path)})
+        assert SchemaCache().path == str(tmp_path / "kasserver" / "schemas.db")
+
+    @staticmethod
+    def test_cache(tmp_path):
+        """Test storing and loading schemas"""
+        cache = SchemaCache(str(tmp_path / "cache" / "schemas.db"))
+        assert cache.get("http://example.com") is None
+        cache.add("http://example.com", b"schema")
+        assert SchemaCache(cache.path).get("http://example.com") == b"schema"
+
+    @staticmethod
+    def test_cache_failed(tmp_path):
+        """Test that an unusable cache is ignored"""
+        (tmp_path / "file").write_text("")
+        cache = SchemaCache(str(tmp_path / "file" / "schemas.db"))
+        cache.add("http://example.com", b"schema")
+        assert cache.get("http://example.com") is None
+
+
+class TestFloodState:
+    """Unit tests for sharing the flood delay between processes"""
+
+    @pytest.fixture()
+    def kasserver(self, mocker, tmp_path):
+        """Fixture that sets up a KasServer with shared pacing in tmp_path"""
+        mocker.patch.dict(
+            "os.environ",
+            {
+                "KASSERVER_USER": USERNAME,
+                "KASSERVER_PASSWORD": PASSWORD,
+                "XDG_CACHE_HOME": str(tmp_path),
+            },
+        )
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        response = copy.deepcopy(TestKasServer.RESPONSE)
+        response[1]["value"]["item"][0]["value"] = 2
+        kasserver = KasServer(shared_pacing=True)
+        kasserver._client.service.KasApi.return_value = response
+        return kasserver
+
+    @staticmethod
+    def test_state(tmp_path, mocker):
+        """Test storing the time of the next allowed request"""
+        mocker.patch("time.time", return_value=100.0)
+        state = FloodState(USERNAME, str(tmp_path / "state.json"))
+        with state.lock():
+            assert state.remaining() == 0
+            state.update(2)
+        with FloodState(USERNAME, state.path).lock() as other:
+            assert other.remaining() == 2
+
+    @staticmethod
+    def test_state_invalid(tmp_path):
+        """Test that an invalid state file is ignored"""
+        path = tmp_path / "state.json"
+        path.write_text("invalid")
+        with FloodState(USERNAME, str(path)).lock() as state:
+            assert state.remaining() == 0
+
+    @staticmethod
+    def test_state_locked(tmp_path):
+        """Test that the state is locked exclusively"""
+        state = FloodState(USERNAME, str(tmp_path / "state.json"))
+        with state.lock():
+            with open(state.path, encoding="utf-8") as file:
+                with pytest.raises(BlockingIOError):
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    @staticmethod
+    def test_shared(kasserver, tmp_path, mocker):
+        """Test that a new client waits for the delay of a previous one"""
+        sleep = mocker.patch("time.sleep")
+        kasserver._request("test_request", {})
+        assert (tmp_path / "kasserver" / f"flood-{USERNAME}.json").exists()
+        KasServer(shared_pacing=True)._request("test_request", {})
+        assert sleep.call_args_list[0].args[0] == 0
+        assert sleep.call_args_list[1].args[0] == pytest.approx(2, abs=0.5)
+
+    @staticmethod
+    def test_shared_floodprotection(kasserver, mocker):
+        """Test that the flood protection delay is shared"""
+        sleep = mocker.patch("time.sleep")
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = [
+            zeep.exceptions.Fault("flood_protection", detail=mock.Mock(text="3")),
+            mock.DEFAULT,
+        ]
+        kasserver._request("test_request", {})
+        assert kasapi.call_count == 2
+        assert sleep.call_args_list[1].args[0] == pytest.approx(3, abs=0.5)
+
+    @staticmethod
+    def test_shared_unavailable(mocker, tmp_path):
+        """Test falling back to local pacing if the state cannot be stored"""
+        (tmp_path / "file").write_text("")
+        mocker.patch.dict(
+            "os.environ",
+            {"KASSERVER_USER": USERNAME, "XDG_CACHE_HOME": str(tmp_path / "file")},
+        )
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        assert not KasServer(shared_pacing=True)._flood_state
+
+
+class TestPacer:
+    """Unit tests for spacing out requests between threads"""
+
+    @staticmethod
+    def test_remaining(mocker):
+        """Test that only the part of the delay that has not passed is left"""
+        monotonic = mocker.patch("time.monotonic", return_value=100.0)
+        pacer = Pacer()
+        assert pacer.remaining() == 0
+        pacer.delay(2)
+        monotonic.return_value = 101.5
+        assert pacer.remaining() == 0.5
+        monotonic.return_value = 103.0
+        assert pacer.remaining() == 0
+
+    @staticmethod
+    def test_fifo():
+        """Test that waiting threads enter in the order they arrived"""
+        drawn = queue.SimpleQueue()
+
+        class Condition(threading.Condition):
+            """Condition that reports the threads that drew a ticket"""
+
+            def wait_for(self, predicate, timeout=None):
+                drawn.put(threading.current_thread())
+                return super().wait_for(predicate, timeout)
+
+        with mock.patch("threading.Condition", Condition):
+            pacer = Pacer()
+        order = []
+
+        def enter(i):
+            with pacer:
+                order.append(i)
+
+        threads = [threading.Thread(target=enter, args=(i,)) for i in range(5)]
+        with pacer:
+            assert drawn.get(timeout=5) is threading.current_thread()
+            for thread in threads:
+                thread.start()
+                # Wait until the thread has drawn its ticket
+                assert drawn.get(timeout=5) is thread
+        for thread in threads:
+            thread.join()
+        assert order == list(range(5))
+
+    @staticmethod
+    def test_shared(mocker):
+        """Test that clients sharing a pacer wait for each other's delay"""
+        mocker.patch.dict(
+            "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+        )
+        mocker.patch("zeep.Client", autospec=True).return_value.wsdl = WSDL
+        sleep = mocker.patch("time.sleep")
+        pacer = Pacer()
+        response = copy.deepcopy(TestKasServer.RESPONSE)
+        response[1]["value"]["item"][0]["value"] = 2
+        clients = [KasServer(pacer=pacer) for _ in range(2)]
+        for client in clients:
+            client._client.service.KasApi.return_value = response
+            client._request("test_request", {})
+        assert [call.args[0] for call in sleep.call_args_list] == [
+            0,
+            pytest.approx(2, abs=0.5),
+        ]
+
+
+class TestKasServerSession:
+    """Unit tests for session authentication"""
+
+    TOKEN = "token"
+
+    @pytest.fixture()
+    def kasserver(self, mocker, tmp_path):
+        """Fixture that sets up a KasServer using sessions with mocked KasApi"""
+        mocker.patch.dict(
+            "os.environ",
+            {
+                "KASSERVER_USER": USERNAME,
+                "KASSERVER_PASSWORD": PASSWORD,
+                "XDG_CACHE_HOME": str(tmp_path),
+            },
+        )
+        client = mocker.patch("zeep.Client", autospec=True).return_value
+        client.wsdl = WSDL
+        client.service.KasApi.return_value = TestKasServer.RESPONSE
+        client.service.KasAuth.return_value = self.TOKEN
+        return KasServer(session_lifetime=600, session_cache=True)
+
+    @staticmethod
+    def _auth(kasapi):
+        return [
+            (json.loads(args[0])["KasAuthType"], json.loads(args[0])["KasAuthData"])
+            for args, _ in kasapi.call_args_list
+        ]
+
+    def test_session(self, kasserver):
+        """Test that the password is only sent to get a session token"""
+        kasserver._request("test_request", {})
+        kasserver._request("test_request", {})
+        service = kasserver._client.service
+        assert self._auth(service.KasApi) == [("session", self.TOKEN)] * 2
+        service.KasAuth.assert_called_once()
+        auth = json.loads(service.KasAuth.call_args.args[0])
+        assert auth["KasPassword"] == PASSWORD
+        assert auth["SessionLifeTime"] == 600
+
+    def test_session_cached(self, kasserver, tmp_path):
+        """Test that the session token is reused by later clients"""
+        kasserver._request("test_request", {})
+        path = tmp_path / "kasserver" / f"session-{USERNAME}.json"
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        KasServer(session_lifetime=600, session_cache=True)._request("test", {})
+        kasserver._client.service.KasAuth.assert_called_once()
+
+    def test_session_renewed(self, kasserver):
+        """Test that rejected session tokens are renewed"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = [zeep.exceptions.Fault("session_invalid"), mock.DEFAULT]
+        kasserver._client.service.KasAuth.side_effect = ["expired", self.TOKEN]
+        kasserver._request("test_request", {})
+        assert self._auth(kasapi) == [("session", "expired"), ("session", "token")]
+
+    @staticmethod
+    def test_session_failed(kasserver):
+        """Test that other faults are not retried"""
+        kasapi = kasserver._client.service.KasApi
+        kasapi.side_effect = zeep.exceptions.Fault("failed")
+        with pytest.raises(zeep.exceptions.Fault):
+            kasserver._request("test_request", {})
+        assert kasapi.call_count == 1
+
+    def test_session_endpoint(self, mocker):
+        """Test getting a session token from a local endpoint"""
+        received = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Fake KasAuth endpoint"""
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Answer KasAuth requests with a token"""
+                length = int(self.headers["Content-Length"])
+                received.append((self.path, self.rfile.read(length).decode()))
+                body = (
+                    '<?xml version="1.0" encoding="UTF-8"?><SOAP-ENV:Envelope '
+                    'xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+                    'xmlns:ns1="urn:xmethodsKasApiAuthentication" '
+                    'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+                    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+                    "<SOAP-ENV:Body><ns1:KasAuthResponse>"
+                    f'<return xsi:type="xsd:string">{TestKasServerSession.TOKEN}'
+                    "</return></ns1:KasAuthResponse></SOAP-ENV:Body>"
+                    "</SOAP-ENV:Envelope>"
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Suppress request logging"""
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint = f"http://127.0.0.1:{server.server_port}/soap"
+
+        mocker.patch.dict(
+            "os.environ", {"KASSERVER_USER": USERNAME, "KASSERVER_PASSWORD": PASSWORD}
+        )
+        client_class = zeep.Client
+        api_client = mock.create_autospec(zeep.Client, instance=True)
+        api_client.wsdl = WSDL
+        mocker.patch(
+            "zeep.Client",
+            side_effect=lambda wsdl, **kwargs: (
+                api_client if wsdl == WSDL_FILE else client_class(wsdl, **kwargs)
+            ),
+        )
+        kasserver = KasServer(endpoint=endpoint, session_lifetime=600)
+        kasserver._service.KasApi.return_value = TestKasServer.RESPONSE
+        kasserver._request("test_request", {})
+        server.shutdown()
+        server.server_close()
+
+        api_client.create_service.assert_called_once_with(
+            "{https://kasserver.com/}KasApiBinding", f"{endpoint}/KasApi.php"
+        )
+        assert received[0][0] == "/soap/KasAuth.php"
+        assert PASSWORD in received[0][1]
+        assert self._auth(kasserver._service.KasApi) == [("session", self.TOKEN)]
+
+
+class TestSessionStore:
+    """Unit tests for SessionStore"""
+
+    @staticmethod
+    def test_expiry(mocker):
+        """Test that tokens expire unless they are used"""
+        now = mocker.patch("time.time", return_value=0)
+        store = SessionStore(USERNAME, 100)
+        assert store.get() is None
+        store.set("token")
+        now.return_value = 60
+        assert store.get() == "token"
+        store.touch()
+        now.return_value = 120
+        assert store.get() == "token"
+        now.return_value = 140
+        assert store.get() is None
+        store.set("token")
+        store.clear()
+        assert store.get() is None
+
+    @staticmethod
+    def test_persistence(tmp_path):
+        """Test storing tokens on disk"""
+        path = str(tmp_path / "session.json")
+        SessionStore(USERNAME, 100, path).set("token")
+        assert SessionStore(USERNAME, 100, path).get() == "token"
+        assert SessionStore("other", 100, path).get() is None
+        SessionStore(USERNAME, 100, path).clear()
+        assert SessionStore(USERNAME, 100, path).get() is None
+        SessionStore(USERNAME, 100, path).clear()
+
+    @staticmethod
+    def test_persistence_failed(tmp_path):
+        """Test that unusable session files are ignored"""
+        (tmp_path / "file").write_text("")
+        store = SessionStore(USERNAME, 100, str(tmp_path / "file" / "session.json"))
+        store.set("token")
+        assert store.get() == "token"
@@ -21,12 +21,19 @@
 
 """Tests for kasserver_dns cli"""
 
+import csv
+import io
+import json
+import logging
 from unittest import mock
 
 import click
 import click.testing
 import pytest
+import requests.exceptions
+import zeep
 
+from kasserver import DnsRecord, daemon, zonefile
 from kasserver.kasserver_dns import cli
 from .test_kasserver import TestKasServer
 
@@ -40,12 +47,98 @@ RECORD_TTL = "10"
 @mock.patch("kasserver.KasServer", autospec=True)
 def test_list(kasserver):
     """Test the list command"""
-    kasserver.return_value.get_dns_records.return_value = TestKasServer.RESPONSE_PARSED
+    kasserver.return_value.iter_dns_records.return_value = (
+        DnsRecord(**record) for record in TestKasServer.RESPONSE_PARSED
+    )
     result = click.testing.CliRunner().invoke(cli, ["list", "example.com"])
     assert result.exit_code == 0
     assert "example.com" in result.output
 
 
+def _zone_records(zone_name):
+    if zone_name == "missing.com":
+        raise zeep.exceptions.Fault("zone_not_found")
+    return (
+        DnsRecord(**{**record, "zone": zone_name})
+        for record in TestKasServer.RESPONSE_PARSED
+    )
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_list_zones(kasserver):
+    """Test the list command with several zones in a stable order"""
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    zones = [f"example{index}.com" for index in range(10)]
+    result = click.testing.CliRunner().invoke(
+        cli, ["list", "--output", "ndjson", "--jobs", "3", *zones]
+    )
+    assert result.exit_code == 0
+    listed = [json.loads(line)["zone"] for line in result.output.splitlines()]
+    assert listed == [zone for zone in zones for _ in TestKasServer.RESPONSE_PARSED]
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_list_all(kasserver):
+    """Test the list command with all zones of the account"""
+    kasserver.return_value.get_domains.return_value = ["a.com", "b.com"]
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    result = click.testing.CliRunner().invoke(
+        cli, ["list", "--all", "--format", "json"]
+    )
+    assert result.exit_code == 0
+    zones = json.loads(result.output)
+    assert list(zones) == ["a.com", "b.com"]
+    assert zones["b.com"][1]["name"] == "test"
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+@pytest.mark.parametrize("output_format", ["text", "ndjson"])
+def test_list_output_envvar(kasserver, output_format):
+    """Test that the list command uses the format in KASSERVER_OUTPUT"""
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    result = click.testing.CliRunner().invoke(
+        cli, ["list", "example.com"], env={"KASSERVER_OUTPUT": output_format}
+    )
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert len(lines) == len(TestKasServer.RESPONSE_PARSED) + (output_format == "text")
+    if output_format == "ndjson":
+        assert json.loads(lines[0])["zone"] == "example.com"
+
+
+def test_list_missing_argument():
+    """Test the list command without zones"""
+    result = click.testing.CliRunner().invoke(cli, ["list"])
+    assert result.exit_code == 2
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_list_failed_zone(kasserver):
+    """Test that zones that cannot be listed are reported at the end"""
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    result = click.testing.CliRunner().invoke(
+        cli, ["list", "--format", "csv", "missing.com", "example.com"]
+    )
+    assert result.exit_code == 1
+    rows = list(csv.DictReader(io.StringIO(result.stdout)))
+    assert [row["zone"] for row in rows] == ["example.com", "example.com"]
+    assert "1 of 2 zones could not be listed" in result.stderr
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_list_bind(kasserver, tmp_path):
+    """Test that the BIND output can be read as state file"""
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    result = click.testing.CliRunner().invoke(
+        cli, ["list", "--format", "bind", "example.com"]
+    )
+    assert result.exit_code == 0
+    path = tmp_path / "example.com.zone"
+    path.write_text(result.output)
+    records = zonefile.load(str(path))["example.com"]
+    assert [record["data"] for record in records] == ["1.2.3.4", "www.example.com"]
+
+
 @mock.patch("kasserver.KasServer", autospec=True)
 @pytest.mark.parametrize(
     "command,expected",
@@ -63,7 +156,15 @@ def test_list(kasserver):
             {
                 "method": "delete_dns_record",
                 "params": [RECORD_FQDN, RECORD_TYPE],
-                "args": [RECORD_FQDN, RECORD_TYPE],
+                "args": [RECORD_FQDN, RECORD_TYPE, None],
+            },
+        ),
+        (
+            "remove",
+            {
+                "method": "delete_dns_record",
+                "params": [RECORD_FQDN, RECORD_TYPE, RECORD_VALUE],
+                "args": [RECORD_FQDN, RECORD_TYPE, RECORD_VALUE],
             },
         ),
     ],
@@ -75,3 +176,267 @@ def test_add_remove(kasserver, command, expected):
     getattr(kasserver.return_value, expected["method"]).assert_any_call(
         *expected["args"]
     )
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_add_remove_output(kasserver):
+    """Test printing the results of add and remove as NDJSON"""
+    kasserver.return_value.add_dns_record.return_value = "5"
+    kasserver.return_value.delete_dns_record.return_value = "5"
+    runner = click.testing.CliRunner()
+    results = [
+        json.loads(
+            runner.invoke(
+                cli, [command, "--output", "ndjson", RECORD_FQDN, RECORD_TYPE, "x"]
+            ).stdout
+        )
+        for command in ("add", "remove")
+    ]
+    assert [(r["action"], r["fqdn"], r["record_id"]) for r in results] == [
+        ("add", RECORD_FQDN, "5"),
+        ("delete", RECORD_FQDN, "5"),
+    ]
+
+
+@mock.patch("kasserver.kasserver_dns.daemon.connect")
+def test_add_remove_daemon_error(connect):
+    """Test that errors of the daemon are reported without a traceback"""
+    connect.return_value.add_dns_record.side_effect = daemon.DaemonError("failed")
+    connect.return_value.delete_dns_record.side_effect = daemon.DaemonError("failed")
+    runner = click.testing.CliRunner()
+    for command in ("add", "remove"):
+        result = runner.invoke(cli, [command, RECORD_FQDN, RECORD_TYPE, "x"])
+        assert result.exit_code == 1
+        assert "Error: failed" in result.output
+
+
+BATCH = f"""# comment
+add {RECORD_FQDN} {RECORD_TYPE} {RECORD_VALUE} {RECORD_TTL}
+{{"action": "delete", "fqdn": "{RECORD_FQDN}", "type": "{RECORD_TYPE}"}}
+list example.com
+remove {RECORD_FQDN}
+add {RECORD_FQDN} A 'a b'
+"""
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_batch(kasserver):
+    """Test running operations from stdin on one client"""
+    kasserver.return_value.add_dns_record.return_value = "5"
+    kasserver.return_value.delete_dns_record.return_value = "5"
+    kasserver.return_value.get_dns_records.return_value = TestKasServer.RESPONSE_PARSED
+    result = click.testing.CliRunner().invoke(
+        cli, ["batch", "--continue-on-error", "--output", "ndjson"], input=BATCH
+    )
+    assert result.exit_code == 1
+    assert "1 of 5 operations failed" in result.output
+    kasserver.assert_called_once()
+    assert kasserver.call_args.kwargs["cache_ttl"]
+    results = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [(r["line"], r.get("action"), bool(r["error"])) for r in results] == [
+        (2, "add", False),
+        (3, "delete", False),
+        (4, "list", False),
+        (5, None, True),
+        (6, "add", False),
+    ]
+    assert results[2]["records"] == TestKasServer.RESPONSE_PARSED
+    kasserver.return_value.add_dns_record.assert_has_calls(
+        [
+            mock.call(RECORD_FQDN, RECORD_TYPE, RECORD_VALUE, RECORD_TTL),
+            mock.call(RECORD_FQDN, "A", "a b", "0"),
+        ]
+    )
+    kasserver.return_value.delete_dns_record.assert_called_once_with(
+        RECORD_FQDN, RECORD_TYPE, None
+    )
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_batch_text(kasserver):
+    """Test the text output of a batch and invalid operations"""
+    kasserver.return_value.add_dns_record.return_value = "5"
+    kasserver.return_value.get_dns_records.return_value = TestKasServer.RESPONSE_PARSED
+    operations = f"""list example.com
+add {RECORD_FQDN} {RECORD_TYPE} {RECORD_VALUE}
+[1]
+add {RECORD_FQDN} {RECORD_TYPE}
+"""
+    result = click.testing.CliRunner().invoke(
+        cli, ["batch", "--continue-on-error"], input=operations
+    )
+    assert result.exit_code == 1
+    lines = result.stdout.splitlines()
+    assert lines[0].split() == ["ID", "C", "Zone", "Name", "Type", "Data", "Aux"]
+    assert len(lines) == len(TestKasServer.RESPONSE_PARSED) + 4
+    assert lines[-3:] == [
+        f"2: + {RECORD_FQDN} {RECORD_TYPE} {RECORD_VALUE}",
+        "3: failed: unknown operation '[1]'",
+        "4: failed: wrong number of arguments for add",
+    ]
+    assert "2 of 4 operations failed" in result.output
+    result = click.testing.CliRunner().invoke(
+        cli, ["batch"], input=f"remove {RECORD_FQDN} {RECORD_TYPE}\n"
+    )
+    assert result.exit_code == 0
+    assert result.stdout == f"1: - {RECORD_FQDN} {RECORD_TYPE}\n"
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_batch_stop(kasserver, tmp_path):
+    """Test that a batch stops at the first failed operation"""
+    path = tmp_path / "batch.txt"
+    path.write_text(f"remove {RECORD_FQDN} A\nadd {RECORD_FQDN} A 1.2.3.4\n")
+    kasserver.return_value.delete_dns_record.side_effect = zeep.exceptions.Fault(
+        "record_id_not_found"
+    )
+    result = click.testing.CliRunner().invoke(cli, ["batch", str(path)])
+    assert result.exit_code == 1
+    assert "1: failed: record_id_not_found" in result.stdout
+    assert "1 of 1 operations failed" in result.output
+    kasserver.return_value.add_dns_record.assert_not_called()
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_batch_connection_error(kasserver):
+    """Test that a batch continues after a connection error"""
+    kasserver.return_value.delete_dns_record.side_effect = (
+        requests.exceptions.ConnectionError("connection refused")
+    )
+    kasserver.return_value.add_dns_record.return_value = "5"
+    result = click.testing.CliRunner().invoke(
+        cli,
+        ["batch", "--continue-on-error"],
+        input=f"remove {RECORD_FQDN} A\nadd {RECORD_FQDN} A 1.2.3.4\n",
+    )
+    assert result.exit_code == 1
+    assert result.stdout.splitlines() == [
+        "1: failed: connection refused",
+        f"2: + {RECORD_FQDN} A 1.2.3.4",
+    ]
+    assert "1 of 2 operations failed" in result.output
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_sync(kasserver, tmp_path, dry_run):
+    """Test the sync command"""
+    path = tmp_path / "example.com.zone"
+    path.write_text("www A 1.2.3.4\n")
+    kasserver.return_value.sync_zone.return_value = [
+        {
+            "operation": "update",
+            "name": "www",
+            "type": "A",
+            "data": "1.2.3.4",
+            "aux": "0",
+            "record_id": "1",
+            "previous": "5.6.7.8",
+        }
+    ]
+    args = ["sync", str(path)] + (["--dry-run"] if dry_run else [])
+    result = click.testing.CliRunner().invoke(cli, args)
+    assert result.exit_code == 0
+    assert "~ example.com" in result.output
+    assert kasserver.return_value.execute_plan.called != dry_run
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_sync_unchanged(kasserver, tmp_path):
+    """Test the sync command with an up to date zone"""
+    path = tmp_path / "state.json"
+    path.write_text('{"example.com": []}')
+    kasserver.return_value.sync_zone.return_value = []
+    result = click.testing.CliRunner().invoke(cli, ["sync", str(path)])
+    assert result.exit_code == 0
+    assert not kasserver.return_value.execute_plan.called
+
+
+def test_sync_invalid(tmp_path):
+    """Test the sync command with an invalid state file"""
+    path = tmp_path / "state.json"
+    path.write_text("[]")
+    result = click.testing.CliRunner().invoke(cli, ["sync", str(path)])
+    assert result.exit_code == 1
+
+
+@pytest.fixture(name="cache_home")
+def fixture_cache_home(tmp_path, monkeypatch):
+    """Fixture that keeps the inventory in a temporary directory"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.usefixtures("cache_home")
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_inventory(kasserver):
+    """Test refreshing the inventory and answering from it"""
+    kasserver.return_value.get_domains.return_value = ["a.com", "b.com"]
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    runner = click.testing.CliRunner()
+    result = runner.invoke(cli, ["inventory", "refresh"])
+    assert result.exit_code == 0
+    assert "+ a.com" in result.output
+    assert kasserver.return_value.iter_dns_records.call_count == 2
+
+    result = runner.invoke(cli, ["inventory", "refresh", "a.com", "c.com"])
+    assert result.exit_code == 0
+    assert kasserver.return_value.iter_dns_records.call_count == 3
+
+    kasserver.reset_mock()
+    result = runner.invoke(cli, ["list", "--cached", "--all", "--format", "ndjson"])
+    assert result.exit_code == 0
+    assert len(result.output.splitlines()) == 6
+    result = runner.invoke(cli, ["list", "--cached", "b.com", "d.com"])
+    assert result.exit_code == 1
+    result = runner.invoke(cli, ["inventory", "search", "--zones", "1.2.3.4"])
+    assert result.output.splitlines() == ["a.com", "b.com", "c.com"]
+    result = runner.invoke(cli, ["inventory", "search", "--type", "CNAME", "www.*"])
+    assert result.exit_code == 0
+    assert len(result.output.splitlines()) == 4
+    result = runner.invoke(cli, ["inventory", "changes", "b.com"])
+    assert len(result.output.splitlines()) == 2
+    assert not kasserver.return_value.method_calls
+
+
+@pytest.mark.usefixtures("cache_home")
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_inventory_failed(kasserver):
+    """Test that zones that cannot be fetched are reported"""
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    result = click.testing.CliRunner().invoke(
+        cli, ["inventory", "refresh", "missing.com"]
+    )
+    assert result.exit_code == 1
+    assert "1 of 1 zones failed" in result.output
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_inventory_prune(kasserver, cache_home, caplog):
+    """Test that zones that left the account are dropped"""
+    kasserver.return_value.get_domains.return_value = ["a.com", "b.com"]
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    runner = click.testing.CliRunner()
+    assert runner.invoke(cli, ["inventory", "refresh"]).exit_code == 0
+    kasserver.return_value.get_domains.return_value = ["a.com"]
+    with caplog.at_level(logging.INFO, logger="kasserver"):
+        assert runner.invoke(cli, ["inventory", "refresh"]).exit_code == 0
+    assert "Dropped zone b.com" in caplog.text
+    result = runner.invoke(cli, ["inventory", "search", "--zones", "1.2.3.4"])
+    assert result.output.splitlines() == ["a.com"]
+
+    (cache_home / "kasserver").rename(cache_home / "moved")
+    (cache_home / "kasserver").write_text("")
+    result = runner.invoke(cli, ["inventory", "refresh"])
+    assert result.exit_code == 1
+    assert "Cannot use the inventory" in result.output
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_stats(kasserver):
+    """Test that --stats prints a summary after the command"""
+    kasserver.return_value.iter_dns_records.side_effect = _zone_records
+    result = click.testing.CliRunner().invoke(cli, ["--stats", "list", "example.com"])
+    assert result.exit_code == 0
+    assert result.stdout.startswith("      ID")
+    assert "No KAS API requests" in result.stderr
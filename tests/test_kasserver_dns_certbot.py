@@ -21,13 +21,18 @@
 
 """Tests for kasserver_dns_certbot cli"""
 
+import json
+import os
+
 from unittest import mock
 
 import click
 import click.testing
 import pytest
+import zeep
 
-from kasserver.kasserver_dns_certbot import cli
+from kasserver import daemon
+from kasserver.kasserver_dns_certbot import QUEUE_TTL, cli
 
 
 RECORD_FQDN = "new.example.com"
@@ -35,47 +40,251 @@ RECORD_FQDN_ACME = f"_acme-challenge.{RECORD_FQDN}"
 RECORD_VALUE = "123456"
 RECORD_VALUE_DIFFERENT = "654321"
 RECORD_TYPE = "TXT"
+DOMAINS = "new.example.com,*.example.com,other.example.org"
+
+
+@pytest.fixture(name="kasserver")
+def fixture_kasserver(tmp_path, mocker):
+    """Fixture for a mocked KasServer and an empty challenge queue"""
+    mocker.patch.dict("os.environ", {"XDG_CACHE_HOME": str(tmp_path)})
+    os.environ.pop("CERTBOT_AUTH_OUTPUT", None)
+    kasserver = mocker.patch("kasserver.KasServer", autospec=True)
+    kasserver.return_value.add_dns_record.return_value = "5"
+    kasserver.return_value.delete_dns_record.return_value = "5"
+    return kasserver
+
+
+def test_authentication(kasserver):
+    """Test that the record is added and its id printed for the cleanup"""
+    result = click.testing.CliRunner().invoke(cli, [RECORD_FQDN, RECORD_VALUE])
+    assert result.exit_code == 0
+    assert result.stdout == "5\n"
+    kasserver.return_value.add_dns_record.assert_called_once_with(
+        RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE, replace=False
+    )
+    kasserver.return_value.delete_dns_record.assert_not_called()
 
 
-@mock.patch("kasserver.KasServer", autospec=True)
 @pytest.mark.parametrize(
-    "record,expected",
+    "auth_output,record_id",
     [
+        ("5\n", "5"),
+        ("", None),
+        ("invalid", None),
+        ("{invalid", None),
         (
-            None,
-            [
-                {
-                    "method": "add_dns_record",
-                    "args": [RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE],
-                }
-            ],
-        ),
-        (
-            {"data": RECORD_VALUE},
-            [{"method": "delete_dns_record", "args": [RECORD_FQDN_ACME, RECORD_TYPE]}],
-        ),
-        (
-            {"data": RECORD_VALUE_DIFFERENT},
-            [
-                {
-                    "method": "delete_dns_record",
-                    "args": [RECORD_FQDN_ACME, RECORD_TYPE],
-                },
-                {
-                    "method": "add_dns_record",
-                    "args": [RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE],
-                },
-            ],
+            json.dumps(
+                [
+                    {"fqdn": RECORD_FQDN_ACME, "data": "other", "record_id": "6"},
+                    {"fqdn": RECORD_FQDN_ACME, "data": RECORD_VALUE, "record_id": 7},
+                ]
+            ),
+            "7",
         ),
     ],
 )
-def test_authentication_cleanup(kasserver, record, expected):
-    """Test the authentication and cleanup"""
-    kasserver.return_value.get_dns_record.return_value = record
+def test_cleanup(kasserver, auth_output, record_id):
+    """Test that the record is deleted by the id of the authentication hook"""
+    result = click.testing.CliRunner().invoke(
+        cli, [RECORD_FQDN, RECORD_VALUE], env={"CERTBOT_AUTH_OUTPUT": auth_output}
+    )
+    assert result.exit_code == 0
+    kasserver.return_value.delete_dns_record.assert_called_once_with(
+        RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE, record_id=record_id
+    )
+    kasserver.return_value.add_dns_record.assert_not_called()
+    kasserver.return_value.get_dns_record.assert_not_called()
+
+
+def test_cleanup_flag(kasserver):
+    """Test selecting the cleanup hook explicitly"""
+    result = click.testing.CliRunner().invoke(
+        cli, ["--cleanup", RECORD_FQDN, RECORD_VALUE]
+    )
+    assert result.exit_code == 0
+    kasserver.return_value.delete_dns_record.assert_called_once()
+
+
+def test_batch(kasserver):
+    """Test that challenges are queued, written in a single pass and cleaned up"""
+    kasserver.return_value.add_dns_record.side_effect = ["1", "2", "3"]
+    runner = click.testing.CliRunner()
+    env = {"CERTBOT_ALL_DOMAINS": DOMAINS}
+    fqdns = ["new.example.com", "example.com", "other.example.org"]
+    outputs = []
+    for remaining, fqdn in enumerate(reversed(fqdns)):
+        env["CERTBOT_REMAINING_CHALLENGES"] = str(len(fqdns) - remaining - 1)
+        result = runner.invoke(cli, [fqdn, RECORD_VALUE], env=env)
+        assert result.exit_code == 0
+        outputs.append(result.stdout)
+        if remaining < len(fqdns) - 1:
+            kasserver.assert_not_called()
+    kasserver.assert_called_once_with(
+        cache_ttl=60, shared_pacing=True, domains_ttl=daemon.DOMAINS_TTL
+    )
+    assert kasserver.return_value.add_dns_record.call_args_list == [
+        mock.call(f"_acme-challenge.{fqdn}", RECORD_TYPE, RECORD_VALUE, replace=False)
+        for fqdn in reversed(fqdns)
+    ]
+    assert outputs == ["", "", "3\n"]
+
+    # The ids of the queued challenges are stored for their cleanup hooks
+    for fqdn, output in zip(reversed(fqdns), outputs):
+        env["CERTBOT_AUTH_OUTPUT"] = output
+        assert runner.invoke(cli, [fqdn, RECORD_VALUE], env=env).exit_code == 0
+    assert [
+        call.kwargs["record_id"]
+        for call in kasserver.return_value.delete_dns_record.call_args_list
+    ] == ["1", "2", "3"]
+    kasserver.return_value.get_dns_record.assert_not_called()
+
+
+def test_output_json(kasserver):
+    """Test that the cleanup hook finds the id in the JSON results"""
+    env = {"KASSERVER_OUTPUT": "json"}
+    result = click.testing.CliRunner().invoke(cli, [RECORD_FQDN, RECORD_VALUE], env=env)
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == [
+        {
+            "action": "add",
+            "fqdn": RECORD_FQDN_ACME,
+            "type": RECORD_TYPE,
+            "data": RECORD_VALUE,
+            "record_id": "5",
+        }
+    ]
+    env["CERTBOT_AUTH_OUTPUT"] = result.stdout
+    result = click.testing.CliRunner().invoke(cli, [RECORD_FQDN, RECORD_VALUE], env=env)
+    assert result.exit_code == 0
+    kasserver.return_value.delete_dns_record.assert_called_once_with(
+        RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE, record_id="5"
+    )
+
+
+def test_sibling(kasserver):
+    """Test that the challenges of a domain and its wildcard keep both values"""
+    kasserver.return_value.add_dns_record.side_effect = ["1", "2"]
+    runner = click.testing.CliRunner()
+    env = {"CERTBOT_ALL_DOMAINS": "example.com,*.example.com"}
+    values = [RECORD_VALUE, RECORD_VALUE_DIFFERENT]
+    for remaining, value in zip((1, 0), values):
+        env["CERTBOT_REMAINING_CHALLENGES"] = str(remaining)
+        assert runner.invoke(cli, ["example.com", value], env=env).exit_code == 0
+    env["CERTBOT_AUTH_OUTPUT"] = ""
+    assert runner.invoke(cli, ["example.com", RECORD_VALUE], env=env).exit_code == 0
+    kasserver.return_value.delete_dns_record.assert_called_once_with(
+        "_acme-challenge.example.com", RECORD_TYPE, RECORD_VALUE, record_id="1"
+    )
+
+
+def test_batch_concurrent(kasserver):
+    """Test that runs for other domains keep the queued challenges"""
+    runner = click.testing.CliRunner()
+    env = {
+        "CERTBOT_ALL_DOMAINS": "other.example.com,www.example.com",
+        "CERTBOT_REMAINING_CHALLENGES": "1",
+    }
+    runner.invoke(cli, ["other.example.com", RECORD_VALUE], env=env)
+    other_env = {"CERTBOT_ALL_DOMAINS": RECORD_FQDN}
+    result = runner.invoke(cli, [RECORD_FQDN, RECORD_VALUE], env=other_env)
+    assert result.exit_code == 0
+    kasserver.return_value.add_dns_record.assert_called_once_with(
+        RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE, replace=False
+    )
+    kasserver.return_value.add_dns_record.reset_mock()
+    env["CERTBOT_REMAINING_CHALLENGES"] = "0"
+    result = runner.invoke(cli, ["www.example.com", RECORD_VALUE], env=env)
+    assert result.exit_code == 0
+    assert kasserver.return_value.add_dns_record.call_args_list == [
+        mock.call(f"_acme-challenge.{fqdn}", RECORD_TYPE, RECORD_VALUE, replace=False)
+        for fqdn in ("other.example.com", "www.example.com")
+    ]
+
+
+def test_batch_aborted(kasserver, mocker):
+    """Test that challenges queued by an aborted run are dropped"""
+    runner = click.testing.CliRunner()
+    env = {
+        "CERTBOT_ALL_DOMAINS": "other.example.com,www.example.com",
+        "CERTBOT_REMAINING_CHALLENGES": "1",
+    }
+    runner.invoke(cli, ["other.example.com", "old"], env=env)
+    # The next run for the same domains starts with its first challenge
+    runner.invoke(cli, ["other.example.com", RECORD_VALUE], env=env)
+    env["CERTBOT_REMAINING_CHALLENGES"] = "0"
+    result = runner.invoke(cli, ["www.example.com", RECORD_VALUE], env=env)
+    assert result.exit_code == 0
+    assert kasserver.return_value.add_dns_record.call_args_list == [
+        mock.call(f"_acme-challenge.{fqdn}", RECORD_TYPE, RECORD_VALUE, replace=False)
+        for fqdn in ("other.example.com", "www.example.com")
+    ]
+
+    # Without the domains, challenges expire after QUEUE_TTL
+    kasserver.return_value.add_dns_record.reset_mock()
+    now = mocker.patch("time.time", return_value=1000.0)
+    env = {"CERTBOT_REMAINING_CHALLENGES": "1"}
+    runner.invoke(cli, ["other.example.com", "old"], env=env)
+    now.return_value += QUEUE_TTL
+    env["CERTBOT_REMAINING_CHALLENGES"] = "0"
+    result = runner.invoke(cli, [RECORD_FQDN, RECORD_VALUE], env=env)
+    assert result.exit_code == 0
+    kasserver.return_value.add_dns_record.assert_called_once_with(
+        RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE, replace=False
+    )
+
+
+def test_batch_error(kasserver, tmp_path):
+    """Test that the ids of added records are kept if a run fails"""
+    kasserver.return_value.add_dns_record.side_effect = ["1", RuntimeError("failed")]
+    runner = click.testing.CliRunner()
+    env = {"CERTBOT_ALL_DOMAINS": DOMAINS, "CERTBOT_REMAINING_CHALLENGES": "1"}
+    runner.invoke(cli, ["new.example.com", RECORD_VALUE], env=env)
+    env["CERTBOT_REMAINING_CHALLENGES"] = "0"
+    result = runner.invoke(cli, ["example.com", RECORD_VALUE], env=env)
+    assert isinstance(result.exception, RuntimeError)
+    (path,) = (tmp_path / "kasserver").glob("certbot-challenges-*.json")
+    assert json.loads(path.read_text())["records"] == {
+        f"_acme-challenge.new.example.com {RECORD_VALUE}": "1"
+    }
+
+
+def test_batch_invalid_state(kasserver, tmp_path):
+    """Test that an unreadable state is replaced"""
+    runner = click.testing.CliRunner()
+    env = {"CERTBOT_ALL_DOMAINS": RECORD_FQDN, "CERTBOT_REMAINING_CHALLENGES": "1"}
+    runner.invoke(cli, [RECORD_FQDN, RECORD_VALUE], env=env)
+    (path,) = (tmp_path / "kasserver").glob("certbot-challenges-*.json")
+    path.write_text("{")
+    env["CERTBOT_REMAINING_CHALLENGES"] = "0"
+    result = runner.invoke(cli, [RECORD_FQDN, RECORD_VALUE_DIFFERENT], env=env)
+    assert result.exit_code == 0
+    kasserver.return_value.add_dns_record.assert_called_once_with(
+        RECORD_FQDN_ACME, RECORD_TYPE, RECORD_VALUE_DIFFERENT, replace=False
+    )
+    assert json.loads(path.read_text())["challenges"] == []
+
+
+def test_failed(kasserver):
+    """Test that failed changes are reported"""
+    kasserver.return_value.add_dns_record.side_effect = zeep.exceptions.Fault("failed")
     result = click.testing.CliRunner().invoke(cli, [RECORD_FQDN, RECORD_VALUE])
+    assert result.exit_code == 1
+    assert "1 of 1 changes failed" in result.output
+
+
+def test_propagation(kasserver, mocker):
+    """Test waiting for the propagation of added records"""
+    wait = mocker.patch("kasserver.propagation.wait", autospec=True)
+    result = click.testing.CliRunner().invoke(
+        cli, [RECORD_FQDN, RECORD_VALUE], env={"KASSERVER_PROPAGATION_TIMEOUT": "30"}
+    )
     assert result.exit_code == 0
-    print(kasserver.mock_calls)
-    all(
-        getattr(kasserver.return_value, call["method"]).assert_any_call(*call["args"])
-        for call in expected
+    wait.assert_called_once_with(
+        kasserver.return_value, [(RECORD_FQDN_ACME, RECORD_VALUE)], 30
+    )
+    wait.return_value = False
+    result = click.testing.CliRunner().invoke(
+        cli, [RECORD_FQDN, RECORD_VALUE], env={"KASSERVER_PROPAGATION_TIMEOUT": "30"}
     )
+    assert result.exit_code == 1
+    assert "Records are not served after 30 seconds" in result.output
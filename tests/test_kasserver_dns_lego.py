@@ -45,11 +45,15 @@ RECORD_TTL = "10"
             {
                 "method": "add_dns_record",
                 "args": [RECORD_FQDN, RECORD_TYPE, RECORD_VALUE, RECORD_TTL],
+                "kwargs": {"replace": False},
             },
         ),
         (
             "cleanup",
-            {"method": "delete_dns_record", "args": [RECORD_FQDN, RECORD_TYPE]},
+            {
+                "method": "delete_dns_record",
+                "args": [RECORD_FQDN, RECORD_TYPE, RECORD_VALUE],
+            },
         ),
     ],
 )
@@ -60,5 +64,40 @@ def test_present_cleanup(kasserver, command, expected):
     )
     assert result.exit_code == 0
     getattr(kasserver.return_value, expected["method"]).assert_any_call(
-        *expected["args"]
+        *expected["args"], **expected.get("kwargs", {})
+    )
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_present_output(kasserver):
+    """Test printing the result as CSV"""
+    kasserver.return_value.add_dns_record.return_value = "5"
+    result = click.testing.CliRunner().invoke(
+        cli, ["present", "--output", "csv", RECORD_FQDN, RECORD_VALUE]
+    )
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == [
+        "action,fqdn,type,data,record_id",
+        f"add,{RECORD_FQDN},{RECORD_TYPE},{RECORD_VALUE},5",
+    ]
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_present_propagation(kasserver, mocker):
+    """Test waiting for the propagation of the record"""
+    wait = mocker.patch("kasserver.propagation.wait", autospec=True)
+    result = click.testing.CliRunner().invoke(
+        cli,
+        ["present", "--propagation-timeout", "30", RECORD_FQDN, RECORD_VALUE],
+    )
+    assert result.exit_code == 0
+    wait.assert_called_once_with(
+        kasserver.return_value, [(RECORD_FQDN, RECORD_VALUE)], 30
+    )
+    wait.return_value = False
+    result = click.testing.CliRunner().invoke(
+        cli,
+        ["present", "--propagation-timeout", "30", RECORD_FQDN, RECORD_VALUE],
     )
+    assert result.exit_code == 1
+    assert "Record is not served after 30 seconds" in result.output
@@ -0,0 +1,147 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the request metrics"""
+
+import json
+import logging
+
+import click
+import click.testing
+import pytest
+
+from kasserver import metrics
+
+REQUESTS = [
+    metrics.RequestMetrics("get_dns_settings", wait=1.0, latency=0.25, decode=0.5),
+    metrics.RequestMetrics("get_dns_settings", latency=0.25, retries=2),
+    metrics.RequestMetrics("add_dns_settings", fault="record_already_exists"),
+]
+
+
+@pytest.fixture(name="collector")
+def fixture_collector():
+    """Fixture with a StatsCollector that observed REQUESTS"""
+    collector = metrics.StatsCollector()
+    for request in REQUESTS:
+        collector.observe(request)
+    return collector
+
+
+def test_collector(collector):
+    """Test aggregating metrics per request type"""
+    assert collector.as_dict() == {
+        "add_dns_settings": {
+            "count": 1,
+            "wait": 0.0,
+            "latency": 0.0,
+            "decode": 0.0,
+            "retries": 0,
+            "faults": {"record_already_exists": 1},
+        },
+        "get_dns_settings": {
+            "count": 2,
+            "wait": 1.0,
+            "latency": 0.5,
+            "decode": 0.5,
+            "retries": 2,
+            "faults": {},
+        },
+    }
+    lines = collector.summary().splitlines()
+    assert lines[-1].split() == ["Total", "3", "1.00s", "0.50s", "0.50s", "2", "1"]
+    assert "No KAS API requests" in metrics.StatsCollector().summary()
+
+
+def test_prometheus(collector, tmp_path):
+    """Test exporting metrics as Prometheus textfile"""
+    text = collector.prometheus()
+    assert 'kasserver_requests_total{request="get_dns_settings"} 2\n' in text
+    assert (
+        'kasserver_faults_total{request="add_dns_settings",'
+        'fault="record_already_exists"} 1\n'
+    ) in text
+    path = tmp_path / "kasserver.prom"
+    collector.write(str(path))
+    assert path.read_text() == text
+    path = tmp_path / "stats.json"
+    collector.write(str(path))
+    assert json.loads(path.read_text()) == collector.as_dict()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "kasserver.prom",
+        "stats.json",
+    ]
+
+
+def test_request_metrics():
+    """Test the representation of the metrics and the observer interface"""
+    assert repr(REQUESTS[2]).startswith(
+        "RequestMetrics({'request': 'add_dns_settings', "
+    )
+    with pytest.raises(NotImplementedError):
+        metrics.Observer().observe(REQUESTS[2])
+
+
+def test_log_observer(caplog):
+    """Test logging structured lines"""
+    with caplog.at_level(logging.DEBUG, logger="kasserver.metrics"):
+        metrics.LogObserver().observe(REQUESTS[2])
+    assert caplog.messages == [
+        "request=add_dns_settings wait=0.000 latency=0.000 decode=0.000 "
+        "retries=0 fault=record_already_exists"
+    ]
+    assert caplog.records[0].kas_metrics == REQUESTS[2].as_dict()
+
+
+def test_notify(mocker, caplog):
+    """Test that failing observers do not break requests"""
+    failing = mocker.Mock(spec=metrics.Observer)
+    failing.observe.side_effect = RuntimeError
+    observer = mocker.Mock(spec=metrics.Observer)
+    assert not metrics.observing()
+    metrics.add_observer(failing)
+    metrics.add_observer(observer)
+    try:
+        metrics.notify(REQUESTS[0])
+    finally:
+        metrics.remove_observer(failing)
+        metrics.remove_observer(observer)
+    observer.observe.assert_called_once_with(REQUESTS[0])
+    assert "failed" in caplog.text
+
+
+def test_stats_options(tmp_path):
+    """Test the --stats and --stats-file options"""
+
+    @click.command()
+    @metrics.stats_options
+    def command():
+        metrics.notify(REQUESTS[0])
+
+    path = tmp_path / "stats.json"
+    result = click.testing.CliRunner().invoke(
+        command, ["--stats", "--stats-file", str(path)]
+    )
+    assert result.exit_code == 0
+    assert "get_dns_settings" in result.stderr
+    assert list(json.loads(path.read_text())) == ["get_dns_settings"]
+    assert not metrics.observing()
@@ -0,0 +1,55 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the machine readable output"""
+
+import sys
+
+import pytest
+
+from kasserver import output
+
+RESULTS = [
+    output.result("add", "a.example.com", "TXT", "value", "1"),
+    output.result("delete", "b.example.com", "A", None, None),
+]
+
+
+@pytest.mark.parametrize("output_format", ["json", "ndjson", "csv"])
+def test_write_parse(capsys, output_format):
+    """Test that written results are parsed again"""
+    output.write(output_format, iter(RESULTS))
+    assert output.parse(capsys.readouterr().out) == RESULTS
+
+
+def test_write_text(capsys):
+    """Test that nothing is written for text output"""
+    output.write("text", RESULTS)
+    assert not capsys.readouterr().out
+    assert not output.parse("1234")
+
+
+def test_ndjson_flushed(mocker):
+    """Test that every NDJSON line is flushed right away"""
+    stdout = mocker.patch.object(sys, "stdout")
+    output.write("ndjson", RESULTS)
+    assert stdout.flush.call_count == len(RESULTS)
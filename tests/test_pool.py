@@ -0,0 +1,181 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the client pool of several accounts"""
+
+import os
+import threading
+
+from unittest import mock
+
+import pytest
+
+from kasserver import DnsChange, daemon, pool
+
+ACCOUNTS = [
+    pool.Account("w1", "password1", ("example.com",)),
+    pool.Account("w2", "password2", ("example.org", "sub.example.com")),
+]
+
+
+@pytest.fixture(name="kasserver")
+def fixture_kasserver(mocker):
+    """Fixture for a mocked KasServer class with a client per account"""
+    clients = {}
+
+    def create(credentials, **_kwargs):
+        client = mock.Mock(name=credentials[0])
+        client.apply.side_effect = lambda changes: {
+            "results": [
+                {"change": change, "account": credentials[0]} for change in changes
+            ],
+            "round_trips": len(changes),
+            "wait_time": 1.0,
+        }
+        clients[credentials[0]] = client
+        return client
+
+    kasserver = mocker.patch("kasserver.KasServer", side_effect=create)
+    kasserver.clients = clients
+    return kasserver
+
+
+def test_load_accounts(tmp_path):
+    """Test loading the accounts file"""
+    path = tmp_path / "accounts.ini"
+    path.write_text(
+        "[w1]\npassword = secret%\nzones = example.com, example.org\n"
+        "[w2]\npassword = other\n"
+    )
+    os.chmod(path, 0o600)
+    assert pool.load_accounts(str(path)) == [
+        pool.Account("w1", "secret%", ("example.com", "example.org")),
+        pool.Account("w2", "other", ()),
+    ]
+
+
+def test_load_accounts_netrc(tmp_path, mocker):
+    """Test loading the accounts from the KAS entries of ~/.netrc"""
+    mocker.patch("kasserver._load_netrc").return_value.hosts = {
+        "kasapi.kasserver.com": ("w1", None, "password1"),
+        "w2.kasapi.kasserver.com": ("w2", None, "password2"),
+        "example.com": ("other", None, "password"),
+    }
+    assert pool.load_accounts(str(tmp_path / "missing.ini")) == [
+        pool.Account("w1", "password1", ()),
+        pool.Account("w2", "password2", ()),
+    ]
+
+
+def test_route(kasserver):
+    """Test that names are routed to the account that owns their zone"""
+    kas = pool.KasServerPool(ACCOUNTS, cache_ttl=60, pacer=mock.sentinel.pacer)
+    kas.add_dns_record("www.example.com", "A", "192.0.2.1")
+    kas.delete_dns_record("www.sub.example.com", "A")
+    kas.get_dns_records("example.org")
+    assert kasserver.clients["w1"].add_dns_record.called
+    assert kasserver.clients["w2"].delete_dns_record.called
+    assert kasserver.clients["w2"].get_dns_records.called
+    kasserver.assert_any_call(
+        credentials=("w1", "password1"), zone_names=("example.com",), cache_ttl=60
+    )
+    assert kas.accounts == ["w1", "w2"]
+    assert kas.get_domains() == ["example.com", "example.org", "sub.example.com"]
+    with pytest.raises(pool.AccountNotFoundError):
+        kas.get_dns_records("example.net")
+
+
+def test_fetch_zones(kasserver):
+    """Test that unconfigured zones are fetched once per account"""
+    accounts = [pool.Account("w1", "password1", ()), ACCOUNTS[1]]
+    kas = pool.KasServerPool(accounts)
+    kas.client("w1").get_domains.return_value = ["example.net"]
+    kas.get_dns_record("www.example.net", "A")
+    kas.get_dns_record("example.net", "A")
+    assert kasserver.clients["w1"].get_dns_record.call_count == 2
+    kasserver.clients["w1"].get_domains.assert_called_once_with()
+
+
+def test_single_account(kasserver):
+    """Test that a single account needs no zones"""
+    kas = pool.KasServerPool([pool.Account("w1", "password1", ())])
+    kas.iter_dns_records("example.com")
+    assert not kasserver.clients["w1"].get_domains.called
+
+
+def test_invalidate_cache(kasserver):
+    """Test that caches are invalidated for a name or for all accounts"""
+    kas = pool.KasServerPool(ACCOUNTS)
+    kas.invalidate_cache("www.example.org")
+    kasserver.clients["w2"].invalidate_cache.assert_called_once_with("www.example.org")
+    kas.client("w1")
+    kas.invalidate_cache()
+    for client in kasserver.clients.values():
+        client.invalidate_cache.assert_called_with(None)
+
+
+def test_client_zones(mocker):
+    """Test that the clients split names at the configured zones"""
+    mocker.patch("zeep.Client", autospec=True).return_value.wsdl = mock.sentinel.wsdl
+    kas = pool.KasServerPool(ACCOUNTS)
+    client = kas.client(kas.account("www.sub.example.com"))
+    # pylint: disable=protected-access
+    assert (client._username, client._password) == ("w2", "password2")
+    assert client._split_fqdn("www.sub.example.com") == ("www", "sub.example.com.")
+
+
+def test_apply(kasserver):
+    """Test that the changes of several accounts are applied in parallel"""
+    barrier = threading.Barrier(2, timeout=5)
+    kas = pool.KasServerPool(ACCOUNTS)
+    for username in ("w1", "w2"):
+        apply = kas.client(username).apply.side_effect
+        kas.client(username).apply.side_effect = lambda changes, apply=apply: (
+            barrier.wait() is None or apply(changes)
+        )
+    changes = [
+        DnsChange("add", "a.example.org", "A", "192.0.2.1"),
+        DnsChange("add", "a.example.com", "A", "192.0.2.1"),
+        DnsChange("delete", "b.example.org", "A"),
+    ]
+    result = kas.apply(changes)
+    assert [item["change"] for item in result["results"]] == changes
+    assert [item["account"] for item in result["results"]] == ["w2", "w1", "w2"]
+    assert result["round_trips"] == 3
+    assert kasserver.call_count == 2
+
+
+def test_connect(kasserver, tmp_path, mocker):
+    """Test that the daemon client is a pool if accounts are configured"""
+    path = tmp_path / "accounts.ini"
+    path.write_text("[w1]\npassword = password1\n")
+    mocker.patch.dict("os.environ", {"KASSERVER_ACCOUNTS": str(path)})
+    os.environ.pop("KASSERVER_USER", None)
+    kas = daemon.connect(shared_pacing=True)
+    assert isinstance(kas, pool.KasServerPool)
+    kas.get_dns_records("example.com")
+    kasserver.assert_called_once_with(
+        credentials=("w1", "password1"),
+        zone_names=(),
+        shared_pacing=True,
+        domains_ttl=daemon.DOMAINS_TTL,
+    )
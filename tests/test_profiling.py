@@ -0,0 +1,78 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for profiling the command line utilities"""
+
+import cProfile
+import pstats
+from unittest import mock
+
+import click.testing
+
+import kasserver
+from kasserver import profiling
+from kasserver.kasserver_dns import cli
+
+
+def test_phases(mocker, monkeypatch):
+    """Test that client construction and credentials are found in a profile"""
+    mocker.patch("zeep.Client", autospec=True).return_value.wsdl = mock.sentinel.wsdl
+    monkeypatch.setenv("KASSERVER_USER", "user")
+    profiler = cProfile.Profile()
+    profiler.runcall(kasserver.KasServer)
+    phases = profiling.phases(pstats.Stats(profiler))
+    assert list(phases) == [name for name, _ in profiling.PHASES]
+    assert phases["client"] > 0
+    assert phases["credentials"] > 0
+    assert phases["network"] == 0
+
+
+@mock.patch("kasserver.KasServer", autospec=True)
+def test_profile_option(kasserver_mock, tmp_path, monkeypatch):
+    """Test that --profile writes statistics and prints a summary"""
+    kasserver_mock.return_value.add_dns_record.return_value = "5"
+    path = tmp_path / "add.prof"
+    runner = click.testing.CliRunner()
+    result = runner.invoke(cli, [f"--profile={path}", "add", "a.example.com", "A", "x"])
+    assert result.exit_code == 0
+    assert "credentials" in result.stderr
+    assert "cumulative" in result.stderr
+    assert pstats.Stats(str(path)).total_calls
+
+    monkeypatch.chdir(tmp_path)
+    result = runner.invoke(cli, ["--profile", "-v", "add", "a.example.com", "A", "x"])
+    assert result.exit_code == 0
+    assert (tmp_path / profiling.DEFAULT_PATH).exists()
+
+    path = tmp_path / "env.prof"
+    result = runner.invoke(
+        cli, ["add", "a.example.com", "A", "x"], env={"KASSERVER_PROFILE": str(path)}
+    )
+    assert result.exit_code == 0
+    assert path.exists()
+
+
+def test_profile_command_name():
+    """Test that a command is not taken as the path of the profile"""
+    result = click.testing.CliRunner().invoke(cli, ["--profile", "add"])
+    assert result.exit_code == 2
+    assert "--profile=PATH" in result.output
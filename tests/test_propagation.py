@@ -0,0 +1,257 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the DNS propagation checker"""
+
+import socket
+import socketserver
+import struct
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from kasserver import propagation
+
+FQDN = "_acme-challenge.example.com"
+VALUE = "123456"
+
+
+class _StubHandler(socketserver.BaseRequestHandler):
+    """Answers TXT queries from the records of the server"""
+
+    def handle(self):
+        if isinstance(self.request, tuple):
+            query, sock = self.request
+        else:
+            length = struct.unpack("!H", self.request.recv(2))[0]
+            query = self.request.recv(length)
+        response = self.server.stub.respond(
+            query, tcp=not isinstance(self.request, tuple)
+        )
+        if isinstance(self.request, tuple):
+            sock.sendto(response, self.client_address)
+        else:
+            self.request.sendall(struct.pack("!H", len(response)) + response)
+
+
+class StubDnsServer:
+    """Local nameserver answering over UDP and TCP on the same port"""
+
+    def __init__(self):
+        self.records = {}
+        self.truncate = False
+        self.queries = 0
+        self.udp = socketserver.ThreadingUDPServer(("127.0.0.1", 0), _StubHandler)
+        self.address = self.udp.server_address
+        self.tcp = socketserver.ThreadingTCPServer(self.address, _StubHandler)
+        for server in (self.udp, self.tcp):
+            server.stub = self
+            threading.Thread(
+                target=server.serve_forever, args=(0.05,), daemon=True
+            ).start()
+
+    def close(self):
+        """Stop the server"""
+        for server in (self.udp, self.tcp):
+            server.shutdown()
+            server.server_close()
+
+    def respond(self, query, tcp):
+        """Build the response for a query"""
+        self.queries += 1
+        query_id = struct.unpack_from("!H", query)[0]
+        end = query.index(b"\0", 12) + 5
+        labels, offset = [], 12
+        while query[offset]:
+            labels.append(query[offset + 1 : offset + 1 + query[offset]].decode())
+            offset += 1 + query[offset]
+        values = self.records.get(".".join(labels))
+        if values is None:
+            return struct.pack("!HHHHHH", query_id, 0x8403, 1, 0, 0, 0) + query[12:end]
+        flags = 0x8400 | (0x200 if self.truncate and not tcp else 0)
+        answers = b""
+        if not flags & 0x200:
+            for value in values:
+                rdata = b"".join(
+                    bytes([len(part)]) + part
+                    for part in (
+                        value.encode()[i : i + 255] for i in range(0, len(value), 255)
+                    )
+                )
+                answers += (
+                    b"\xc0\x0c"
+                    + struct.pack(
+                        "!HHIH",
+                        propagation.TYPE_TXT,
+                        propagation.CLASS_IN,
+                        60,
+                        len(rdata),
+                    )
+                    + rdata
+                )
+        count = 0 if flags & 0x200 else len(values)
+        return (
+            struct.pack("!HHHHHH", query_id, flags, 1, count, 0, 0)
+            + query[12:end]
+            + answers
+        )
+
+
+@pytest.fixture(name="stub")
+def fixture_stub():
+    """Fixture that runs a stub nameserver"""
+    stub = StubDnsServer()
+    yield stub
+    stub.close()
+
+
+def test_query(stub):
+    """Test querying TXT records"""
+    stub.records[FQDN] = [VALUE, "x" * 300]
+    assert propagation.query_txt(stub.address, FQDN) == [VALUE, "x" * 300]
+    assert not propagation.query_txt(stub.address, "missing.example.com")
+
+
+def test_query_idna(stub):
+    """Test that internationalized names are queried in their ASCII form"""
+    stub.records["_acme-challenge.xn--bcher-kva.example"] = [VALUE]
+    assert propagation.query_txt(stub.address, "_acme-challenge.Bücher.example.") == [
+        VALUE
+    ]
+
+
+def test_query_truncated(stub):
+    """Test that truncated answers are repeated over TCP"""
+    stub.records[FQDN] = [VALUE]
+    stub.truncate = True
+    assert propagation.query_txt(stub.address, FQDN) == [VALUE]
+    assert stub.queries == 2
+
+
+def test_query_invalid():
+    """Test that invalid responses are rejected"""
+    with pytest.raises(propagation.DnsError):
+        propagation._parse_response(b"\0\1\x80\0", 1)  # pylint: disable=protected-access
+    with pytest.raises(propagation.DnsError, match="Unexpected"):
+        propagation._parse_response(bytes(12), 1)  # pylint: disable=protected-access
+    with pytest.raises(propagation.DnsError, match="rcode 2"):
+        propagation._parse_response(  # pylint: disable=protected-access
+            struct.pack("!HHHHHH", 1, 0x8002, 0, 0, 0, 0), 1
+        )
+    with pytest.raises(propagation.DnsError, match="closed"):
+        propagation._recv_exactly(  # pylint: disable=protected-access
+            mock.Mock(recv=mock.Mock(return_value=b"")), 2
+        )
+
+
+def test_query_other_types():
+    """Test that answers of other types than TXT are skipped"""
+    response = (
+        struct.pack("!HHHHHH", 1, 0x8400, 0, 1, 0, 0)
+        + b"\xc0\x0c"
+        + struct.pack("!HHIH", 1, propagation.CLASS_IN, 60, 4)
+        + bytes(4)
+    )
+    # pylint: disable-next=protected-access
+    assert propagation._parse_response(response, 1) == ([], False)
+
+
+def test_wait(stub):
+    """Test waiting until all nameservers serve the value"""
+    other = StubDnsServer()
+    try:
+        stub.records[FQDN] = [VALUE]
+        threading.Timer(0.2, other.records.__setitem__, (FQDN, ["old", VALUE])).start()
+        start = time.monotonic()
+        pending = propagation.wait_for_txt(
+            [stub.address, other.address], FQDN, VALUE, timeout=5, interval=0.1
+        )
+        assert not pending
+        assert time.monotonic() - start < 2
+    finally:
+        other.close()
+
+
+def test_wait_timeout(stub):
+    """Test that waiting ends at the deadline"""
+    stub.records[FQDN] = ["old"]
+    start = time.monotonic()
+    pending = propagation.wait_for_txt(
+        [stub.address], FQDN, VALUE, timeout=0.3, interval=0.1
+    )
+    assert pending == [stub.address]
+    assert time.monotonic() - start < 1
+
+
+def test_wait_invalid_name(stub):
+    """Test that names that cannot be queried are never served"""
+    fqdn = "a" * 64 + "ü.example.com"
+    pending = propagation.wait_for_txt([stub.address], fqdn, VALUE, timeout=0.1)
+    assert pending == [stub.address]
+    assert not stub.queries
+
+
+def test_wait_no_addresses():
+    """Test that no nameservers are not waited for"""
+    assert not propagation.wait_for_txt([], FQDN, VALUE, timeout=0.1)
+
+
+def test_nameservers(mocker):
+    """Test resolving the NS records of a zone"""
+    getaddrinfo = mocker.patch(
+        "socket.getaddrinfo",
+        side_effect=[
+            [(socket.AF_INET, socket.SOCK_DGRAM, 0, "", ("192.0.2.1", 53))],
+            socket.gaierror("failed"),
+        ],
+    )
+    records = [
+        {"name": "", "type": "NS", "data": "ns5.kasserver.com."},
+        {"name": "", "type": "NS", "data": "ns6.kasserver.com."},
+        {"name": "sub", "type": "NS", "data": "ns.example.org."},
+        {"name": "", "type": "A", "data": "192.0.2.2"},
+    ]
+    assert propagation.nameservers(records) == [("192.0.2.1", 53)]
+    getaddrinfo.assert_any_call("ns5.kasserver.com", 53, type=socket.SOCK_DGRAM)
+
+
+def test_wait_zone(stub, mocker):
+    """Test waiting for the records of a zone"""
+    kas = mocker.Mock()
+    kas.get_dns_records.return_value = [
+        {"name": "", "type": "NS", "data": "localhost."}
+    ]
+    stub.records[FQDN] = [VALUE]
+    mocker.patch("socket.getaddrinfo", return_value=[(0, 0, 0, "", stub.address)])
+    assert propagation.wait(kas, [(FQDN, VALUE)], timeout=1)
+    assert not propagation.wait(kas, [(FQDN, "other")], timeout=0.2)
+    kas.get_dns_records.assert_called_with(FQDN)
+
+
+def test_wait_no_nameservers(mocker, caplog):
+    """Test that records of zones without NS records are not propagated"""
+    kas = mocker.Mock()
+    kas.get_dns_records.return_value = [{"name": "", "type": "A", "data": "192.0.2.1"}]
+    assert not propagation.wait(kas, [(FQDN, VALUE)], timeout=1)
+    assert "No nameservers found" in caplog.text
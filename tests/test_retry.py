@@ -0,0 +1,118 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for retrying failed requests"""
+
+import pytest
+import requests.exceptions
+import zeep.exceptions
+
+from kasserver import retry
+from kasserver.retry import CircuitBreaker, RetryPolicy
+
+FLOOD = zeep.exceptions.Fault("flood_protection")
+
+
+@pytest.mark.parametrize(
+    "exc,expected",
+    [
+        (FLOOD, retry.FLOOD),
+        (zeep.exceptions.Fault("zone_not_found"), None),
+        (requests.exceptions.ConnectionError(), retry.CONNECTION),
+        (requests.exceptions.ConnectTimeout(), retry.TIMEOUT),
+        (requests.exceptions.ReadTimeout(), retry.TIMEOUT),
+        (zeep.exceptions.TransportError(status_code=503), retry.SERVER),
+        (zeep.exceptions.TransportError(status_code=404), None),
+        (ValueError(), None),
+    ],
+)
+def test_classify(exc, expected):
+    """Test the error classes of exceptions"""
+    assert RetryPolicy.classify(exc) == expected
+
+
+def test_backoff(mocker):
+    """Test the exponential backoff and the number of attempts"""
+    mocker.patch("random.uniform", side_effect=lambda low, high: high)
+    attempt = RetryPolicy(attempts=4, backoff=1, max_backoff=3).start()
+    error = requests.exceptions.ConnectionError()
+    delays = [attempt.delay(error) for _ in range(5)]
+    assert delays == [1, 2, 3, 3, None]
+    # Every error class has its own attempts
+    assert attempt.delay(requests.exceptions.ReadTimeout()) == 1
+
+
+def test_flood_delay(mocker):
+    """Test that the delay of the server is honoured"""
+    mocker.patch("random.uniform", return_value=0.1)
+    attempt = RetryPolicy(flood_attempts=1).start()
+    assert attempt.delay(FLOOD, server_delay=2) == pytest.approx(2.1)
+    assert attempt.delay(FLOOD, server_delay=2) is None
+
+
+def test_not_idempotent():
+    """Test that processed requests are not repeated if not idempotent"""
+    attempt = RetryPolicy().start()
+    assert attempt.delay(requests.exceptions.ReadTimeout(), idempotent=False) is None
+    assert attempt.delay(requests.exceptions.ConnectTimeout(), idempotent=False)
+    assert attempt.delay(FLOOD, 1, idempotent=False)
+
+
+def test_deadline(mocker):
+    """Test that waiting beyond the deadline fails"""
+    mocker.patch("time.monotonic", return_value=100.0)
+    attempt = RetryPolicy(deadline=5).start(deadline=110.0)
+    attempt.check(5)
+    with pytest.raises(retry.DeadlineExceeded):
+        attempt.check(6)
+    with pytest.raises(retry.DeadlineExceeded) as err:
+        attempt.delay(FLOOD, server_delay=10)
+    assert err.value.__cause__ is FLOOD
+
+
+def test_circuit_breaker(mocker, caplog):
+    """Test opening, trying and closing the circuit"""
+    monotonic = mocker.patch("time.monotonic", return_value=100.0)
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10)
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check()
+    # Requests that were already running fail without warning again
+    breaker.failure()
+    assert breaker.state == "open"
+    assert caplog.text.count("failing fast") == 1
+    monotonic.return_value = 111.0
+    assert breaker.state == "half-open"
+    breaker.check()
+    with pytest.raises(retry.CircuitOpenError):
+        # Only a single trial request
+        breaker.check()
+    breaker.failure()
+    assert breaker.state == "open"
+    monotonic.return_value = 122.0
+    breaker.check()
+    breaker.success()
+    assert breaker.state == "closed"
+    breaker.check()
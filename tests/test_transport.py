@@ -0,0 +1,136 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the HTTP transport configuration"""
+
+import gzip
+import http.server
+import threading
+
+import pytest
+import requests
+import urllib3
+
+from kasserver import KasServer
+from kasserver.transport import TransportConfig
+
+BODY = b"<response/>"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Respond with a (compressed if accepted) body, keeping the connection"""
+        body = BODY
+        self.send_response(200)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    """Fixture that runs a local HTTP/1.1 server"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+class TestTransportConfig:
+    """Tests for TransportConfig"""
+
+    @staticmethod
+    def test_reuse(server):
+        """Test that requests reuse a pooled keep-alive connection"""
+        config = TransportConfig()
+        session = config.session()
+        for _ in range(3):
+            assert session.get(server).content == BODY
+        assert config.stats.as_dict() == {"requests": 3, "opened": 1, "reused": 2}
+        assert config.stats.latency > 0
+
+    @staticmethod
+    def test_compression(server):
+        """Test that compressed responses are decoded"""
+        response = TransportConfig().session().get(server)
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.content == BODY
+        response = TransportConfig(compression=False).session().get(server)
+        assert "Content-Encoding" not in response.headers
+        assert response.content == BODY
+
+    @staticmethod
+    def test_proxy():
+        """Test that the proxy is used for all schemes"""
+        session = TransportConfig(proxy="http://proxy:3128").session()
+        assert session.proxies == {
+            "http": "http://proxy:3128",
+            "https": "http://proxy:3128",
+        }
+
+    @staticmethod
+    def test_pool():
+        """Test the connection pool settings"""
+        session = TransportConfig(pool_size=8).session()
+        adapter = session.get_adapter("https://kasapi.kasserver.com/")
+        assert adapter._pool_maxsize == 8  # pylint: disable=protected-access
+        assert adapter.max_retries.total == 0
+        # The pool classes of other users of urllib3 are not modified
+        assert (
+            requests.adapters.PoolManager(1).pool_classes_by_scheme
+            == urllib3.poolmanager.pool_classes_by_scheme
+        )
+
+    @staticmethod
+    def test_transport():
+        """Test the timeouts of the zeep transport"""
+        config = TransportConfig(connect_timeout=5, read_timeout=30)
+        transport = config.transport()
+        assert transport.load_timeout == (5, 30)
+        assert transport.operation_timeout == (5, 30)
+        assert transport.session.get_adapter("https://x").stats is config.stats
+
+    @staticmethod
+    def test_kasserver(mocker):
+        """Test that KasServer uses the configured transport"""
+        mocker.patch.dict(
+            "os.environ", {"KASSERVER_USER": "user", "KASSERVER_PASSWORD": "pass"}
+        )
+        client = mocker.patch("zeep.Client", autospec=True)
+        client.return_value.wsdl = mocker.sentinel.wsdl
+        config = TransportConfig(read_timeout=5)
+        kasserver = KasServer(transport=config)
+        assert kasserver.transport_config is config
+        transport = client.call_args.kwargs["transport"]
+        assert transport.operation_timeout == (10, 5)
+        assert kasserver.connection_stats == {"requests": 0, "opened": 0, "reused": 0}
+        assert KasServer().transport_config is not config
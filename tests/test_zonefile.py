@@ -0,0 +1,133 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for zonefile"""
+
+import json
+from unittest import mock
+
+import pytest
+
+from kasserver import zonefile
+
+ZONE = """$ORIGIN example.com.
+$TTL 300
+@ 300 IN SOA ns1.kasserver.com. hostmaster.example.com. (
+        2024010101 ; serial
+        7200 ) ; refresh
+@ 300 IN A 1.2.3.4
+    IN MX 10 mail.example.com.
+www IN CNAME @ ; comment
+ftp IN CNAME www
+_acme-challenge IN TXT "a;b c"
+test.example.com. A 5.6.7.8
+_sip._tcp IN SRV 10 5 5060 sip
+@ NS ns1.kasserver.com.
+
+; apex records
+example.com. TXT ( v=spf1
+    "-all" )
+"""
+
+RECORDS = [
+    {"name": "", "type": "A", "data": "1.2.3.4", "aux": "0"},
+    {"name": "", "type": "MX", "data": "mail.example.com", "aux": "10"},
+    {"name": "www", "type": "CNAME", "data": "example.com", "aux": "0"},
+    {"name": "ftp", "type": "CNAME", "data": "www.example.com", "aux": "0"},
+    {"name": "_acme-challenge", "type": "TXT", "data": "a;b c", "aux": "0"},
+    {"name": "test", "type": "A", "data": "5.6.7.8", "aux": "0"},
+    {"name": "_sip._tcp", "type": "SRV", "data": "5 5060 sip.example.com", "aux": "10"},
+    {"name": "", "type": "NS", "data": "ns1.kasserver.com", "aux": "0"},
+    {"name": "", "type": "TXT", "data": "v=spf1 -all", "aux": "0"},
+]
+
+
+def test_bind(tmp_path):
+    """Test loading a BIND zone file"""
+    path = tmp_path / "example.org.zone"
+    path.write_text(ZONE)
+    assert zonefile.load(str(path)) == {"example.com": RECORDS}
+    path.write_text("@ A 1.2.3.4\n")
+    assert list(zonefile.load(str(path))) == ["example.org"]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "www A\n",
+        'www TXT "unterminated\n',
+        "www.example.org. A 1.2.3.4\n",
+        "@ SOA ns. host. ( 1\n",
+        "@ A 1.2.3.4 )\n",
+    ],
+)
+def test_bind_invalid(line):
+    """Test that invalid BIND zone files are rejected"""
+    with pytest.raises(ValueError):
+        zonefile.parse_bind(line, "example.com")
+
+
+def test_format_bind():
+    """Test that formatted BIND zone files are parsed to the same records"""
+    records = RECORDS + [
+        {"name": "quote", "type": "TXT", "data": 'say "hi" \\o/', "aux": "0"}
+    ]
+    content = zonefile.format_bind("example.com", records)
+    assert content.startswith("$ORIGIN example.com.\n@\tIN\tA\t1.2.3.4\n")
+    assert "@\tIN\tMX\t10 mail.example.com.\n" in content
+    assert "_sip._tcp\tIN\tSRV\t10 5 5060 sip.example.com.\n" in content
+    assert zonefile.parse_bind(content, "example.org") == {"example.com": records}
+
+
+def test_json(tmp_path):
+    """Test loading a JSON state file"""
+    path = tmp_path / "state.txt"
+    path.write_text(
+        json.dumps({"example.com": [{"name": "@", "type": "a", "data": "1.2.3.4"}]})
+    )
+    assert zonefile.load(str(path), "json") == {"example.com": RECORDS[:1]}
+
+
+@pytest.mark.parametrize("content", ["[]", '{"example.com": [{"name": "www"}]}'])
+def test_json_invalid(tmp_path, content):
+    """Test that invalid JSON state files are rejected"""
+    path = tmp_path / "state.json"
+    path.write_text(content)
+    with pytest.raises(ValueError):
+        zonefile.load(str(path))
+
+
+def test_yaml(tmp_path):
+    """Test loading a YAML state file"""
+    pytest.importorskip("yaml")
+    path = tmp_path / "state.yml"
+    path.write_text("example.com:\n  - {type: A, data: 1.2.3.4}\n")
+    assert zonefile.load(str(path)) == {"example.com": RECORDS[:1]}
+
+
+def test_yaml_missing(tmp_path):
+    """Test the error message when PyYAML is not installed"""
+    path = tmp_path / "state.yml"
+    path.write_text("")
+    with mock.patch.dict("sys.modules", {"yaml": None}):
+        with pytest.raises(ValueError, match="PyYAML"):
+            zonefile.load(str(path))
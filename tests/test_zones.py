@@ -0,0 +1,83 @@
+# kasserver - Manage domains hosted on All-Inkl.com through the KAS server API
+# Copyright (c) 2018 Christian Fetzer
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for resolving the zone of domain names"""
+
+import pytest
+
+from kasserver import zones
+
+
+@pytest.mark.parametrize(
+    "fqdn,expected",
+    [
+        ("www.example.com", ("www", "example.com.")),
+        ("www.example.com.", ("www", "example.com.")),
+        ("example.com", ("", "example.com.")),
+        ("com", ("", "com.")),
+        ("a.b.example.co.uk", ("a.b", "example.co.uk.")),
+        ("Www.Example.CO.UK", ("Www", "Example.CO.UK.")),
+        ("a.b.c.ck", ("a", "b.c.ck.")),
+        ("a.www.ck", ("a", "www.ck.")),
+        ("a.b.city.kawasaki.jp", ("a.b", "city.kawasaki.jp.")),
+        ("a.b.c.kawasaki.jp", ("a", "b.c.kawasaki.jp.")),
+        ("www.example.xn--55qx5d.cn", ("www", "example.xn--55qx5d.cn.")),
+        ("www.example.github.io", ("www", "example.github.io.")),
+    ],
+)
+def test_public_suffix(fqdn, expected):
+    """Test falling back to the registrable domain"""
+    assert zones.ZoneResolver().split(fqdn) == expected
+
+
+def test_account_zones():
+    """Test that the longest zone of the account is preferred"""
+    resolver = zones.ZoneResolver(["example.com", "example.co.uk"])
+    assert resolver.split("a.sub.example.com") == ("a.sub", "example.com.")
+    resolver.update(["sub.example.com."])
+    assert resolver.split("a.sub.example.com") == ("a", "sub.example.com.")
+    assert resolver.split("sub.example.com") == ("", "sub.example.com.")
+    assert resolver.split("a.example.org") == ("a", "example.org.")
+
+
+@pytest.mark.parametrize("fqdn", ["", "."])
+def test_invalid(fqdn):
+    """Test that empty names are rejected"""
+    with pytest.raises(ValueError):
+        zones.ZoneResolver().split(fqdn)
+
+
+def test_rules(tmp_path):
+    """Test parsing a public suffix list"""
+    path = tmp_path / "rules.dat"
+    path.write_text(
+        f"// comment\n\nco.uk  trailing text\n*.ck\n!www.ck\n公司.cn\n{'ä' * 64}.cn\n",
+        encoding="utf-8",
+    )
+    trie = zones.public_suffixes(str(path))
+    assert trie is zones.public_suffixes(str(path))
+    assert trie.public_suffix(["a", "example", "co", "uk"]) == 2
+    assert trie.public_suffix(["a", "example", "ck"]) == 2
+    assert trie.public_suffix(["a", "www", "ck"]) == 1
+    assert trie.public_suffix(["example", "de"]) == 1
+    assert trie.public_suffix(["example", "公司", "cn"]) == 2
+    assert trie.public_suffix(["example", "xn--55qx5d", "cn"]) == 2